@@ -8,124 +8,268 @@ import sqlite3
 import json
 import os
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
-import statistics
+from typing import Callable, Collection, Dict, FrozenSet, List, Any, Optional, Tuple
 import re
+import threading
+import time
+from collections import OrderedDict
+from functools import cached_property
 from flask import request
+from authz import current_scope
+from database import DB_PATH, get_db_connection
+from partitions import range_source
+from rollups import get_high_water_mark
+from forecasting import ForecastEngine
+import analytics
+
+# Окно анализа по умолчанию (сутки)
+DEFAULT_WINDOW_DAYS = 30
+
+# Снимок пересоздаётся при новых почасовых агрегатах, но не реже чем раз в SNAPSHOT_TTL секунд:
+# статус датчиков и активность за последний час зависят от времени, а не только от агрегатов
+SNAPSHOT_TTL = 60.0
+
+# Снимки хранятся отдельно для каждого окна и набора датчиков (магазин, выбор, область пользователя);
+# лишние вытесняются по LRU
+MAX_SNAPSHOTS = 128
+
+
+class AnalysisSnapshot:
+    def __init__(self, days: int, high_water_mark: int, frame, today: Dict[str, Any],
+                 active_sensors: int, offline_sensors: List[Dict[str, Any]], high_activity: List[Dict[str, Any]],
+                 sensor_ids: Optional[FrozenSet[int]] = None):
+        """
+        Согласованный срез данных для всех разделов аналитики
+
+        Args:
+            days: Окно анализа (сутки)
+            high_water_mark: Последний visitor_data.id, учтённый в почасовых агрегатах
+            frame: Почасовые агрегаты окна (analytics.load_hourly_frame)
+            today: Датчики, посетители и события за сегодня
+            active_sensors: Число активных датчиков
+            offline_sensors: Активные датчики без данных более 2 часов
+            high_activity: Датчики с необычно большим числом событий за последний час
+            sensor_ids: Датчики среза (None — вся сеть)
+        """
+        self.days = days
+        self.sensor_ids = sensor_ids
+        self.high_water_mark = high_water_mark
+        self.frame = frame
+        self.today = today
+        self.active_sensors = active_sensors
+        self.offline_sensors = offline_sensors
+        self.high_activity = high_activity
+        self.taken_at = datetime.now()
+        self._created = time.monotonic()
+
+    @classmethod
+    def load(cls, conn, days: int, sensor_ids: Optional[FrozenSet[int]] = None) -> 'AnalysisSnapshot':
+        """
+        Чтение среза одной транзакцией: все разделы видят одну версию базы
+
+        С sensor_ids каждый запрос ограничен этими датчиками по индексам sensor_id,
+        поэтому срез магазина читает только его данные.
+        """
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        try:
+            high_water_mark = get_high_water_mark(cursor)
+            frame = analytics.load_hourly_frame(conn, analytics.window_start(days), sensor_ids=sensor_ids)
+
+            condition, params = analytics.sensor_filter('sensor_id', sensor_ids)
+            cursor.execute(f'''
+                SELECT 
+                    COUNT(DISTINCT sensor_id) as total_sensors,
+                    SUM(visitor_count) as total_visitors_today,
+                    SUM(sample_count) as total_events_today
+                FROM hourly_statistics
+                WHERE bucket_start >= DATE('now') AND bucket_start < DATE('now', '+1 day'){condition}
+            ''', params)
+            today = dict(cursor.fetchone())
+
+            sensors_condition, sensors_params = analytics.sensor_filter('s.id', sensor_ids)
+            cursor.execute(f"SELECT COUNT(*) FROM sensors s WHERE s.status = 'active'{sensors_condition}",
+                           sensors_params)
+            active_sensors = cursor.fetchone()[0]
+
+            # Датчики, которые не передавали данные последние 2 часа
+            cursor.execute(f'''
+                SELECT s.id, s.name, s.location, s.last_update
+                FROM sensors s
+                WHERE s.last_update < datetime('now', '-2 hours')
+                AND s.status = 'active'{sensors_condition}
+            ''', sensors_params)
+            offline_sensors = [dict(row) for row in cursor.fetchall()]
+
+            # Необычная активность (слишком много событий за короткий период)
+            source = range_source(cursor, datetime.now() - timedelta(hours=1))
+            cursor.execute(f'''
+                SELECT sensor_id, COUNT(*) as event_count
+                FROM {source}
+                WHERE timestamp > datetime('now', '-1 hour'){condition}
+                GROUP BY sensor_id
+                HAVING COUNT(*) > 50
+            ''', params)
+            high_activity = [dict(row) for row in cursor.fetchall()]
+        finally:
+            conn.rollback()
+
+        return cls(days, high_water_mark, frame, today, active_sensors, offline_sensors, high_activity,
+                   sensor_ids)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() - self._created >= SNAPSHOT_TTL
+
+    @cached_property
+    def patterns(self) -> Dict[str, Any]:
+        """Пиковые часы и дни, статистика датчиков за окно"""
+        if self.frame.empty:
+            return {'error': 'Недостаточно данных для анализа'}
+        return {
+            'peak_hours': analytics.peak_hours(self.frame),
+            'peak_days': analytics.peak_days(self.frame),
+            'sensor_performance': analytics.sensor_summary(self.frame),
+            'total_analyzed_days': self.days,
+            'analysis_timestamp': self.taken_at.isoformat()
+        }
+
+    @cached_property
+    def daily_hours(self):
+        """Суммарный поток по часам сегодня и вчера: (сегодня по часам, сумма вчера)"""
+        today = analytics.to_bucket(self.taken_at.replace(hour=0, minute=0, second=0, microsecond=0))
+        buckets = self.frame['bucket']
+        today_rows = self.frame[(buckets >= today) & (buckets < today + 24)]
+        yesterday_rows = self.frame[(buckets >= today - 24) & (buckets < today)]
+        return today_rows.groupby('hour')['visitors'].sum(), int(yesterday_rows['visitors'].sum())
+
 
 class BelwestAIAgent:
-    def __init__(self, db_path: str = 'visitor_data.db'):
+    def __init__(self, db_path: Optional[str] = None):
         """
         Инициализация AI агента
         
         Args:
-            db_path: Путь к базе данных
+            db_path: Путь к базе данных (по умолчанию общая база приложения)
         """
-        self.db_path = db_path
-        self.insights_cache = {}
+        self.db_path = db_path or DB_PATH
+        # Последний снимок для каждого окна анализа и набора датчиков:
+        # {(days, frozenset датчиков или None для всей сети): AnalysisSnapshot}
+        self.insights_cache = OrderedDict()
         self.last_analysis = None
+        self._lock = threading.Lock()
+        self._loading = {}
+        # Сезонные модели прогноза сети, магазинов и датчиков
+        self.forecaster = ForecastEngine(self.db_path)
         
     def get_db_connection(self):
-        """Получение соединения с базой данных"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """Получение соединения с базой данных из общего пула"""
+        return get_db_connection(self.db_path)
+    
+    def sensors_for(self, store_id: Optional[int] = None,
+                    sensor_ids: Optional[Collection[int]] = None) -> Optional[FrozenSet[int]]:
+        """
+        Набор датчиков для анализа
+
+        Args:
+            store_id: Датчики магазина (из store_sensors)
+            sensor_ids: Явно выбранные датчики; вместе с store_id — их пересечение
+
+        Returns:
+            frozenset id датчиков или None, если ограничений нет (вся сеть)
+        """
+        selected = frozenset(int(sensor_id) for sensor_id in sensor_ids) if sensor_ids is not None else None
+        if store_id is None:
+            return selected
+        conn = self.get_db_connection()
+        try:
+            rows = conn.execute('SELECT sensor_id FROM store_sensors WHERE store_id = ?', (store_id,)).fetchall()
+        finally:
+            conn.close()
+        store_sensors = frozenset(row[0] for row in rows)
+        return store_sensors if selected is None else store_sensors & selected
     
-    def analyze_visitor_patterns(self, days: int = 30) -> Dict[str, Any]:
+    def snapshot(self, days: int = DEFAULT_WINDOW_DAYS,
+                 sensor_ids: Optional[Collection[int]] = None) -> AnalysisSnapshot:
+        """
+        Срез данных за окно days по датчикам sensor_ids (по умолчанию — вся сеть);
+        пересчитывается, только если появились новые агрегаты или срез старше SNAPSHOT_TTL
+        """
+        if sensor_ids is not None:
+            sensor_ids = frozenset(sensor_ids)
+        key = (days, sensor_ids)
+        conn = self.get_db_connection()
+        try:
+            high_water_mark = get_high_water_mark(conn.cursor())
+            with self._lock:
+                snapshot = self.insights_cache.get(key)
+                if snapshot is not None and snapshot.high_water_mark == high_water_mark and not snapshot.expired:
+                    self.insights_cache.move_to_end(key)
+                    return snapshot
+                # Одновременные запросы одного среза ждут один пересчёт, разные срезы считаются параллельно
+                loading = self._loading.setdefault(key, threading.Lock())
+
+            with loading:
+                with self._lock:
+                    snapshot = self.insights_cache.get(key)
+                if snapshot is None or snapshot.high_water_mark != high_water_mark or snapshot.expired:
+                    snapshot = AnalysisSnapshot.load(conn, days, sensor_ids)
+                    with self._lock:
+                        self.insights_cache[key] = snapshot
+                        self.insights_cache.move_to_end(key)
+                        while len(self.insights_cache) > MAX_SNAPSHOTS:
+                            self.insights_cache.popitem(last=False)
+                        self._loading.pop(key, None)
+                    self.last_analysis = snapshot.taken_at
+                return snapshot
+        finally:
+            conn.close()
+    
+    def invalidate(self, *args):
+        """Сброс снимков: следующий запрос перечитает данные"""
+        with self._lock:
+            self.insights_cache.clear()
+    
+    def _scoped(self, snapshot: Optional[AnalysisSnapshot], store_id: Optional[int] = None,
+                sensor_ids: Optional[Collection[int]] = None) -> AnalysisSnapshot:
+        if snapshot is not None:
+            return snapshot
+        return self.snapshot(sensor_ids=self.sensors_for(store_id, sensor_ids))
+    
+    def analyze_visitor_patterns(self, days: int = DEFAULT_WINDOW_DAYS, store_id: Optional[int] = None,
+                                 sensor_ids: Optional[Collection[int]] = None) -> Dict[str, Any]:
         """
         Анализ паттернов посещаемости
         
         Args:
             days: Количество дней для анализа
+            store_id: Только датчики магазина
+            sensor_ids: Только эти датчики
             
         Returns:
             Dict с результатами анализа
         """
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Получаем данные за последние дни
-        cursor.execute('''
-            SELECT 
-                DATE(timestamp) as date,
-                strftime('%H', timestamp) as hour,
-                strftime('%w', timestamp) as day_of_week,
-                SUM(visitor_count) as total_visitors,
-                sensor_id
-            FROM visitor_data
-            WHERE timestamp > datetime('now', '-{} days')
-            GROUP BY DATE(timestamp), strftime('%H', timestamp), sensor_id
-            ORDER BY timestamp
-        '''.format(days))
-        
-        data = cursor.fetchall()
-        conn.close()
-        
-        if not data:
-            return {'error': 'Недостаточно данных для анализа'}
-        
-        # Анализ пиковых часов
-        hourly_traffic = {}
-        daily_traffic = {}
-        sensor_performance = {}
-        
-        for row in data:
-            hour = int(row['hour'])
-            day_of_week = int(row['day_of_week'])
-            visitors = row['total_visitors']
-            sensor_id = row['sensor_id']
-            
-            if hour not in hourly_traffic:
-                hourly_traffic[hour] = []
-            hourly_traffic[hour].append(visitors)
-            
-            if day_of_week not in daily_traffic:
-                daily_traffic[day_of_week] = []
-            daily_traffic[day_of_week].append(visitors)
-            
-            if sensor_id not in sensor_performance:
-                sensor_performance[sensor_id] = []
-            sensor_performance[sensor_id].append(visitors)
-        
-        # Вычисляем статистику
-        peak_hours = []
-        for hour, visitors_list in hourly_traffic.items():
-            avg_visitors = statistics.mean(visitors_list)
-            peak_hours.append({'hour': hour, 'avg_visitors': avg_visitors})
-        
-        peak_hours.sort(key=lambda x: x['avg_visitors'], reverse=True)
-        
-        # Дни недели (0 = воскресенье, 1 = понедельник, ...)
-        day_names = ['Воскресенье', 'Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота']
-        peak_days = []
-        for day, visitors_list in daily_traffic.items():
-            avg_visitors = statistics.mean(visitors_list)
-            peak_days.append({'day': day_names[day], 'avg_visitors': avg_visitors})
-        
-        peak_days.sort(key=lambda x: x['avg_visitors'], reverse=True)
-        
-        return {
-            'peak_hours': peak_hours[:3],
-            'peak_days': peak_days[:3],
-            'sensor_performance': sensor_performance,
-            'total_analyzed_days': days,
-            'analysis_timestamp': datetime.now().isoformat()
-        }
+        return self.snapshot(days, self.sensors_for(store_id, sensor_ids)).patterns
     
-    def generate_recommendations(self, store_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    def generate_recommendations(self, store_id: Optional[int] = None,
+                                 snapshot: Optional[AnalysisSnapshot] = None,
+                                 sensor_ids: Optional[Collection[int]] = None) -> List[Dict[str, Any]]:
         """
         Генерация рекомендаций для улучшения работы
         
         Args:
             store_id: ID магазина для специфических рекомендаций
+            snapshot: Срез данных (по умолчанию — текущий срез магазина или выбранных датчиков)
+            sensor_ids: Только эти датчики
             
         Returns:
             Список рекомендаций
         """
+        snapshot = self._scoped(snapshot, store_id, sensor_ids)
         recommendations = []
         
         # Анализ паттернов посещаемости
-        patterns = self.analyze_visitor_patterns()
+        patterns = snapshot.patterns
         
         if 'error' not in patterns:
             # Рекомендации по пиковым часам
@@ -153,32 +297,22 @@ class BelwestAIAgent:
                 })
         
         # Анализ датчиков
-        sensor_recommendations = self.analyze_sensor_health()
+        sensor_recommendations = self.analyze_sensor_health(snapshot)
         recommendations.extend(sensor_recommendations)
         
         # Рекомендации по безопасности
-        security_recommendations = self.analyze_security_risks()
+        security_recommendations = self.analyze_security_risks(snapshot)
         recommendations.extend(security_recommendations)
         
         return recommendations
     
-    def analyze_sensor_health(self) -> List[Dict[str, Any]]:
-        """Анализ состояния датчиков"""
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Проверяем датчики, которые не передавали данные последние 2 часа
-        cursor.execute('''
-            SELECT s.id, s.name, s.location, s.last_update
-            FROM sensors s
-            WHERE s.last_update < datetime('now', '-2 hours')
-            AND s.status = 'active'
-        ''')
-        
-        offline_sensors = cursor.fetchall()
+    def analyze_sensor_health(self, snapshot: Optional[AnalysisSnapshot] = None, store_id: Optional[int] = None,
+                              sensor_ids: Optional[Collection[int]] = None) -> List[Dict[str, Any]]:
+        """Анализ состояния датчиков (всех или магазина store_id, датчиков sensor_ids)"""
+        snapshot = self._scoped(snapshot, store_id, sensor_ids)
         recommendations = []
         
-        for sensor in offline_sensors:
+        for sensor in snapshot.offline_sensors:
             recommendations.append({
                 'type': 'maintenance',
                 'priority': 'high',
@@ -189,28 +323,15 @@ class BelwestAIAgent:
                 'sensor_id': sensor['id']
             })
         
-        conn.close()
         return recommendations
     
-    def analyze_security_risks(self) -> List[Dict[str, Any]]:
-        """Анализ рисков безопасности"""
+    def analyze_security_risks(self, snapshot: Optional[AnalysisSnapshot] = None, store_id: Optional[int] = None,
+                               sensor_ids: Optional[Collection[int]] = None) -> List[Dict[str, Any]]:
+        """Анализ рисков безопасности (всех или магазина store_id, датчиков sensor_ids)"""
+        snapshot = self._scoped(snapshot, store_id, sensor_ids)
         recommendations = []
         
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Проверяем необычную активность (слишком много посетителей за короткий период)
-        cursor.execute('''
-            SELECT sensor_id, COUNT(*) as event_count
-            FROM visitor_data
-            WHERE timestamp > datetime('now', '-1 hour')
-            GROUP BY sensor_id
-            HAVING COUNT(*) > 50
-        ''')
-        
-        high_activity = cursor.fetchall()
-        
-        for activity in high_activity:
+        for activity in snapshot.high_activity:
             recommendations.append({
                 'type': 'security',
                 'priority': 'medium',
@@ -220,198 +341,388 @@ class BelwestAIAgent:
                 'category': 'security'
             })
         
-        conn.close()
         return recommendations
     
-    def predict_visitor_flow(self, hours_ahead: int = 24) -> Dict[str, Any]:
+    def predict_visitor_flow(self, hours_ahead: int = 24,
+                             snapshot: Optional[AnalysisSnapshot] = None, store_id: Optional[int] = None,
+                             sensor_ids: Optional[Collection[int]] = None) -> Dict[str, Any]:
         """
-        Прогнозирование потока посетителей
+        Прогнозирование потока посетителей по сезонным моделям
         
         Args:
             hours_ahead: Количество часов для прогноза
+            snapshot: Срез данных, чьи датчики прогнозируются (по умолчанию — вся сеть)
+            store_id: Прогноз по модели магазина
+            sensor_ids: Прогноз по моделям этих датчиков
             
         Returns:
-            Dict с прогнозом
+            Dict с прогнозом; у каждого часа интервал lower..upper, в который фактическое
+            значение попадает с вероятностью confidence
         """
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Получаем исторические данные
-        cursor.execute('''
-            SELECT 
-                strftime('%H', timestamp) as hour,
-                strftime('%w', timestamp) as day_of_week,
-                AVG(visitor_count) as avg_visitors
-            FROM visitor_data
-            WHERE timestamp > datetime('now', '-30 days')
-            GROUP BY strftime('%H', timestamp), strftime('%w', timestamp)
-        ''')
-        
-        historical_data = cursor.fetchall()
-        conn.close()
-        
-        # Создаем прогноз на основе исторических данных
-        predictions = []
-        current_time = datetime.now()
-        
-        for i in range(hours_ahead):
-            future_time = current_time + timedelta(hours=i)
-            hour = future_time.hour
-            day_of_week = future_time.weekday() + 1  # Преобразуем в формат SQLite
-            
-            # Ищем соответствующие исторические данные
-            matching_data = [
-                row for row in historical_data 
-                if int(row['hour']) == hour and int(row['day_of_week']) == day_of_week
-            ]
-            
-            if matching_data:
-                predicted_visitors = int(matching_data[0]['avg_visitors'])
-            else:
-                predicted_visitors = 0
-            
-            predictions.append({
-                'datetime': future_time.isoformat(),
-                'hour': hour,
-                'predicted_visitors': predicted_visitors,
-                'confidence': 0.8 if matching_data else 0.3
-            })
+        if store_id is None and sensor_ids is None and snapshot is not None:
+            sensor_ids = snapshot.sensor_ids
+        elif store_id is not None and sensor_ids is not None:
+            sensor_ids, store_id = self.sensors_for(store_id, sensor_ids), None
+        
+        forecaster = self.forecaster
+        forecast = forecaster.forecast(datetime.now(), hours_ahead, store_id, sensor_ids)
+        
+        predictions = [
+            {
+                'datetime': row.datetime.isoformat(),
+                'hour': int(row.hour),
+                'predicted_visitors': int(row.predicted_visitors),
+                'lower': int(row.lower),
+                'upper': int(row.upper),
+                # Без истории для этого часа недели прогноз — 0 без интервала
+                'confidence': forecaster.interval_level if row.has_history else 0.0
+            }
+            for row in forecast.itertuples(index=False)
+        ]
         
         return {
             'predictions': predictions,
             'generated_at': datetime.now().isoformat(),
-            'confidence_note': 'Прогноз основан на исторических данных за последние 30 дней'
+            'confidence_note': f'Сезонная модель (день недели × час с трендом), '
+                               f'интервал {forecaster.interval_level:.0%}; вес наблюдений убывает вдвое '
+                               f'за {forecaster.half_life_weeks:g} недель'
         }
     
-    def generate_insights_report(self) -> Dict[str, Any]:
-        """Генерация полного отчета с аналитикой"""
+    def generate_insights_report(self, snapshot: Optional[AnalysisSnapshot] = None, store_id: Optional[int] = None,
+                                 sensor_ids: Optional[Collection[int]] = None) -> Dict[str, Any]:
+        """Генерация полного отчета с аналитикой (по всей сети или магазину store_id, датчикам sensor_ids)"""
         
-        # Собираем все данные
-        patterns = self.analyze_visitor_patterns()
-        recommendations = self.generate_recommendations()
-        predictions = self.predict_visitor_flow()
-        
-        # Общая статистика
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                COUNT(DISTINCT sensor_id) as total_sensors,
-                SUM(visitor_count) as total_visitors_today,
-                COUNT(*) as total_events_today
-            FROM visitor_data
-            WHERE DATE(timestamp) = DATE('now')
-        ''')
-        
-        today_stats = cursor.fetchone()
-        
-        cursor.execute('''
-            SELECT COUNT(*) as active_sensors
-            FROM sensors
-            WHERE status = 'active'
-        ''')
-        
-        active_sensors = cursor.fetchone()
-        
-        conn.close()
+        # Все разделы строятся по одному срезу данных
+        snapshot = self._scoped(snapshot, store_id, sensor_ids)
+        today = snapshot.today
         
         report = {
             'generated_at': datetime.now().isoformat(),
             'summary': {
-                'total_sensors': today_stats['total_sensors'] if today_stats else 0,
-                'active_sensors': active_sensors['active_sensors'] if active_sensors else 0,
-                'visitors_today': today_stats['total_visitors_today'] if today_stats else 0,
-                'events_today': today_stats['total_events_today'] if today_stats else 0
+                'total_sensors': today['total_sensors'] or 0,
+                'active_sensors': snapshot.active_sensors,
+                'visitors_today': today['total_visitors_today'] or 0,
+                'events_today': today['total_events_today'] or 0
             },
-            'visitor_patterns': patterns,
-            'recommendations': recommendations,
-            'predictions': predictions,
+            'visitor_patterns': snapshot.patterns,
+            'recommendations': self.generate_recommendations(snapshot=snapshot),
+            'predictions': self.predict_visitor_flow(snapshot=snapshot),
             'ai_status': 'active',
-            'last_update': datetime.now().isoformat()
+            'last_update': snapshot.taken_at.isoformat()
         }
         
         return report
     
-    def get_quick_insights(self) -> List[str]:
+    def get_quick_insights(self, snapshot: Optional[AnalysisSnapshot] = None, store_id: Optional[int] = None,
+                           sensor_ids: Optional[Collection[int]] = None) -> List[str]:
         """Получение быстрых инсайтов для отображения в дашборде"""
         insights = []
+        snapshot = self._scoped(snapshot, store_id, sensor_ids)
+        today_hours, yesterday = snapshot.daily_hours
         
         # Анализ данных за сегодня
-        conn = self.get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT 
-                strftime('%H', timestamp) as hour,
-                SUM(visitor_count) as hourly_visitors
-            FROM visitor_data
-            WHERE DATE(timestamp) = DATE('now')
-            GROUP BY strftime('%H', timestamp)
-            ORDER BY hourly_visitors DESC
-            LIMIT 1
-        ''')
-        
-        peak_hour = cursor.fetchone()
-        if peak_hour:
-            insights.append(f"Пиковый час сегодня: {peak_hour['hour']}:00 ({peak_hour['hourly_visitors']} посетителей)")
+        if not today_hours.empty:
+            hour = int(today_hours.idxmax())
+            insights.append(f"Пиковый час сегодня: {hour:02d}:00 ({int(today_hours.max())} посетителей)")
         
         # Проверка датчиков
-        cursor.execute('''
-            SELECT COUNT(*) as offline_count
-            FROM sensors
-            WHERE last_update < datetime('now', '-2 hours')
-            AND status = 'active'
-        ''')
-        
-        offline_sensors = cursor.fetchone()
-        if offline_sensors and offline_sensors['offline_count'] > 0:
-            insights.append(f"⚠️ {offline_sensors['offline_count']} датчиков не отвечают")
+        if snapshot.offline_sensors:
+            insights.append(f"⚠️ {len(snapshot.offline_sensors)} датчиков не отвечают")
         
         # Сравнение с вчерашним днем
-        cursor.execute('''
-            SELECT 
-                (SELECT SUM(visitor_count) FROM visitor_data WHERE DATE(timestamp) = DATE('now')) as today,
-                (SELECT SUM(visitor_count) FROM visitor_data WHERE DATE(timestamp) = DATE('now', '-1 day')) as yesterday
-        ''')
-        
-        comparison = cursor.fetchone()
-        if comparison and comparison['today'] and comparison['yesterday']:
-            change = ((comparison['today'] - comparison['yesterday']) / comparison['yesterday']) * 100
+        today = int(today_hours.sum())
+        if today and yesterday:
+            change = ((today - yesterday) / yesterday) * 100
             trend = "↑" if change > 0 else "↓"
             insights.append(f"Посетители {trend} {abs(change):.1f}% по сравнению с вчера")
         
-        conn.close()
-        
         return insights
 
+# Результаты AI пересчитываются раз в PRECOMPUTE_INTERVAL секунд или досрочно, когда в почасовые
+# агрегаты попало PRECOMPUTE_SAMPLES новых замеров (но не чаще раза в PRECOMPUTE_MIN_INTERVAL)
+PRECOMPUTE_INTERVAL = 300.0
+PRECOMPUTE_MIN_INTERVAL = 30.0
+PRECOMPUTE_SAMPLES = 1000
+
+# Прогноз считается заранее на неделю; запрос на больший горизонт считается сразу
+PRECOMPUTE_HOURS = 168
+
+
+class InsightsScheduler:
+    def __init__(self, agent: BelwestAIAgent, interval: float = PRECOMPUTE_INTERVAL,
+                 min_interval: float = PRECOMPUTE_MIN_INTERVAL, samples_threshold: int = PRECOMPUTE_SAMPLES):
+        """
+        Инициализация фонового пересчёта результатов AI
+
+        Результаты хранятся в таблице ai_results с номером версии, поэтому их видят все процессы
+        приложения, а пересчитывает один.
+
+        Args:
+            agent: AI агент, которым считаются результаты
+            interval: Максимальный интервал между пересчётами (секунды)
+            min_interval: Интервал проверки новых данных и минимальный интервал между пересчётами (секунды)
+            samples_threshold: Сколько новых замеров в агрегатах вызывают досрочный пересчёт
+        """
+        self.agent = agent
+        self.interval = interval
+        self.min_interval = min_interval
+        self.samples_threshold = samples_threshold
+
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._last_refresh = None
+        self._last_high_water_mark = None
+        self._stats = {
+            'refreshes': 0,
+            'version': 0,
+            'last_refresh_at': None,
+            'last_refresh_ms': 0.0,
+            'last_error': None
+        }
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        """Вызов listener(meta) после каждого пересчёта"""
+        self._listeners.append(listener)
+
+    def start(self):
+        """Запуск фонового потока пересчёта"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='ai-scheduler', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def refresh(self) -> Dict[str, Any]:
+        """
+        Пересчёт всех результатов по одному снимку данных и сохранение новой версии
+
+        Returns:
+            Метаданные сохранённой версии
+        """
+        with self._lock:
+            started = time.perf_counter()
+            # Модели прогноза дообучаются на часах, свёрнутых после прошлого пересчёта
+            self.agent.forecaster.update()
+            snapshot = self.agent.snapshot()
+            results = {
+                'insights': self.agent.get_quick_insights(snapshot),
+                'recommendations': self.agent.generate_recommendations(snapshot=snapshot),
+                'report': self.agent.generate_insights_report(snapshot),
+                'predictions': self.agent.predict_visitor_flow(PRECOMPUTE_HOURS, snapshot)
+            }
+            compute_ms = round((time.perf_counter() - started) * 1000, 3)
+            computed_at = datetime.now().isoformat()
+
+            conn = self.agent.get_db_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM ai_results')
+                version = cursor.fetchone()[0]
+                cursor.executemany('''
+                    INSERT INTO ai_results (name, version, payload, computed_at, high_water_mark, compute_ms)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET
+                        version = excluded.version, payload = excluded.payload, computed_at = excluded.computed_at,
+                        high_water_mark = excluded.high_water_mark, compute_ms = excluded.compute_ms
+                ''', [
+                    (name, version, json.dumps(payload, ensure_ascii=False, default=str), computed_at,
+                     snapshot.high_water_mark, compute_ms)
+                    for name, payload in results.items()
+                ])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+            self._last_refresh = time.monotonic()
+            self._last_high_water_mark = snapshot.high_water_mark
+            self._stats['refreshes'] += 1
+            self._stats['version'] = version
+            self._stats['last_refresh_at'] = computed_at
+            self._stats['last_refresh_ms'] = compute_ms
+
+        meta = {'version': version, 'computed_at': computed_at, 'high_water_mark': snapshot.high_water_mark}
+        for listener in self._listeners:
+            try:
+                listener(meta)
+            except Exception as e:
+                print(f"Ошибка обработчика пересчёта AI: {e}")
+        return meta
+
+    def latest(self, name: str) -> Dict[str, Any]:
+        """
+        Последняя сохранённая версия результата name
+
+        Если результатов ещё нет или они старше двух интервалов, они считаются сразу.
+
+        Returns:
+            {'data': результат, 'meta': {version, computed_at, age_seconds, stale}}
+        """
+        row = self._load(name)
+        if row is None or self._age(row) > 2 * self.interval:
+            # Фоновый пересчёт не запущен в этом процессе или не поспевает
+            self.refresh()
+            row = self._load(name)
+
+        age = self._age(row)
+        return {
+            'data': json.loads(row['payload']),
+            'meta': {
+                'version': row['version'],
+                'computed_at': row['computed_at'],
+                'age_seconds': round(age, 1),
+                # Данные могли измениться: результат старше интервала пересчёта
+                'stale': age > self.interval,
+                'compute_ms': row['compute_ms']
+            }
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        return stats
+
+    def _load(self, name: str):
+        conn = self.agent.get_db_connection()
+        try:
+            return conn.execute('''
+                SELECT version, payload, computed_at, compute_ms FROM ai_results WHERE name = ?
+            ''', (name,)).fetchone()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _age(row) -> float:
+        return (datetime.now() - datetime.fromisoformat(row['computed_at'])).total_seconds()
+
+    def _due(self) -> bool:
+        if self._last_refresh is None:
+            return True
+        if time.monotonic() - self._last_refresh >= self.interval:
+            return True
+        conn = self.agent.get_db_connection()
+        try:
+            high_water_mark = get_high_water_mark(conn.cursor())
+        finally:
+            conn.close()
+        return high_water_mark - self._last_high_water_mark >= self.samples_threshold
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if self._due():
+                    self.refresh()
+                self._stats['last_error'] = None
+            except Exception as e:
+                self._stats['last_error'] = str(e)
+                print(f"Ошибка пересчёта результатов AI: {e}")
+            self._stopping.wait(self.min_interval)
+
 # Функция для интеграции с Flask приложением
 def create_ai_endpoints(app):
-    """Создание API endpoints для AI агента"""
+    """
+    Создание API endpoints для AI агента (используются app.ai_agent и app.ai_scheduler, если уже созданы)
+
+    Результаты ограничены областью видимости пользователя; параметры store_id и sensor_ids
+    сужают её до магазина или набора датчиков. Результаты по всей сети отдаются из последней
+    рассчитанной версии, по магазину или датчикам — из отдельного снимка этого набора.
+    meta показывает версию или снимок и их возраст.
+    """
     
-    agent = BelwestAIAgent()
+    agent = getattr(app, 'ai_agent', None)
+    if agent is None:
+        agent = BelwestAIAgent()
+        app.ai_agent = agent
+    
+    scheduler = getattr(app, 'ai_scheduler', None)
+    if scheduler is None:
+        scheduler = InsightsScheduler(agent)
+        app.ai_scheduler = scheduler
+    
+    def request_sensors() -> Tuple[Optional[FrozenSet[int]], Any]:
+        """(датчики запроса или None для всей сети, ответ с ошибкой)"""
+        scope = current_scope()
+        if scope is None:
+            return None, ({'error': 'Не авторизован', 'status': 'error'}, 401)
+        
+        store_id = request.args.get('store_id', type=int)
+        sensor_ids = None
+        if request.args.get('sensor_ids'):
+            try:
+                sensor_ids = frozenset(int(value) for value in request.args['sensor_ids'].split(','))
+            except ValueError:
+                return None, ({'error': 'sensor_ids — список id через запятую', 'status': 'error'}, 400)
+        
+        if not scope['all']:
+            if (store_id is not None and store_id not in scope['store_ids']) or \
+                    (sensor_ids is not None and not sensor_ids <= scope['sensor_ids']):
+                return None, ({'error': 'Недостаточно прав доступа', 'status': 'error'}, 403)
+            if store_id is None and sensor_ids is None:
+                # Без параметров — всё, что видит пользователь
+                sensor_ids = scope['sensor_ids']
+        
+        return agent.sensors_for(store_id, sensor_ids), None
+    
+    def snapshot_meta(snapshot: AnalysisSnapshot) -> Dict[str, Any]:
+        age = (datetime.now() - snapshot.taken_at).total_seconds()
+        return {
+            'computed_at': snapshot.taken_at.isoformat(),
+            'age_seconds': round(age, 1),
+            'stale': False,
+            'high_water_mark': snapshot.high_water_mark,
+            'sensors': len(snapshot.sensor_ids)
+        }
+    
+    def scoped(name: str, compute: Callable[[AnalysisSnapshot], Any]):
+        """Результат name для датчиков запроса: (данные, meta) или ответ с ошибкой"""
+        sensor_ids, error = request_sensors()
+        if error is not None:
+            return None, None, error
+        if sensor_ids is None:
+            result = scheduler.latest(name)
+            return result['data'], result['meta'], None
+        snapshot = agent.snapshot(sensor_ids=sensor_ids)
+        return compute(snapshot), snapshot_meta(snapshot), None
     
     @app.route('/api/ai/insights')
     def get_ai_insights():
         try:
-            insights = agent.get_quick_insights()
-            return {'insights': insights, 'status': 'success'}
+            data, meta, error = scoped('insights', agent.get_quick_insights)
+            if error is not None:
+                return error
+            return {'insights': data, 'meta': meta, 'status': 'success'}
         except Exception as e:
             return {'error': str(e), 'status': 'error'}, 500
     
     @app.route('/api/ai/recommendations')
     def get_ai_recommendations():
         try:
-            recommendations = agent.generate_recommendations()
-            return {'recommendations': recommendations, 'status': 'success'}
+            data, meta, error = scoped('recommendations',
+                                       lambda snapshot: agent.generate_recommendations(snapshot=snapshot))
+            if error is not None:
+                return error
+            return {'recommendations': data, 'meta': meta, 'status': 'success'}
         except Exception as e:
             return {'error': str(e), 'status': 'error'}, 500
     
     @app.route('/api/ai/report')
     def get_ai_report():
         try:
-            report = agent.generate_insights_report()
-            return {'report': report, 'status': 'success'}
+            data, meta, error = scoped('report', agent.generate_insights_report)
+            if error is not None:
+                return error
+            return {'report': data, 'meta': meta, 'status': 'success'}
         except Exception as e:
             return {'error': str(e), 'status': 'error'}, 500
     
@@ -419,8 +730,34 @@ def create_ai_endpoints(app):
     def get_ai_predictions():
         try:
             hours = request.args.get('hours', 24, type=int)
-            predictions = agent.predict_visitor_flow(hours)
-            return {'predictions': predictions, 'status': 'success'}
+            sensor_ids, error = request_sensors()
+            if error is not None:
+                return error
+            if sensor_ids is not None:
+                # Для одного магазина — его собственная модель, иначе сумма моделей датчиков
+                store_id = request.args.get('store_id', type=int)
+                if store_id is not None and not request.args.get('sensor_ids'):
+                    predictions = agent.predict_visitor_flow(hours, store_id=store_id)
+                else:
+                    predictions = agent.predict_visitor_flow(hours, sensor_ids=sensor_ids)
+                meta = {'computed_at': predictions['generated_at'], 'age_seconds': 0.0, 'stale': False,
+                        'sensors': len(sensor_ids)}
+                return {'predictions': predictions, 'meta': meta, 'status': 'success'}
+            
+            result = scheduler.latest('predictions')
+            predictions = result['data']
+            
+            # Часы, которые уже прошли с момента расчёта, отбрасываются
+            current_hour = (datetime.now() - timedelta(hours=1)).isoformat()
+            upcoming = [p for p in predictions['predictions'] if p['datetime'] > current_hour]
+            if len(upcoming) < hours:
+                # Сохранённый прогноз короче запрошенного: считаем заново по моделям
+                predictions = agent.predict_visitor_flow(hours)
+                meta = {'computed_at': predictions['generated_at'], 'age_seconds': 0.0, 'stale': False}
+                return {'predictions': predictions, 'meta': meta, 'status': 'success'}
+            
+            predictions['predictions'] = upcoming[:hours]
+            return {'predictions': predictions, 'meta': result['meta'], 'status': 'success'}
         except Exception as e:
             return {'error': str(e), 'status': 'error'}, 500
 
@@ -0,0 +1,149 @@
+"""
+Аналитическое ядро BELWEST
+Почасовые агрегаты окна анализа загружаются одной типизированной таблицей pandas,
+статистика по часам, дням недели и датчикам считается векторно
+"""
+
+import calendar
+import sqlite3
+from datetime import datetime, timedelta
+from itertools import chain
+from typing import Any, Collection, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+HOURLY_COLUMNS = ['bucket', 'sensor_id', 'hour', 'day_of_week', 'visitors']
+
+# Дни недели в нумерации SQLite strftime('%w'): 0 = воскресенье, 1 = понедельник, ...
+DAY_NAMES = ['Воскресенье', 'Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота']
+
+BUCKET_FORMAT = '%Y-%m-%d %H:00:00'
+
+# Час агрегата — целым числом часов от 1970-01-01 (местное время без пояса):
+# так из базы приходят три целых на строку вместо строки даты, которую пришлось бы разбирать
+if sqlite3.sqlite_version_info >= (3, 38, 0):
+    BUCKET_SQL = 'unixepoch(bucket_start) / 3600'
+else:
+    BUCKET_SQL = "CAST(strftime('%s', bucket_start) AS INTEGER) / 3600"
+
+
+def window_start(days: int, now: Optional[datetime] = None) -> datetime:
+    """Начало окна анализа: days суток назад с точностью до часа"""
+    now = now or datetime.now()
+    return (now - timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+
+
+def to_bucket(moment: datetime) -> int:
+    """Номер часа от 1970-01-01 для момента местного времени (как в колонке bucket)"""
+    return calendar.timegm(moment.timetuple()) // 3600
+
+
+def to_buckets(times: pd.DatetimeIndex) -> np.ndarray:
+    """Номера часов от 1970-01-01 для моментов times"""
+    return (times - pd.Timestamp(1970, 1, 1)) // pd.Timedelta(hours=1)
+
+
+def from_bucket(bucket: int) -> datetime:
+    """Начало часа bucket"""
+    return datetime(1970, 1, 1) + timedelta(hours=int(bucket))
+
+
+def bucket_cells(buckets: np.ndarray) -> np.ndarray:
+    """Ячейка недели каждого часа: день недели (нумерация SQLite) × 24 + час"""
+    return _bucket_weekday(buckets) * 24 + buckets % 24
+
+
+def sensor_filter(column: str, sensor_ids: Optional[Collection[int]]) -> Tuple[str, List[int]]:
+    """
+    Условие AND column IN (...) для выборки по набору датчиков
+
+    Returns:
+        (SQL-условие, параметры); для sensor_ids=None — пустое условие (все датчики)
+    """
+    if sensor_ids is None:
+        return '', []
+    ids = sorted(int(sensor_id) for sensor_id in sensor_ids)
+    return f' AND {column} IN ({", ".join("?" * len(ids))})', ids
+
+
+def load_hourly_frame(conn: sqlite3.Connection, since: datetime, until: Optional[datetime] = None,
+                      sensor_ids: Optional[Collection[int]] = None) -> pd.DataFrame:
+    """
+    Почасовые агрегаты за период одной таблицей
+
+    Args:
+        conn: Соединение с базой
+        since: Начало периода (включительно)
+        until: Конец периода (не включительно), по умолчанию — без ограничения
+        sensor_ids: Только эти датчики (по индексу sensor_id, bucket_start), по умолчанию — все
+
+    Returns:
+        DataFrame с колонками HOURLY_COLUMNS
+    """
+    condition, sensor_params = sensor_filter('sensor_id', sensor_ids)
+    query = f'''
+        SELECT {BUCKET_SQL}, sensor_id, COALESCE(visitor_count, 0)
+        FROM hourly_statistics
+        WHERE bucket_start >= ?{condition}
+    '''
+    params = [since.strftime(BUCKET_FORMAT)] + sensor_params
+    if until is not None:
+        query += ' AND bucket_start < ?'
+        params.append(until.strftime(BUCKET_FORMAT))
+
+    cursor = conn.cursor()
+    # Кортежи вместо sqlite3.Row: массив собирается из них без доступа к полям по имени
+    cursor.row_factory = None
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    values = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * 3)
+    return hourly_frame(values.reshape(-1, 3))
+
+
+def hourly_frame(values: np.ndarray) -> pd.DataFrame:
+    """Типизированная таблица из массива n×3: (час от 1970-01-01, sensor_id, посетители)"""
+    bucket = values[:, 0]
+    return pd.DataFrame({
+        'bucket': bucket,
+        'sensor_id': values[:, 1],
+        'hour': (bucket % 24).astype(np.int8),
+        'day_of_week': _bucket_weekday(bucket).astype(np.int8),
+        'visitors': values[:, 2]
+    })
+
+
+def peak_hours(frame: pd.DataFrame, limit: int = 3) -> List[Dict[str, Any]]:
+    """Часы с наибольшим средним потоком на датчик"""
+    means = frame.groupby('hour')['visitors'].mean().nlargest(limit)
+    return [{'hour': int(hour), 'avg_visitors': float(value)} for hour, value in means.items()]
+
+
+def peak_days(frame: pd.DataFrame, limit: int = 3) -> List[Dict[str, Any]]:
+    """Дни недели с наибольшим средним потоком на датчик"""
+    means = frame.groupby('day_of_week')['visitors'].mean().nlargest(limit)
+    return [{'day': DAY_NAMES[int(day)], 'avg_visitors': float(value)} for day, value in means.items()]
+
+
+def sensor_summary(frame: pd.DataFrame) -> Dict[int, Dict[str, Any]]:
+    """Поток каждого датчика за час: среднее, медиана, 95-й перцентиль, сумма и число часов"""
+    grouped = frame.groupby('sensor_id')['visitors']
+    summary = grouped.agg(['mean', 'sum', 'count'])
+    summary['p50'] = grouped.quantile(0.5)
+    summary['p95'] = grouped.quantile(0.95)
+    return {
+        int(sensor_id): {
+            'avg_visitors': round(float(row['mean']), 2),
+            'p50_visitors': round(float(row['p50']), 2),
+            'p95_visitors': round(float(row['p95']), 2),
+            'total_visitors': int(row['sum']),
+            'hours': int(row['count'])
+        }
+        for sensor_id, row in summary.iterrows()
+    }
+
+
+def _bucket_weekday(buckets: np.ndarray) -> np.ndarray:
+    # 1970-01-01 — четверг (4 в нумерации SQLite)
+    return (buckets // 24 + 4) % 7
+
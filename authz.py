@@ -0,0 +1,207 @@
+"""
+Права доступа BELWEST
+Матрица прав компилируется в битовые маски по ролям: проверка (роль, ресурс, действие) — одна операция AND
+"""
+
+import functools
+from typing import Any, Dict, List, Optional
+
+from flask import g, jsonify, session
+
+from cache import ResultCache
+from database import get_db_connection
+from hierarchy import scope_resolver
+from shared_state import shared_state
+
+RESOURCES = ['users', 'sensors', 'stores', 'reports', 'settings', 'permissions', 'hierarchy']
+ACTIONS = ['read', 'create', 'update', 'delete', 'export']
+
+# Матрица прав доступа по ролям
+PERMISSIONS_MATRIX = {
+    'admin': {
+        'users': ['read', 'create', 'update', 'delete'],
+        'sensors': ['read', 'create', 'update', 'delete'],
+        'stores': ['read', 'create', 'update', 'delete'],
+        'reports': ['read', 'create', 'export'],
+        'settings': ['read', 'update'],
+        'permissions': ['read', 'update'],
+        'hierarchy': ['read', 'create', 'delete']
+    },
+    'manager': {
+        'users': ['read', 'create', 'update', 'delete'],
+        'sensors': ['read', 'create', 'update', 'delete'],
+        'stores': ['read', 'update'],
+        'reports': ['read', 'create', 'export'],
+        'settings': ['read'],
+        'permissions': ['read'],
+        'hierarchy': ['read', 'create', 'delete']
+    },
+    'rd': {
+        'users': ['read'],
+        'sensors': ['read'],
+        'stores': ['read'],
+        'reports': ['read', 'export']
+    },
+    'tu': {
+        'users': ['read'],
+        'sensors': ['read'],
+        'stores': ['read'],
+        'reports': ['read']
+    },
+    'store': {
+        'sensors': ['read'],
+        'reports': ['read']
+    },
+    'user': {
+        'sensors': ['read'],
+        'reports': ['read']
+    }
+}
+
+# Роли, с пользователями которых может работать роль
+ACCESSIBLE_ROLES = {
+    'admin': ['admin', 'manager', 'rd', 'tu', 'store'],
+    'manager': ['rd', 'tu', 'store'],
+    'rd': ['tu', 'store'],
+    'tu': ['store'],
+    'store': []
+}
+
+# Сколько секунд роль другого пользователя берётся из кэша
+ROLE_TTL = 300.0
+
+
+def permission_bit(resource: str, action: str) -> int:
+    """Бит права (ресурс, действие); 0 для неизвестной пары"""
+    if resource not in RESOURCES or action not in ACTIONS:
+        return 0
+    return 1 << (RESOURCES.index(resource) * len(ACTIONS) + ACTIONS.index(action))
+
+
+def compile_matrix(matrix: Dict[str, Dict[str, List[str]]]) -> Dict[str, int]:
+    """Битовая маска прав каждой роли"""
+    compiled = {}
+    for role, resources in matrix.items():
+        bits = 0
+        for resource, actions in resources.items():
+            for action in actions:
+                bits |= permission_bit(resource, action)
+        compiled[role] = bits
+    return compiled
+
+
+ROLE_BITS = compile_matrix(PERMISSIONS_MATRIX)
+PERMISSION_BITS = {(resource, action): permission_bit(resource, action)
+                   for resource in RESOURCES for action in ACTIONS}
+
+
+def allowed(role: Optional[str], resource: str, action: str) -> bool:
+    bit = PERMISSION_BITS.get((resource, action), 0)
+    return bool(bit) and bool(ROLE_BITS.get(role, 0) & bit)
+
+
+def permissions_of(role: Optional[str]) -> Dict[str, List[str]]:
+    """Права роли в виде {ресурс: [действия]}, восстановленные из маски"""
+    bits = ROLE_BITS.get(role, 0)
+    result = {}
+    for resource in RESOURCES:
+        actions = [action for action in ACTIONS if bits & PERMISSION_BITS[(resource, action)]]
+        if actions:
+            result[resource] = actions
+    return result
+
+
+def capabilities_of(role: Optional[str]) -> Dict[str, Any]:
+    """Флаги интерфейса для роли (какие разделы и кнопки показывать)"""
+    return {
+        'can_create_users': allowed(role, 'users', 'create'),
+        'can_edit_users': allowed(role, 'users', 'update'),
+        'can_delete_users': allowed(role, 'users', 'delete'),
+        'can_manage_sensors': allowed(role, 'sensors', 'update'),
+        'can_view_reports': allowed(role, 'reports', 'read'),
+        'can_manage_hierarchy': allowed(role, 'hierarchy', 'create'),
+        'accessible_roles': list(ACCESSIBLE_ROLES.get(role, []))
+    }
+
+
+_roles = ResultCache(max_entries=4096, ttl=ROLE_TTL, min_age=0)
+
+
+def role_of(user_id: int) -> Optional[str]:
+    """Роль пользователя (из кэша; None, если пользователя нет)"""
+    def load():
+        conn = get_db_connection()
+        try:
+            row = conn.execute('SELECT role FROM users WHERE id = ?', (user_id,)).fetchone()
+            return row[0] if row else None
+        finally:
+            conn.close()
+    return _roles.get_or_compute(('role', user_id), load)
+
+
+def invalidate_roles(*args):
+    """Сброс кэша ролей после изменения или удаления пользователей (во всех процессах)"""
+    _roles.invalidate()
+    shared_state.broadcast('roles')
+
+
+shared_state.on('roles', invalidate_roles)
+
+
+def current_principal() -> Optional[Dict[str, Any]]:
+    """
+    Пользователь текущего запроса с маской прав
+
+    Считается один раз на запрос; область видимости загружается при первом обращении
+    к current_scope() и берётся из кэша scope_resolver.
+    """
+    if 'user_id' not in session:
+        return None
+    principal = g.get('principal')
+    if principal is None:
+        role = session.get('role')
+        principal = {
+            'user_id': session.get('user_id'),
+            'role': role,
+            'bits': ROLE_BITS.get(role, 0),
+            'scope': None
+        }
+        g.principal = principal
+    return principal
+
+
+def current_scope() -> Optional[Dict[str, Any]]:
+    """Пользователи, магазины и датчики, видимые текущему пользователю"""
+    principal = current_principal()
+    if principal is None:
+        return None
+    if principal['scope'] is None:
+        principal['scope'] = scope_resolver.resolve(principal['user_id'], principal['role'])
+    return principal['scope']
+
+
+def can(resource: str, action: str) -> bool:
+    """Есть ли у текущего пользователя право (ресурс, действие)"""
+    principal = current_principal()
+    return principal is not None and bool(principal['bits'] & PERMISSION_BITS.get((resource, action), 0))
+
+
+def requires(resource: str, action: str):
+    """
+    Декоратор обработчика: 401 без входа, 403 без права (ресурс, действие)
+
+    Пример:
+        @users.route('/api/users', methods=['POST'])
+        @requires('users', 'create')
+        def create_user(): ...
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            if current_principal() is None:
+                return jsonify({'error': 'Не авторизован'}), 401
+            if not can(resource, action):
+                return jsonify({'error': 'Недостаточно прав доступа'}), 403
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
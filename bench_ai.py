@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест аналитики AI агента BELWEST
+Заполняет копию базы почасовыми агрегатами сети датчиков за год и сравнивает
+прежний расчёт на списках Python с векторным ядром analytics.py
+
+    python bench_ai.py [--sensors 200] [--days 365] [--repeat 3]
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+
+import numpy as np
+
+import analytics
+from ai_agent import BelwestAIAgent
+from database import DB_PATH, connect
+from migrations import run_migrations
+
+# Магазины открыты с 9 до 21, поток растёт к вечеру и в выходные
+OPEN_HOURS = np.arange(9, 22)
+HOUR_PROFILE = np.array([0.4, 0.6, 0.8, 1.0, 1.1, 0.9, 0.8, 0.9, 1.1, 1.3, 1.2, 0.9, 0.5])
+WEEKDAY_PROFILE = np.array([1.4, 0.8, 0.8, 0.9, 0.9, 1.1, 1.5])  # 0 = воскресенье
+
+
+def fill_hourly_statistics(conn, sensors: int, days: int, seed: int = 1, trend: float = 0.0) -> int:
+    """
+    Синтетические почасовые агрегаты: sensors датчиков по 5 на магазин за days суток
+
+    trend — относительный рост потока за год (0.2 — на 20%)
+    """
+    rng = np.random.default_rng(seed)
+    base = rng.uniform(5, 60, sensors)
+    start = datetime.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=days)
+
+    conn.execute('DELETE FROM hourly_statistics')
+    rows = 0
+    for day in range(days + 1):
+        date = start + timedelta(days=day)
+        weekday = (date.weekday() + 1) % 7
+        lam = base[:, None] * HOUR_PROFILE[None, :] * WEEKDAY_PROFILE[weekday] * (1 + trend * day / 365)
+        visitors = rng.poisson(lam)
+        batch = []
+        for column, hour in enumerate(OPEN_HOURS):
+            bucket = date.replace(hour=int(hour))
+            bucket_start = bucket.strftime(analytics.BUCKET_FORMAT)
+            for sensor in range(sensors):
+                batch.append((sensor + 1, sensor // 5 + 1, int(hour), weekday, int(visitors[sensor, column]),
+                              12, bucket.date().isoformat(), bucket_start))
+        conn.executemany('''
+            INSERT INTO hourly_statistics
+                (sensor_id, store_id, hour, day_of_week, visitor_count, sample_count, date, bucket_start)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+        rows += len(batch)
+    conn.commit()
+    return rows
+
+
+def legacy_analyze(conn, days: int) -> dict:
+    """Прежний analyze_visitor_patterns: списки по часам, дням и датчикам и statistics.mean"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT date, hour, day_of_week, visitor_count as total_visitors, sensor_id
+        FROM hourly_statistics
+        WHERE bucket_start >= strftime('%Y-%m-%d %H:00:00', 'now', ?)
+        ORDER BY bucket_start
+    ''', (f'-{int(days)} days',))
+    hourly_traffic, daily_traffic, sensor_performance = {}, {}, {}
+    for row in cursor.fetchall():
+        hourly_traffic.setdefault(int(row['hour']), []).append(row['total_visitors'])
+        daily_traffic.setdefault(int(row['day_of_week']), []).append(row['total_visitors'])
+        sensor_performance.setdefault(row['sensor_id'], []).append(row['total_visitors'])
+    peak_hours = sorted(({'hour': hour, 'avg_visitors': statistics.mean(values)}
+                         for hour, values in hourly_traffic.items()),
+                        key=lambda x: x['avg_visitors'], reverse=True)
+    peak_days = sorted(({'day': analytics.DAY_NAMES[day], 'avg_visitors': statistics.mean(values)}
+                        for day, values in daily_traffic.items()),
+                       key=lambda x: x['avg_visitors'], reverse=True)
+    return {'peak_hours': peak_hours[:3], 'peak_days': peak_days[:3], 'sensor_performance': sensor_performance}
+
+
+def legacy_predict(conn, hours_ahead: int) -> list:
+    """Прежний predict_visitor_flow: просмотр всех строк истории для каждого часа прогноза"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT hour, day_of_week, AVG(hour_visitors) as avg_visitors
+        FROM (
+            SELECT hour, day_of_week, SUM(visitor_count) as hour_visitors
+            FROM hourly_statistics
+            WHERE bucket_start >= strftime('%Y-%m-%d %H:00:00', 'now', '-30 days')
+            GROUP BY bucket_start
+        )
+        GROUP BY hour, day_of_week
+    ''')
+    historical_data = cursor.fetchall()
+    predictions = []
+    current_time = datetime.now()
+    for i in range(hours_ahead):
+        future_time = current_time + timedelta(hours=i)
+        matching = [row for row in historical_data
+                    if int(row['hour']) == future_time.hour and int(row['day_of_week']) == future_time.weekday() + 1]
+        predictions.append(int(matching[0]['avg_visitors']) if matching else 0)
+    return predictions
+
+
+def measure(func: Callable, repeat: int, before: Optional[Callable] = None) -> float:
+    """Медианное время вызова, мс"""
+    timings: List[float] = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def run(sensors: int, days: int, repeat: int):
+    # Агрегаты пишутся в копию базы, рабочая база не меняется
+    workdir = tempfile.mkdtemp(prefix='belwest-bench-ai-')
+    db_path = os.path.join(workdir, 'visitor_data.db')
+    shutil.copy(DB_PATH, db_path)
+    conn = connect(db_path)
+    try:
+        run_migrations(conn)
+        started = time.perf_counter()
+        rows = fill_hourly_statistics(conn, sensors, days)
+        print(f'Датчиков: {sensors}, дней: {days}, почасовых строк: {rows} '
+              f'(заполнение {time.perf_counter() - started:.1f} с)')
+
+        agent = BelwestAIAgent(db_path)
+        # Модели прогноза обучаются заранее: замеры прогноза — вычисление по сохранённым параметрам
+        agent.forecaster.update()
+        cases = [
+            (f'Паттерны за {days} дн.', lambda: legacy_analyze(conn, days),
+             lambda: agent.analyze_visitor_patterns(days)),
+            ('Паттерны за 30 дн.', lambda: legacy_analyze(conn, 30),
+             lambda: agent.analyze_visitor_patterns(30)),
+            ('Прогноз на 24 ч', lambda: legacy_predict(conn, 24),
+             lambda: agent.predict_visitor_flow(24)),
+            ('Прогноз на 168 ч', lambda: legacy_predict(conn, 168),
+             lambda: agent.predict_visitor_flow(168)),
+            # Прежний отчёт дважды считал паттерны и отдельно прогноз, теперь всё строится по одному снимку
+            ('Полный отчёт', lambda: (legacy_analyze(conn, 30), legacy_analyze(conn, 30), legacy_predict(conn, 24)),
+             agent.generate_insights_report)
+        ]
+        print(f'{"Расчёт":<22}{"списки, мс":>14}{"pandas, мс":>14}{"ускорение":>12}')
+        for title, legacy, vectorized in cases:
+            legacy_ms = measure(legacy, repeat)
+            # Снимок агента сбрасывается, чтобы каждый замер читал данные заново
+            vectorized_ms = measure(vectorized, repeat, agent.invalidate)
+            print(f'{title:<22}{legacy_ms:>14.1f}{vectorized_ms:>14.1f}{legacy_ms / vectorized_ms:>11.1f}x')
+    finally:
+        conn.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Сравнение расчётов AI агента на синтетических данных')
+    parser.add_argument('--sensors', type=int, default=200, help='Число датчиков (по 5 на магазин)')
+    parser.add_argument('--days', type=int, default=365, help='Глубина истории (сутки)')
+    parser.add_argument('--repeat', type=int, default=3, help='Повторов каждого замера')
+    args = parser.parse_args()
+
+    run(args.sensors, args.days, args.repeat)
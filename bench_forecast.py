@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Бэктест сезонных моделей прогноза BELWEST
+На копии базы модели сети, магазинов и датчиков обучаются на истории до точки прогноза,
+дообучаются неделя за неделей и на каждой неделе прогнозируют следующие 168 часов.
+Ошибка сравнивается с прежним прогнозом (средний поток того же часа и дня недели за 30 дней)
+
+    python bench_forecast.py [--sensors 50] [--days 180] [--weeks 4] [--trend 0.3] [--live]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from itertools import chain
+
+import numpy as np
+
+import analytics
+import forecasting
+from bench_ai import fill_hourly_statistics
+from database import DB_PATH, connect
+from forecasting import MODEL_KINDS, ForecastEngine
+from migrations import run_migrations
+
+HORIZON_HOURS = 168
+BASELINE_DAYS = 30
+
+
+def load_rows(conn):
+    """Все почасовые агрегаты: (час, датчик, магазин, посетители)"""
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(f'''
+        SELECT {analytics.BUCKET_SQL}, sensor_id, COALESCE(store_id, 0), COALESCE(visitor_count, 0)
+        FROM hourly_statistics
+    ''')
+    rows = cursor.fetchall()
+    values = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * 4).reshape(-1, 4)
+    return values[:, 0], values[:, 1], values[:, 2], values[:, 3]
+
+
+def baseline(keys, buckets, values, since: int, until: int):
+    """Прежний прогноз: средний поток ряда в той же ячейке недели за [since, until)"""
+    mask = (buckets >= since) & (buckets < until)
+    ids = np.unique(keys)
+    codes = np.searchsorted(ids, keys[mask])
+    cells = codes * forecasting.WEEK_CELLS + analytics.bucket_cells(buckets[mask])
+    size = len(ids) * forecasting.WEEK_CELLS
+    sums = np.bincount(cells, weights=values[mask], minlength=size)
+    counts = np.bincount(cells, minlength=size)
+    means = np.divide(sums, counts, out=np.zeros(size), where=counts > 0)
+    return ids, means.reshape(len(ids), forecasting.WEEK_CELLS)
+
+
+def run(sensors: int, days: int, weeks: int, trend: float, live: bool):
+    workdir = tempfile.mkdtemp(prefix='belwest-bench-forecast-')
+    db_path = os.path.join(workdir, 'visitor_data.db')
+    shutil.copy(DB_PATH, db_path)
+    conn = connect(db_path)
+    try:
+        run_migrations(conn)
+        if not live:
+            rows = fill_hourly_statistics(conn, sensors, days, trend=trend)
+            print(f'Датчиков: {sensors}, дней: {days}, рост за год: {trend:.0%}, почасовых строк: {rows}')
+        conn.execute('DELETE FROM forecast_models')
+        conn.execute('DELETE FROM forecast_recent')
+        conn.execute('DELETE FROM rollup_state WHERE name = ?', (forecasting.FORECAST_STATE,))
+        conn.commit()
+
+        buckets, sensor_ids, store_ids, values = load_rows(conn)
+        if not len(buckets):
+            print('Нет почасовых агрегатов для бэктеста')
+            return
+
+        engine = ForecastEngine(db_path, auto_update=False)
+        end = analytics.to_bucket(datetime.now()) - HORIZON_HOURS
+        cutoffs = [end - HORIZON_HOURS * (weeks - 1 - week) for week in range(weeks)]
+        series = {kind: forecasting.series(kind, buckets, sensor_ids, store_ids, values) for kind in MODEL_KINDS}
+        results = {kind: {'abs': 0.0, 'actual': 0.0, 'baseline_abs': 0.0, 'covered': 0, 'hours': 0,
+                          'fit_ms': [], 'predict_ms': 0.0, 'models': 0} for kind in MODEL_KINDS}
+
+        for cutoff in cutoffs:
+            # Первый вызов обучает модели на всей истории до точки прогноза, следующие добавляют неделю
+            update = engine.update(analytics.from_bucket(cutoff) + timedelta(minutes=forecasting.SETTLE_MINUTES))
+            for kind in MODEL_KINDS:
+                result = results[kind]
+                result['fit_ms'].append(update['fit_ms'].get(kind, 0.0))
+                keys, kind_buckets, kind_values = series[kind]
+                base_ids, base_means = baseline(keys, kind_buckets, kind_values,
+                                                cutoff - BASELINE_DAYS * 24, cutoff)
+
+                models = engine.models(kind)
+                result['models'] = len(models)
+                horizon = (kind_buckets >= cutoff) & (kind_buckets < cutoff + HORIZON_HOURS)
+                started = time.perf_counter()
+                for entity_id, model in models.items():
+                    mask = horizon & (keys == entity_id)
+                    actual = kind_values[mask]
+                    mean, deviation, _ = model.predict(kind_buckets[mask])
+                    predicted = np.maximum(mean, 0.0)
+                    lower = np.maximum(predicted - engine.z * deviation, 0.0)
+                    upper = predicted + engine.z * deviation
+
+                    result['abs'] += np.abs(actual - predicted).sum()
+                    result['actual'] += actual.sum()
+                    result['covered'] += int(((actual >= np.floor(lower)) & (actual <= np.ceil(upper))).sum())
+                    result['hours'] += len(actual)
+
+                    position = np.searchsorted(base_ids, entity_id)
+                    if position < len(base_ids) and base_ids[position] == entity_id:
+                        previous = base_means[position][analytics.bucket_cells(kind_buckets[mask])]
+                    else:
+                        previous = np.zeros(len(actual))
+                    result['baseline_abs'] += np.abs(actual - previous).sum()
+                result['predict_ms'] += (time.perf_counter() - started) * 1000
+
+        print(f'Точек прогноза: {weeks}, горизонт {HORIZON_HOURS} ч, интервал {engine.interval_level:.0%}')
+        print(f'{"Модель":<8}{"моделей":>9}{"MAE":>10}{"WAPE":>9}{"WAPE 30 дн.":>13}{"покрытие":>10}'
+              f'{"обучение, мс":>15}{"неделя, мс":>12}{"прогноз, мс":>13}')
+        for kind in MODEL_KINDS:
+            result = results[kind]
+            hours = max(result['hours'], 1)
+            actual = max(result['actual'], 1.0)
+            incremental = result['fit_ms'][1:] or [0.0]
+            print(f'{kind:<8}{result["models"]:>9}{result["abs"] / hours:>10.2f}'
+                  f'{result["abs"] / actual:>9.1%}{result["baseline_abs"] / actual:>13.1%}'
+                  f'{result["covered"] / hours:>10.1%}{result["fit_ms"][0]:>15.1f}'
+                  f'{sum(incremental) / len(incremental):>12.1f}{result["predict_ms"] / weeks:>13.1f}')
+    finally:
+        conn.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Бэктест сезонных моделей прогноза')
+    parser.add_argument('--sensors', type=int, default=50, help='Число датчиков (по 5 на магазин)')
+    parser.add_argument('--days', type=int, default=180, help='Глубина истории (сутки)')
+    parser.add_argument('--weeks', type=int, default=4, help='Число недель бэктеста')
+    parser.add_argument('--trend', type=float, default=0.3, help='Рост потока за год в синтетических данных')
+    parser.add_argument('--live', action='store_true', help='Бэктест на данных рабочей базы (без синтетики)')
+    args = parser.parse_args()
+
+    run(args.sensors, args.days, args.weeks, args.trend, args.live)
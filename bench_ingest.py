@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест приёма данных BELWEST
+Имитирует устройства, каждое держит keep-alive соединение и шлёт замеры на /api/visitor-count;
+выводит запросы в секунду и перцентили задержки
+
+    python bench_ingest.py [--devices 1000] [--requests 20] [--interval 0] [--url http://host:port]
+
+Без --url тест поднимает IngestServer на свободном порту с буфером на копии visitor_data.db.
+С --url можно сравнить с веб-приложением: --url http://127.0.0.1:5000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from database import DB_PATH, connect
+from ingestion import IngestionBuffer
+from ingest_server import IngestServer
+from migrations import run_migrations
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def read_response(reader: asyncio.StreamReader) -> Tuple[int, bool]:
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip().lower()] = value.strip()
+    await reader.readexactly(int(headers.get('content-length', '0')))
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+async def device(index: int, host: str, port: int, requests: int, interval: float,
+                 start: asyncio.Event, latencies: List[float], failures: List[str]):
+    """Одно устройство: соединение, затем requests замеров подряд с паузой interval"""
+    device_id = f'BENCH_{index:05d}'
+    reader = writer = None
+    await start.wait()
+    try:
+        for count in range(1, requests + 1):
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            body = json.dumps({'device_id': device_id, 'count': count, 'status': 'online'}).encode()
+            request = (
+                f'POST /api/visitor-count HTTP/1.1\r\n'
+                f'Host: {host}:{port}\r\n'
+                f'Content-Type: application/json\r\n'
+                f'Content-Length: {len(body)}\r\n'
+                f'\r\n'
+            ).encode('latin-1') + body
+
+            started = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await read_response(reader)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if status != 200:
+                failures.append(str(status))
+            if not keep_alive:
+                writer.close()
+                writer = None
+            if interval:
+                await asyncio.sleep(interval)
+    except (OSError, asyncio.IncompleteReadError) as e:
+        failures.append(type(e).__name__)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def run(devices: int, requests: int, interval: float, url: Optional[str]):
+    server = buffer = None
+    workdir = None
+    if url:
+        parts = urlsplit(url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        # Замеры пишутся в копию базы, рабочая база не меняется
+        workdir = tempfile.mkdtemp(prefix='belwest-bench-')
+        db_path = os.path.join(workdir, 'visitor_data.db')
+        shutil.copy(DB_PATH, db_path)
+        conn = connect(db_path)
+        run_migrations(conn)
+        conn.close()
+
+        buffer = IngestionBuffer(db_path)
+        buffer.start()
+        # Сервер работает в своём потоке и цикле событий, как внутри server.py
+        server = IngestServer(buffer, host='127.0.0.1', port=0, max_connections=devices * 2)
+        server.start()
+        host, port = '127.0.0.1', server.port
+
+    latencies = []
+    failures = []
+    start = asyncio.Event()
+    tasks = [asyncio.ensure_future(device(i, host, port, requests, interval, start, latencies, failures))
+             for i in range(devices)]
+    await asyncio.sleep(0.1)
+
+    started = time.perf_counter()
+    start.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    print(f'Устройств: {devices}, запросов: {len(latencies)}, ошибок: {len(failures)}'
+          + (f' ({", ".join(sorted(set(failures)))})' if failures else ''))
+    print(f'Время: {elapsed:.2f} с, запросов в секунду: {len(latencies) / elapsed:.0f}')
+    print(f'Задержка, мс: p50 {percentile(latencies, 50):.1f}, p95 {percentile(latencies, 95):.1f}, '
+          f'p99 {percentile(latencies, 99):.1f}, max {max(latencies, default=0):.1f}')
+
+    if server is not None:
+        print(f"Пиковое число соединений: {server.stats()['peak_connections']}")
+        server.stop()
+        buffer.stop()
+        stats = buffer.stats()
+        print(f"Записано замеров: {stats['written']}, пакетов: {stats['flushes']}, "
+              f"средняя запись пакета: {stats['avg_flush_latency_ms']} мс")
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Нагрузочный тест приёма данных от датчиков')
+    parser.add_argument('--devices', type=int, default=1000, help='Число одновременных устройств')
+    parser.add_argument('--requests', type=int, default=20, help='Замеров от каждого устройства')
+    parser.add_argument('--interval', type=float, default=0.0, help='Пауза между замерами устройства (с)')
+    parser.add_argument('--url', help='Адрес уже запущенного сервера вместо встроенного')
+    args = parser.parse_args()
+
+    # Каждое устройство — отдельное соединение, а без --url ещё и сокет сервера
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.devices * 2 + 100:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.devices * 2 + 100), hard))
+
+    asyncio.run(run(args.devices, args.requests, args.interval, args.url))
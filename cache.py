@@ -0,0 +1,103 @@
+"""
+Кэш результатов API BELWEST
+Хранит готовые ответы по ключу с TTL и вытеснением давно неиспользуемых (LRU)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 256, ttl: float = 30.0, min_age: float = 5.0):
+        """
+        Инициализация кэша
+
+        Args:
+            max_entries: Максимальное число ключей, лишние вытесняются по LRU
+            ttl: Максимальный возраст результата (секунды)
+            min_age: Сколько секунд результат отдаётся даже после сброса кэша новыми данными;
+                     при непрерывной записи замеров один расчёт обслуживает всех клиентов окна
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_age = min_age
+
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'evictions': 0
+        }
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """
+        Результат из кэша или расчёт при промахе
+
+        Одновременные промахи по одному ключу ждут единственный расчёт.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and self._is_fresh(entry):
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[0]
+
+                event = self._pending.get(key)
+                if event is None:
+                    event = threading.Event()
+                    self._pending[key] = event
+                    generation = self._generation
+                    self._stats['misses'] += 1
+                    break
+
+            # Ключ уже считается в другом потоке — ждём его результат
+            event.wait()
+
+        try:
+            value = compute()
+        except Exception:
+            with self._lock:
+                self._pending.pop(key, None)
+            event.set()
+            raise
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic(), generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+            self._pending.pop(key, None)
+        event.set()
+        return value
+
+    def invalidate(self, *args):
+        """Сброс кэша после записи новых данных; подходит как слушатель записи замеров"""
+        with self._lock:
+            self._generation += 1
+            self._stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        requests = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / requests, 3) if requests else 0.0
+        return stats
+
+    def _is_fresh(self, entry) -> bool:
+        age = time.monotonic() - entry[1]
+        if age >= self.ttl:
+            return False
+        return entry[2] == self._generation or age < self.min_age
@@ -0,0 +1,223 @@
+"""
+Общий доступ к базе данных BELWEST
+Пул соединений SQLite в режиме WAL с настроенными PRAGMA
+"""
+
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+# Путь к базе данных
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'visitor_data.db')
+
+# Настройки пула и соединений
+POOL_SIZE = 16
+POOL_TIMEOUT = 30.0
+BUSY_TIMEOUT_MS = 5000
+CACHE_SIZE_KB = 32768
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+def connect(db_path: Optional[str] = None) -> sqlite3.Connection:
+    """
+    Открытие соединения с настройками приложения
+
+    Args:
+        db_path: Путь к базе данных (по умолчанию DB_PATH)
+
+    Returns:
+        Соединение с row_factory = sqlite3.Row
+    """
+    conn = sqlite3.connect(db_path or DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+
+    # WAL: читатели не блокируют запись замеров, а запись не блокирует читателей
+    conn.execute('PRAGMA journal_mode=WAL').fetchone()
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+
+class PooledConnection:
+    """
+    Соединение из пула: close() возвращает его в пул вместо закрытия
+
+    В блоке with фиксирует транзакцию при успехе, откатывает при ошибке
+    и возвращает соединение в пул.
+    """
+
+    def __init__(self, pool: 'ConnectionPool', conn: sqlite3.Connection):
+        self._pool = pool
+        self._conn = conn
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool._release(conn)
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name in ('_conn', '_pool'):
+            raise AttributeError(name)
+        if self._conn is None:
+            raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        finally:
+            self.close()
+        return False
+
+    def __del__(self):
+        # Соединение, которое обработчик забыл закрыть, всё равно возвращается в пул
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    def __init__(self, db_path: str, max_size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT):
+        """
+        Инициализация пула соединений
+
+        Args:
+            db_path: Путь к базе данных
+            max_size: Максимальное число одновременно открытых соединений
+            timeout: Время ожидания свободного соединения (секунды)
+        """
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._opened = 0
+        self._acquired = 0
+
+    def acquire(self) -> PooledConnection:
+        """Получение соединения из пула (новое открывается, только если свободных нет)"""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError('database connection pool exhausted')
+
+        try:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+                self._acquired += 1
+            if conn is None:
+                conn = connect(self.db_path)
+                with self._lock:
+                    self._opened += 1
+        except Exception:
+            self._slots.release()
+            raise
+
+        return PooledConnection(self, conn)
+
+    def _release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                self._idle.append(conn)
+        except sqlite3.Error:
+            # Повреждённое соединение не возвращаем в пул
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+        finally:
+            self._slots.release()
+
+    def close_all(self):
+        """Закрытие всех свободных соединений"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'opened': self._opened,
+                'idle': len(self._idle),
+                'in_use': self._opened - len(self._idle),
+                'acquired_total': self._acquired
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_pool(db_path: Optional[str] = None) -> ConnectionPool:
+    """Пул соединений для указанной базы (один на процесс)"""
+    db_path = os.path.abspath(db_path or DB_PATH)
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = ConnectionPool(db_path)
+                _pools[db_path] = pool
+    return pool
+
+
+def close_pools():
+    """
+    Закрытие свободных соединений всех пулов
+
+    Вызывается перед fork: соединения SQLite нельзя использовать в дочернем процессе.
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close_all()
+
+
+def get_db_connection(db_path: Optional[str] = None) -> PooledConnection:
+    """Соединение из пула; conn.close() возвращает его обратно"""
+    return get_pool(db_path).acquire()
+
+
+@contextmanager
+def db_connection(db_path: Optional[str] = None):
+    """
+    Соединение на время запроса: фиксация при успехе, откат при ошибке
+
+    Вложенные вызовы в том же потоке получают то же соединение.
+    """
+    outer = getattr(_local, 'conn', None)
+    if outer is not None:
+        yield outer
+        return
+
+    with get_db_connection(db_path) as conn:
+        _local.conn = conn
+        try:
+            yield conn
+        finally:
+            _local.conn = None
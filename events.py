@@ -0,0 +1,448 @@
+"""
+Поток событий BELWEST
+Приращения по датчикам и магазинам из пути приёма данных рассылаются подписчикам (Server-Sent Events)
+с учётом области видимости; медленный подписчик не задерживает запись и других подписчиков
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from database import get_db_connection
+from hierarchy import scope_resolver
+from sensor_registry import registry
+from shared_state import shared_state
+
+# Сколько несведённых событий ждёт одного подписчика, прежде чем ему будет отправлен resync
+EVENT_QUEUE_SIZE = 256
+MAX_SUBSCRIBERS = 200
+
+# Каждый поток событий занимает поток веб-процесса до отключения клиента; под потоки событий
+# отдаётся не больше этой доли потоков, остальные обслуживают обычные запросы
+SUBSCRIBER_THREAD_SHARE = 0.5
+
+# Комментарий-пинг держит соединение открытым через прокси (секунды)
+HEARTBEAT_INTERVAL = 15.0
+# Через сколько секунд клиенту переподключаться после обрыва (миллисекунды, поле retry)
+RECONNECT_DELAY_MS = 5000
+
+# Датчик без замеров дольше OFFLINE_AFTER секунд считается отключившимся
+OFFLINE_AFTER = 300.0
+OFFLINE_CHECK_INTERVAL = 30.0
+
+ONLINE_STATUSES = ('online', 'active')
+
+
+def subscriber_limit(threads: int) -> int:
+    """Предел подписчиков для процесса с threads потоками обработки запросов"""
+    return max(1, int(threads * SUBSCRIBER_THREAD_SHARE))
+
+
+def format_event(event_id: int, event_type: str, data: Dict[str, Any]) -> str:
+    """Событие в формате text/event-stream"""
+    payload = json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+    return f'id: {event_id}\nevent: {event_type}\ndata: {payload}\n\n'
+
+
+def parse_time(value: Any) -> Optional[datetime]:
+    if isinstance(value, datetime):
+        return value
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+class Subscription:
+    def __init__(self, user_id: Optional[int], role: Optional[str], max_pending: int = EVENT_QUEUE_SIZE):
+        """
+        Очередь событий одного клиента
+
+        События с одним ключом (датчик, магазин) сводятся в одно: приращения складываются,
+        состояние берётся последнее. Если клиент не успевает забирать даже сведённые события,
+        очередь сбрасывается и клиенту уходит resync — он перечитывает данные целиком.
+        """
+        self.user_id = user_id
+        self.role = role
+        self.max_pending = max_pending
+        self.connected_at = datetime.now().isoformat()
+        self.delivered = 0
+        self.dropped = 0
+
+        self._pending = OrderedDict()
+        self._overflowed = False
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def push(self, event: Dict[str, Any]):
+        with self._condition:
+            if self._closed:
+                return
+            if self._overflowed:
+                self.dropped += 1
+                return
+
+            key = event['key']
+            previous = self._pending.pop(key, None)
+            if previous is not None:
+                event = merge_events(previous, event)
+            elif len(self._pending) >= self.max_pending:
+                self.dropped += len(self._pending) + 1
+                self._pending.clear()
+                self._overflowed = True
+                self._condition.notify()
+                return
+            self._pending[key] = event
+            self._condition.notify()
+
+    def next(self, timeout: float) -> Optional[List[Dict[str, Any]]]:
+        """
+        Все накопившиеся события (ждёт не дольше timeout)
+
+        Returns:
+            Список событий ([] по таймауту) или None, если подписка закрыта
+        """
+        with self._condition:
+            if not self._pending and not self._overflowed and not self._closed:
+                self._condition.wait(timeout)
+            if self._closed:
+                return None
+            if self._overflowed:
+                self._overflowed = False
+                return [{'type': 'resync', 'key': ('resync',), 'data': {'reason': 'overflow'}}]
+            events = list(self._pending.values())
+            self._pending.clear()
+            self.delivered += len(events)
+            return events
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._pending.clear()
+            self._condition.notify()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+
+def merge_events(previous: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Сведение двух событий с одним ключом"""
+    data = dict(event['data'])
+    if 'visitors' in data:
+        data['visitors'] += previous['data'].get('visitors', 0)
+    if 'previous_status' in data:
+        data['previous_status'] = previous['data'].get('previous_status')
+    merged = dict(event)
+    merged['data'] = data
+    return merged
+
+
+class EventBroker:
+    def __init__(self, db_path: Optional[str] = None, queue_size: int = EVENT_QUEUE_SIZE,
+                 max_subscribers: int = MAX_SUBSCRIBERS, offline_after: float = OFFLINE_AFTER,
+                 check_interval: float = OFFLINE_CHECK_INTERVAL):
+        """
+        Инициализация рассылки событий
+
+        Args:
+            db_path: Путь к базе данных (по умолчанию общая база приложения)
+            queue_size: Предел несведённых событий одного подписчика
+            max_subscribers: Максимальное число одновременных подключений
+            offline_after: Через сколько секунд без замеров датчик считается отключившимся
+            check_interval: Как часто проверять датчики без замеров (секунды)
+        """
+        self.db_path = db_path
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.offline_after = offline_after
+        self.check_interval = check_interval
+
+        self._subscribers = []
+        self._statuses = None
+        self._store_of = None
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+        self._stopping = threading.Event()
+        self._thread = None
+        self._stats = {
+            'published': 0,
+            'offline_transitions': 0,
+            'rejected_subscribers': 0,
+            'last_publish_at': None
+        }
+
+    def start(self):
+        """Запуск фоновой проверки датчиков, переставших присылать замеры"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        # Статусы запоминаются до первых замеров, чтобы первая же смена статуса попала в поток
+        with self._lock:
+            self._load_statuses()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='event-broker', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout)
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, []
+        for subscription in subscribers:
+            subscription.close()
+
+    def subscribe(self, user_id: Optional[int], role: Optional[str]) -> Optional[Subscription]:
+        """Новая подписка; None, если подключений уже слишком много"""
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                self._stats['rejected_subscribers'] += 1
+                return None
+            subscription = Subscription(user_id, role, self.queue_size)
+            self._subscribers.append(subscription)
+            return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.close()
+        with self._lock:
+            if subscription in self._subscribers:
+                self._subscribers.remove(subscription)
+
+    def stream(self, subscription: Subscription, heartbeat: float = HEARTBEAT_INTERVAL) -> Iterator[str]:
+        """Тело ответа text/event-stream; подписка снимается, когда клиент отключается"""
+        try:
+            yield f'retry: {RECONNECT_DELAY_MS}\n\n'
+            yield format_event(self._next_id(), 'ready', {'connected_at': subscription.connected_at})
+            while True:
+                events = subscription.next(heartbeat)
+                if events is None:
+                    break
+                if not events:
+                    yield ': ping\n\n'
+                    continue
+                yield ''.join(format_event(self._next_id(), event['type'], event['data']) for event in events)
+        finally:
+            self.unsubscribe(subscription)
+
+    def on_write(self, samples: List[Dict[str, Any]], sensor_ids: Dict[str, int]):
+        """Слушатель записи замеров: приращения по датчикам и магазинам и смены статуса"""
+        visitors = {}
+        for sample in samples:
+            sensor_id = sensor_ids[sample['device_id']]
+            visitors[sensor_id] = visitors.get(sensor_id, 0) + sample.get('visitor_delta', 0)
+
+        store_of = self._stores()
+        now = datetime.now().isoformat()
+        events = []
+        store_visitors = {}
+
+        with self._lock:
+            statuses = self._load_statuses()
+            for sensor_id, delta in visitors.items():
+                state = registry.get(sensor_id)
+                if state is None:
+                    continue
+                store_id = store_of.get(sensor_id)
+                events.append(self._sensor_event(state, store_id, delta))
+                if store_id is not None:
+                    store_visitors[store_id] = store_visitors.get(store_id, 0) + delta
+
+                previous = statuses.get(sensor_id)
+                if previous != state['status']:
+                    statuses[sensor_id] = state['status']
+                    events.append(self._status_event(sensor_id, store_id, previous, state['status'], 'sample'))
+
+        for store_id, delta in store_visitors.items():
+            events.append({
+                'type': 'store',
+                'key': ('store', store_id),
+                'sensor_id': None,
+                'store_id': store_id,
+                'data': {'store_id': store_id, 'visitors': delta, 'updated_at': now}
+            })
+
+        self.publish(events)
+        # Подписчики других процессов получат те же события через журнал изменений
+        if events:
+            shared_state.broadcast('events', events)
+
+    def apply_remote(self, events: List[Dict[str, Any]]):
+        """
+        События, записанные другим процессом: обновление реестра и статусов и рассылка своим подписчикам
+        """
+        unknown = False
+        with self._lock:
+            statuses = self._load_statuses()
+            for event in events:
+                event['key'] = tuple(event['key'])
+                data = event['data']
+                if event['type'] == 'sensor':
+                    if registry.get(data['id']) is None:
+                        unknown = True
+                    registry.record(data['id'], data['status'], data['visitor_count'], data['last_update'])
+                elif event['type'] == 'status':
+                    statuses[data['id']] = data['status']
+
+        if unknown:
+            # Датчик зарегистрирован другим процессом
+            conn = get_db_connection(self.db_path)
+            try:
+                registry.load(conn)
+            finally:
+                conn.close()
+
+        self.publish(events)
+
+    def check_offline(self, now: Optional[datetime] = None) -> int:
+        """
+        Перевод в offline датчиков, от которых давно не было замеров
+
+        Returns:
+            Число датчиков, перешедших в offline
+        """
+        now = now or datetime.now()
+        store_of = self._stores()
+        events = []
+
+        with self._lock:
+            statuses = self._load_statuses()
+            for state in registry.snapshot():
+                if statuses.get(state['id']) not in ONLINE_STATUSES or not self._is_stale(state, now):
+                    continue
+                previous = statuses[state['id']]
+                statuses[state['id']] = 'offline'
+                events.append(self._status_event(state['id'], store_of.get(state['id']), previous,
+                                                 'offline', 'timeout'))
+
+        self._stats['offline_transitions'] += len(events)
+        self.publish(events)
+        return len(events)
+
+    def publish(self, events: List[Dict[str, Any]]):
+        """
+        Рассылка событий подписчикам, которым видны их датчик или магазин
+
+        События без датчика и магазина относятся ко всей сети и уходят всем подписчикам.
+        """
+        if not events:
+            return
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            scope = scope_resolver.resolve(subscription.user_id, subscription.role)
+            for event in events:
+                if scope['all'] or event['sensor_id'] in scope['sensor_ids'] \
+                        or event['store_id'] in scope['store_ids'] \
+                        or (event['sensor_id'] is None and event['store_id'] is None):
+                    subscription.push(event)
+
+        self._stats['published'] += len(events)
+        self._stats['last_publish_at'] = datetime.now().isoformat()
+
+    def announce(self, event_type: str, data: Dict[str, Any]):
+        """Событие для всей сети, в том числе для подписчиков других процессов"""
+        events = [{'type': event_type, 'key': (event_type,), 'sensor_id': None, 'store_id': None, 'data': data}]
+        self.publish(events)
+        shared_state.broadcast('events', events)
+
+    def invalidate_stores(self, *args):
+        """Сброс привязки датчиков к магазинам; подходит как слушатель scope_resolver"""
+        self._store_of = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        stats = dict(self._stats)
+        stats['subscribers'] = len(subscribers)
+        stats['pending'] = sum(subscription.pending for subscription in subscribers)
+        stats['dropped'] = sum(subscription.dropped for subscription in subscribers)
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        return stats
+
+    def _next_id(self) -> int:
+        with self._lock:
+            self._sequence += 1
+            return self._sequence
+
+    def _load_statuses(self) -> Dict[int, str]:
+        # Вызывается под self._lock; датчики, молчащие дольше offline_after, сразу считаются offline
+        if self._statuses is None:
+            now = datetime.now()
+            self._statuses = {
+                state['id']: 'offline' if state['status'] in ONLINE_STATUSES and self._is_stale(state, now)
+                else state['status']
+                for state in registry.snapshot()
+            }
+        return self._statuses
+
+    def _is_stale(self, state: Dict[str, Any], now: datetime) -> bool:
+        last_update = parse_time(state['last_update'])
+        return last_update is not None and (now - last_update).total_seconds() > self.offline_after
+
+    def _stores(self) -> Dict[int, int]:
+        store_of = self._store_of
+        if store_of is None:
+            # Датчик относится к одному магазину, как и в почасовых агрегатах
+            conn = get_db_connection(self.db_path)
+            try:
+                rows = conn.execute('''
+                    SELECT sensor_id, MIN(store_id) FROM store_sensors GROUP BY sensor_id
+                ''').fetchall()
+            finally:
+                conn.close()
+            store_of = {row[0]: row[1] for row in rows}
+            self._store_of = store_of
+        return store_of
+
+    @staticmethod
+    def _sensor_event(state: Dict[str, Any], store_id: Optional[int], delta: int) -> Dict[str, Any]:
+        return {
+            'type': 'sensor',
+            'key': ('sensor', state['id']),
+            'sensor_id': state['id'],
+            'store_id': store_id,
+            'data': {
+                'id': state['id'],
+                'name': state['name'],
+                'store_id': store_id,
+                'status': state['status'],
+                'visitor_count': state['visitor_count'],
+                'visitors': delta,
+                'last_update': state['last_update']
+            }
+        }
+
+    @staticmethod
+    def _status_event(sensor_id: int, store_id: Optional[int], previous: Optional[str],
+                      status: str, reason: str) -> Dict[str, Any]:
+        return {
+            'type': 'status',
+            'key': ('status', sensor_id),
+            'sensor_id': sensor_id,
+            'store_id': store_id,
+            'data': {
+                'id': sensor_id,
+                'store_id': store_id,
+                'status': status,
+                'previous_status': previous,
+                'reason': reason,
+                'changed_at': datetime.now().isoformat()
+            }
+        }
+
+    def _run(self):
+        while not self._stopping.wait(self.check_interval):
+            try:
+                self.check_offline()
+            except Exception as e:
+                print(f"Ошибка проверки датчиков без замеров: {e}")
+
+
+# Общая рассылка событий процесса
+event_broker = EventBroker()
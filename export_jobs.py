@@ -0,0 +1,410 @@
+"""
+Фоновые задания выгрузки BELWEST
+Выгрузки выполняются пулом потоков, состояние заданий хранится в таблице export_jobs общей базы,
+поэтому прогресс, скачивание и удаление доступны из любого процесса приложения.
+Результаты лежат в каталоге спула с ограничением по суммарному размеру
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from database import connect, get_db_connection
+from exports import (STREAM_FORMATS, TEXT_FORMATS, check_format, count_export_rows, export_filename,
+                     iter_export_rows, resolve_sensor_ids, stream_text, write_export_file)
+
+# Каталог результатов, число одновременных выгрузок в процессе и предел размера спула
+EXPORT_SPOOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'export_spool')
+EXPORT_WORKERS = 2
+EXPORT_SPOOL_MAX_BYTES = 512 * 1024 * 1024
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+# Файлы без задания старше этого возраста (секунды) считаются брошенными и удаляются
+ORPHAN_FILE_AGE = 24 * 3600
+
+# Завершённые задания без результата (ошибка, удаление, вытеснение) хранятся столько секунд
+JOB_HISTORY_AGE = 7 * 24 * 3600
+
+JOB_COLUMNS = ('id, job_key, owner, params, status, requests, rows_written, total_rows, bytes_written, '
+               'filename, path, error, runner_pid, created_at, started_at, finished_at, last_access')
+
+
+class ExportJobManager:
+    def __init__(self, spool_dir: str = EXPORT_SPOOL_DIR, max_workers: int = EXPORT_WORKERS,
+                 max_spool_bytes: int = EXPORT_SPOOL_MAX_BYTES, db_path: Optional[str] = None):
+        """
+        Инициализация очереди выгрузок
+
+        Args:
+            spool_dir: Каталог для готовых файлов (управляется только менеджерами заданий)
+            max_workers: Максимальное число одновременно выполняемых выгрузок в процессе
+            max_spool_bytes: Предел суммарного размера файлов спула; старые результаты вытесняются
+            db_path: Путь к базе данных (по умолчанию общая база приложения)
+        """
+        self.spool_dir = spool_dir
+        self.max_workers = max_workers
+        self.max_spool_bytes = max_spool_bytes
+        self.db_path = db_path
+
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, data_format: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+               sensor_ids: Optional[List[int]] = None, store_ids: Optional[List[int]] = None,
+               owner: Optional[int] = None, visible_sensor_ids: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+        """
+        Постановка выгрузки в очередь
+
+        Одинаковый запрос того же пользователя, который уже выполняется или готов (в любом процессе),
+        возвращает существующее задание.
+
+        Args:
+            owner: Пользователь, поставивший задание; только он видит задание и результат
+            visible_sensor_ids: Датчики, доступные пользователю (None — все); выгрузка
+                ограничивается ими, даже если в запросе указаны другие датчики или магазины
+
+        Returns:
+            Состояние задания
+        """
+        check_format(data_format)
+
+        params = {
+            'format': data_format,
+            'start_date': start_date,
+            'end_date': end_date,
+            'sensor_ids': sorted(set(sensor_ids)) if sensor_ids is not None else None,
+            'store_ids': sorted(set(store_ids)) if store_ids is not None else None,
+            'owner': owner,
+            'visible_sensor_ids': sorted(set(visible_sensor_ids)) if visible_sensor_ids is not None else None
+        }
+        key = self._job_key(params)
+
+        conn = get_db_connection(self.db_path)
+        try:
+            cursor = conn.cursor()
+            # IMMEDIATE: два процесса не поставят одно и то же задание одновременно
+            cursor.execute('BEGIN IMMEDIATE')
+            self._reap(cursor)
+            cursor.execute(f'''
+                SELECT {JOB_COLUMNS} FROM export_jobs
+                WHERE job_key = ? AND status IN ('queued', 'running', 'done')
+                ORDER BY created_at DESC LIMIT 1
+            ''', (key,))
+            existing = cursor.fetchone()
+            if existing is not None:
+                cursor.execute('UPDATE export_jobs SET requests = requests + 1 WHERE id = ?', (existing['id'],))
+                conn.commit()
+                job = self._row(existing)
+                job['requests'] += 1
+                return self._public(job)
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'key': key,
+                'owner': owner,
+                'params': params,
+                'status': 'queued',
+                'requests': 1,
+                'rows_written': 0,
+                'total_rows': None,
+                'bytes_written': 0,
+                'filename': export_filename(data_format, start_date, end_date),
+                'path': None,
+                'error': None,
+                'runner_pid': os.getpid(),
+                'created_at': datetime.now().isoformat(),
+                'started_at': None,
+                'finished_at': None,
+                'last_access': time.time()
+            }
+            cursor.execute(f'''
+                INSERT INTO export_jobs ({JOB_COLUMNS})
+                VALUES ({', '.join('?' * 17)})
+            ''', (job['id'], key, owner, json.dumps(params), job['status'], job['requests'],
+                  job['rows_written'], job['total_rows'], job['bytes_written'], job['filename'], job['path'],
+                  job['error'], job['runner_pid'], job['created_at'], job['started_at'], job['finished_at'],
+                  job['last_access']))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        with self._lock:
+            if self._executor is None:
+                os.makedirs(self.spool_dir, exist_ok=True)
+                self._clear_spool()
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='export-job')
+            self._executor.submit(self._run, job)
+        return self._public(job)
+
+    def get(self, job_id: str, owner: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        job = self._owned(job_id, owner)
+        return self._public(job) if job else None
+
+    def list_jobs(self, owner: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Задания пользователя owner (None — все задания) от новых к старым"""
+        conn = get_db_connection(self.db_path)
+        try:
+            cursor = conn.cursor()
+            self._reap(cursor)
+            conn.commit()
+            if owner is None:
+                cursor.execute(f'SELECT {JOB_COLUMNS} FROM export_jobs ORDER BY created_at DESC')
+            else:
+                cursor.execute(f'''
+                    SELECT {JOB_COLUMNS} FROM export_jobs
+                    WHERE owner = ?
+                    ORDER BY created_at DESC
+                ''', (owner,))
+            return [self._public(self._row(row)) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+    def open_result(self, job_id: str, owner: Optional[int] = None) -> Optional[Tuple[str, str]]:
+        """
+        Путь к готовому файлу и имя для скачивания
+
+        Returns:
+            (путь, имя файла) или None, если результата нет или задание чужое
+        """
+        job = self._owned(job_id, owner)
+        if job is None or job['status'] != 'done' or not job['path'] or not os.path.exists(job['path']):
+            return None
+        self._update(job_id, last_access=time.time())
+        return job['path'], job['filename']
+
+    def remove(self, job_id: str, owner: Optional[int] = None) -> bool:
+        """Удаление готового результата из спула"""
+        job = self._owned(job_id, owner)
+        if job is None or job['status'] in ACTIVE_STATUSES:
+            return False
+        self._remove_file(job['path'])
+        conn = get_db_connection(self.db_path)
+        try:
+            conn.execute('DELETE FROM export_jobs WHERE id = ?', (job_id,))
+            conn.commit()
+        finally:
+            conn.close()
+        return True
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def _run(self, job: Dict[str, Any]):
+        params = job['params']
+        path = os.path.join(self.spool_dir, f"{job['id']}.{STREAM_FORMATS[params['format']][1]}")
+        job['started_at'] = datetime.now().isoformat()
+        self._update(job['id'], status='running', started_at=job['started_at'])
+
+        conn = connect(self.db_path)
+        try:
+            sensor_ids = resolve_sensor_ids(conn, params['sensor_ids'], params['store_ids'])
+            if params['visible_sensor_ids'] is not None:
+                visible = params['visible_sensor_ids']
+                sensor_ids = visible if sensor_ids is None else sorted(set(sensor_ids) & set(visible))
+            total_rows = count_export_rows(conn, params['start_date'], params['end_date'], sensor_ids)
+            self._update(job['id'], total_rows=total_rows)
+            chunks = self._track_rows(job, path, iter_export_rows(conn, params['start_date'], params['end_date'],
+                                                                  sensor_ids))
+
+            if params['format'] in TEXT_FORMATS:
+                with open(path, 'w', newline='', encoding='utf-8') as f:
+                    for data in stream_text(params['format'], chunks, params['start_date'], params['end_date']):
+                        f.write(data)
+            else:
+                write_export_file(path, params['format'], chunks)
+        except Exception as e:
+            print(f"Ошибка выгрузки {job['id']}: {e}")
+            self._remove_file(path)
+            self._update(job['id'], status='failed', error=str(e), finished_at=datetime.now().isoformat())
+            return
+        finally:
+            conn.close()
+
+        self._update(job['id'], path=path, status='done', bytes_written=os.path.getsize(path),
+                     rows_written=job['rows_written'], finished_at=datetime.now().isoformat(),
+                     last_access=time.time())
+        self._enforce_spool_limit()
+
+    def _track_rows(self, job: Dict[str, Any], path: str, chunks: Iterator[List[Tuple]]) -> Iterator[List[Tuple]]:
+        # Прогресс записывается в базу после каждой порции строк, чтобы его видели все процессы
+        job['rows_written'] = 0
+        for rows in chunks:
+            yield rows
+            job['rows_written'] += len(rows)
+            self._update(job['id'], rows_written=job['rows_written'],
+                         bytes_written=os.path.getsize(path) if os.path.exists(path) else 0)
+
+    def _update(self, job_id: str, **fields):
+        conn = get_db_connection(self.db_path)
+        try:
+            conn.execute(f'''
+                UPDATE export_jobs SET {', '.join(f'{name} = ?' for name in fields)}
+                WHERE id = ?
+            ''', (*fields.values(), job_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _owned(self, job_id: str, owner: Optional[int]) -> Optional[Dict[str, Any]]:
+        conn = get_db_connection(self.db_path)
+        try:
+            cursor = conn.cursor()
+            self._reap(cursor)
+            conn.commit()
+            cursor.execute(f'SELECT {JOB_COLUMNS} FROM export_jobs WHERE id = ?', (job_id,))
+            row = cursor.fetchone()
+        finally:
+            conn.close()
+        if row is None or (owner is not None and row['owner'] != owner):
+            return None
+        return self._row(row)
+
+    def _reap(self, cursor):
+        """Задания процесса, который завершился, не доделав их, помечаются неудавшимися"""
+        cursor.execute("SELECT DISTINCT runner_pid FROM export_jobs WHERE status IN ('queued', 'running')")
+        dead = [row[0] for row in cursor.fetchall() if not self._alive(row[0])]
+        for pid in dead:
+            cursor.execute('''
+                UPDATE export_jobs SET status = 'failed', error = 'interrupted', finished_at = ?
+                WHERE runner_pid = ? AND status IN ('queued', 'running')
+            ''', (datetime.now().isoformat(), pid))
+
+    def _enforce_spool_limit(self):
+        """
+        Вытеснение результатов, к которым дольше всего не обращались
+
+        Размер спула считается по файлам каталога, а не по заданиям процесса: каталог общий
+        для всех процессов приложения.
+        """
+        files = {}
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            if os.path.isfile(path):
+                files[path] = os.path.getsize(path)
+        total = sum(files.values())
+
+        conn = get_db_connection(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute("SELECT id, path FROM export_jobs WHERE status = 'done' ORDER BY last_access")
+            done = [(row['id'], row['path']) for row in cursor.fetchall() if row['path'] in files]
+            # Самый свежий результат остаётся, даже если он один больше предела
+            for job_id, path in done[:-1]:
+                if total <= self.max_spool_bytes:
+                    break
+                total -= files[path]
+                self._remove_file(path)
+                cursor.execute("UPDATE export_jobs SET status = 'evicted', path = NULL WHERE id = ?", (job_id,))
+
+            cursor.execute('''
+                DELETE FROM export_jobs
+                WHERE status NOT IN ('queued', 'running', 'done') AND last_access < ?
+            ''', (time.time() - JOB_HISTORY_AGE,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _clear_spool(self):
+        # Файлы, которые не принадлежат ни одному заданию, остаются от прерванных выгрузок
+        conn = get_db_connection(self.db_path)
+        try:
+            referenced = {row[0] for row in conn.execute('SELECT path FROM export_jobs WHERE path IS NOT NULL')}
+            active = {row[0] for row in conn.execute(
+                "SELECT id FROM export_jobs WHERE status IN ('queued', 'running')")}
+        finally:
+            conn.close()
+        cutoff = time.time() - ORPHAN_FILE_AGE
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            if path in referenced or name.split('.')[0] in active:
+                continue
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+    @staticmethod
+    def _remove_file(path: Optional[str]):
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    @staticmethod
+    def _alive(pid: Optional[int]) -> bool:
+        if pid is None:
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    @staticmethod
+    def _job_key(params: Dict[str, Any]) -> str:
+        return json.dumps([params['owner'], params['format'], params['start_date'], params['end_date'],
+                           params['sensor_ids'], params['store_ids'], params['visible_sensor_ids']])
+
+    @staticmethod
+    def _row(row) -> Dict[str, Any]:
+        job = dict(row)
+        job['key'] = job.pop('job_key')
+        job['params'] = json.loads(job['params'])
+        return job
+
+    @staticmethod
+    def _public(job: Dict[str, Any]) -> Dict[str, Any]:
+        """Состояние задания для API: прогресс, размер и оценка оставшегося времени"""
+        eta = None
+        if job['status'] == 'running' and job['started_at'] and job['rows_written'] and job['total_rows']:
+            elapsed = (datetime.now() - datetime.fromisoformat(job['started_at'])).total_seconds()
+            remaining = max(job['total_rows'] - job['rows_written'], 0)
+            eta = round(elapsed / job['rows_written'] * remaining, 1)
+        elif job['status'] == 'done':
+            eta = 0.0
+
+        progress = None
+        if job['total_rows']:
+            progress = round(min(job['rows_written'] / job['total_rows'], 1.0), 3)
+        elif job['status'] == 'done':
+            progress = 1.0
+
+        return {
+            'id': job['id'],
+            'status': job['status'],
+            'format': job['params']['format'],
+            'start_date': job['params']['start_date'],
+            'end_date': job['params']['end_date'],
+            'sensor_ids': job['params']['sensor_ids'],
+            'store_ids': job['params']['store_ids'],
+            'rows_written': job['rows_written'],
+            'total_rows': job['total_rows'],
+            'bytes_written': job['bytes_written'],
+            'progress': progress,
+            'eta_seconds': eta,
+            'filename': job['filename'],
+            'requests': job['requests'],
+            'error': job['error'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at']
+        }
+
+
+# Очередь выгрузок процесса; состояние заданий общее для всех процессов
+export_jobs = ExportJobManager()
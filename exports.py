@@ -0,0 +1,367 @@
+"""
+Потоковая выгрузка замеров BELWEST
+Строки читаются из секций visitor_data порциями, поэтому память не растёт с размером периода
+"""
+
+import csv
+import io
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+from typing import Any, Iterator, List, Optional, Tuple
+
+import xlsxwriter
+
+from partitions import partitions_for_range
+
+# pyarrow нужен только для колоночных форматов (parquet, arrow)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# Колонки выгрузки: (ключ для NDJSON, заголовок для CSV/XLSX)
+EXPORT_COLUMNS = [
+    ('device_id', 'Device ID'),
+    ('count', 'Count'),
+    ('counter', 'Counter'),
+    ('timestamp', 'Timestamp'),
+    ('status', 'Status'),
+    ('location', 'Location')
+]
+
+EXPORT_CHUNK_SIZE = 5000
+FILE_CHUNK_SIZE = 64 * 1024
+
+# Строк в одной группе parquet / пакете arrow
+ROW_GROUP_SIZE = 100000
+
+STREAM_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.file', 'arrow'),
+    'txt': ('text/plain; charset=utf-8', 'txt')
+}
+
+# Текстовые форматы пишутся по мере чтения строк, остальные собираются в файле целиком
+TEXT_FORMATS = ('csv', 'ndjson', 'txt')
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+
+
+def iter_export_rows(conn: sqlite3.Connection, start_date: Optional[str] = None,
+                     end_date: Optional[str] = None, sensor_ids: Optional[List[int]] = None,
+                     chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[Tuple]]:
+    """
+    Замеры за период порциями по chunk_size строк
+
+    Секции читаются по очереди в порядке времени по индексу timestamp,
+    так что базе не нужно сортировать весь период целиком.
+
+    Args:
+        conn: Соединение с базой данных
+        start_date: Первый день периода (YYYY-MM-DD) или None
+        end_date: Последний день периода включительно (YYYY-MM-DD) или None
+        sensor_ids: Только эти датчики (None — все)
+
+    Yields:
+        Списки строк в порядке EXPORT_COLUMNS
+    """
+    cursor = conn.cursor()
+    end_bound = f'{end_date} 23:59:59.999999' if end_date else None
+    partitions = partitions_for_range(cursor, start_date, end_bound)
+
+    sensor_filter = ''
+    sensor_params = ()
+    if sensor_ids is not None:
+        if not sensor_ids:
+            return
+        sensor_filter = f"AND vd.sensor_id IN ({', '.join('?' * len(sensor_ids))})"
+        sensor_params = tuple(sensor_ids)
+
+    for name in partitions:
+        cursor.execute(f'''
+            SELECT s.name, vd.visitor_delta, vd.visitor_count, vd.timestamp, s.status, s.location
+            FROM {name} vd
+            LEFT JOIN sensors s ON s.id = vd.sensor_id
+            WHERE vd.timestamp >= COALESCE(?, '') AND (? IS NULL OR vd.timestamp < DATE(?, '+1 day'))
+            {sensor_filter}
+            ORDER BY vd.timestamp
+        ''', (start_date, end_date, end_date) + sensor_params)
+
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield [tuple(row) for row in rows]
+
+
+def count_export_rows(conn: sqlite3.Connection, start_date: Optional[str] = None,
+                      end_date: Optional[str] = None, sensor_ids: Optional[List[int]] = None) -> int:
+    """Число строк выгрузки (по индексу timestamp, без чтения самих строк)"""
+    if sensor_ids is not None and not sensor_ids:
+        return 0
+
+    cursor = conn.cursor()
+    end_bound = f'{end_date} 23:59:59.999999' if end_date else None
+    sensor_filter = ''
+    sensor_params = ()
+    if sensor_ids is not None:
+        sensor_filter = f"AND sensor_id IN ({', '.join('?' * len(sensor_ids))})"
+        sensor_params = tuple(sensor_ids)
+
+    total = 0
+    for name in partitions_for_range(cursor, start_date, end_bound):
+        cursor.execute(f'''
+            SELECT COUNT(*) FROM {name}
+            WHERE timestamp >= COALESCE(?, '') AND (? IS NULL OR timestamp < DATE(?, '+1 day'))
+            {sensor_filter}
+        ''', (start_date, end_date, end_date) + sensor_params)
+        total += cursor.fetchone()[0]
+    return total
+
+
+def resolve_sensor_ids(conn: sqlite3.Connection, sensor_ids: Optional[List[int]] = None,
+                       store_ids: Optional[List[int]] = None) -> Optional[List[int]]:
+    """
+    Датчики выгрузки по явному списку и привязке к магазинам
+
+    Returns:
+        Отсортированный список id или None, если фильтр не задан
+    """
+    if sensor_ids is None and store_ids is None:
+        return None
+
+    result = set(sensor_ids or [])
+    if store_ids:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT DISTINCT sensor_id FROM store_sensors
+            WHERE store_id IN ({', '.join('?' * len(store_ids))})
+        ''', tuple(store_ids))
+        result.update(row[0] for row in cursor.fetchall())
+    return sorted(result)
+
+
+def check_format(data_format: str):
+    """
+    Проверка, что формат выгрузки поддерживается в этой установке
+
+    Raises:
+        ValueError: если формат неизвестен или для него не установлен pyarrow
+    """
+    if data_format not in STREAM_FORMATS:
+        raise ValueError(f'unsupported format: {data_format}')
+    if data_format in COLUMNAR_FORMATS and pa is None:
+        raise ValueError(f'format {data_format} requires pyarrow')
+
+
+def stream_csv(chunks: Iterator[List[Tuple]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([header for _, header in EXPORT_COLUMNS])
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_ndjson(chunks: Iterator[List[Tuple]]) -> Iterator[str]:
+    keys = [key for key, _ in EXPORT_COLUMNS]
+    for rows in chunks:
+        yield ''.join(json.dumps(dict(zip(keys, row)), ensure_ascii=False) + '\n' for row in rows)
+
+
+def stream_txt(chunks: Iterator[List[Tuple]], start_date: Optional[str] = None,
+               end_date: Optional[str] = None) -> Iterator[str]:
+    """Текстовый отчет (бывший «PDF»): шапка с периодом и строки через табуляцию"""
+    yield ('BELWEST - Отчет по посещаемости\n'
+           + '=' * 50 + '\n\n'
+           + f'Период: {start_date} - {end_date}\n'
+           + f'Дата создания: {datetime.now().strftime("%d.%m.%Y %H:%M:%S")}\n\n'
+           + '\t'.join(header for _, header in EXPORT_COLUMNS) + '\n'
+           + '-' * 80 + '\n')
+    for rows in chunks:
+        yield ''.join('\t'.join(str(x) for x in row) + '\n' for row in rows)
+
+
+def stream_text(data_format: str, chunks: Iterator[List[Tuple]], start_date: Optional[str] = None,
+                end_date: Optional[str] = None) -> Iterator[str]:
+    """Строки текстового формата (csv, ndjson, txt) по мере чтения порций"""
+    if data_format == 'csv':
+        return stream_csv(chunks)
+    if data_format == 'ndjson':
+        return stream_ndjson(chunks)
+    return stream_txt(chunks, start_date, end_date)
+
+
+def write_xlsx(filepath: str, chunks: Iterator[List[Tuple]]) -> int:
+    """
+    Запись XLSX построчно в режиме constant_memory
+
+    Returns:
+        Число записанных строк данных
+    """
+    workbook = xlsxwriter.Workbook(filepath, {'constant_memory': True})
+    worksheet = workbook.add_worksheet()
+    worksheet.write_row(0, 0, [header for _, header in EXPORT_COLUMNS])
+
+    row_idx = 0
+    for rows in chunks:
+        for row in rows:
+            row_idx += 1
+            worksheet.write_row(row_idx, 0, row)
+    workbook.close()
+    return row_idx
+
+
+class _DictionaryColumn:
+    """
+    Словарное кодирование строковой колонки с общим словарём на весь файл
+
+    Словарь только дополняется, поэтому каждая следующая порция — дельта к предыдущей,
+    а IPC-файл arrow не требует замены словаря.
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def encode(self, items: List[Optional[str]]):
+        indices = []
+        for item in items:
+            if item is None:
+                indices.append(None)
+                continue
+            code = self.codes.get(item)
+            if code is None:
+                code = len(self.values)
+                self.codes[item] = code
+                self.values.append(item)
+            indices.append(code)
+        return pa.DictionaryArray.from_arrays(pa.array(indices, type=pa.int32()),
+                                              pa.array(self.values, type=pa.string()))
+
+
+def columnar_schema():
+    dictionary = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ('device_id', dictionary),
+        ('count', pa.int32()),
+        ('counter', pa.int32()),
+        ('timestamp', pa.timestamp('us')),
+        ('status', dictionary),
+        ('location', dictionary)
+    ])
+
+
+def iter_record_batches(chunks: Iterator[List[Tuple]], batch_size: int = ROW_GROUP_SIZE):
+    """Типизированные пакеты arrow по batch_size строк из порций курсора"""
+    schema = columnar_schema()
+    dictionaries = {'device_id': _DictionaryColumn(), 'status': _DictionaryColumn(), 'location': _DictionaryColumn()}
+
+    def build(rows):
+        columns = list(zip(*rows))
+        return pa.RecordBatch.from_arrays([
+            dictionaries['device_id'].encode(list(columns[0])),
+            pa.array(columns[1], type=pa.int32()),
+            pa.array(columns[2], type=pa.int32()),
+            # SQLite хранит время текстом; приводим к timestamp один раз при выгрузке
+            pa.array(columns[3], type=pa.string()).cast(pa.timestamp('us')),
+            dictionaries['status'].encode(list(columns[4])),
+            dictionaries['location'].encode(list(columns[5]))
+        ], schema=schema)
+
+    pending = []
+    for rows in chunks:
+        pending.extend(rows)
+        while len(pending) >= batch_size:
+            yield build(pending[:batch_size])
+            pending = pending[batch_size:]
+    if pending:
+        yield build(pending)
+
+
+def write_columnar(filepath: str, data_format: str, chunks: Iterator[List[Tuple]]) -> int:
+    """
+    Запись parquet или arrow группами по ROW_GROUP_SIZE строк со сжатием zstd
+
+    Returns:
+        Число записанных строк данных
+    """
+    check_format(data_format)
+    schema = columnar_schema()
+    rows = 0
+
+    if data_format == 'parquet':
+        with pq.ParquetWriter(filepath, schema, compression='zstd', use_dictionary=True) as writer:
+            for batch in iter_record_batches(chunks):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    else:
+        options = pa.ipc.IpcWriteOptions(compression='zstd', emit_dictionary_deltas=True)
+        with pa.OSFile(filepath, 'wb') as sink, pa.ipc.new_file(sink, schema, options=options) as writer:
+            for batch in iter_record_batches(chunks):
+                writer.write_batch(batch)
+                rows += batch.num_rows
+    return rows
+
+
+def write_export_file(filepath: str, data_format: str, chunks: Iterator[List[Tuple]]):
+    """Запись двоичного формата (xlsx, parquet, arrow) в файл"""
+    if data_format == 'xlsx':
+        write_xlsx(filepath, chunks)
+    else:
+        write_columnar(filepath, data_format, chunks)
+
+
+def stream_file(data_format: str, chunks: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    """
+    Двоичные форматы собираются во временном файле и отдаются порциями
+
+    Оглавление zip (xlsx) и футер parquet/arrow пишутся в конце, поэтому файл нельзя
+    отдавать в ответ до завершения записи.
+    """
+    fd, filepath = tempfile.mkstemp(suffix=f'.{STREAM_FORMATS[data_format][1]}')
+    os.close(fd)
+    try:
+        write_export_file(filepath, data_format, chunks)
+        with open(filepath, 'rb') as f:
+            while True:
+                data = f.read(FILE_CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+    finally:
+        os.remove(filepath)
+
+
+def stream_export(conn: sqlite3.Connection, data_format: str, start_date: Optional[str] = None,
+                  end_date: Optional[str] = None, sensor_ids: Optional[List[int]] = None) -> Iterator[Any]:
+    """
+    Тело потокового ответа в указанном формате
+
+    Соединение возвращается в пул, когда поток дочитан или прерван клиентом.
+    """
+    try:
+        chunks = iter_export_rows(conn, start_date, end_date, sensor_ids)
+        if data_format in TEXT_FORMATS:
+            yield from stream_text(data_format, chunks, start_date, end_date)
+        else:
+            check_format(data_format)
+            yield from stream_file(data_format, chunks)
+    finally:
+        conn.close()
+
+
+def export_filename(data_format: str, start_date: Optional[str], end_date: Optional[str]) -> str:
+    period = '_'.join(part for part in (start_date, end_date) if part) or 'all'
+    return f"report_{period}.{STREAM_FORMATS[data_format][1]}"
@@ -0,0 +1,492 @@
+"""
+Сезонные модели прогноза посетителей BELWEST
+Для всей сети, каждого магазина и каждого датчика поток за час описывается сезонной регрессией
+    посетители = сезон[ячейка] + тренд[ячейка] · t + шум,   ячейка = день недели × час
+с экспоненциальным забыванием старых недель. Модель хранит только накопленные суммы по 168 ячейкам
+недели, поэтому новые почасовые агрегаты добавляются к ней без повторного обучения, а прогноз —
+это вычисление по сохранённым параметрам
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import cached_property
+from itertools import chain
+from statistics import NormalDist
+from typing import Any, Collection, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import analytics
+from database import DB_PATH, get_db_connection
+from rollups import get_high_water_mark, set_high_water_mark
+
+# Ячеек недели: день недели (нумерация SQLite) × час
+WEEK_CELLS = 168
+
+# Накопленные суммы ячейки: вес, Σt, Σy, Σt², Σty, Σy²
+STAT_COLUMNS = 6
+
+# Вклад наблюдения уменьшается вдвое за HALF_LIFE_WEEKS недель
+HALF_LIFE_WEEKS = 12.0
+
+# Глубина истории при первом обучении (сутки)
+FIT_DAYS = 365
+
+# Час агрегата попадает в модели через SETTLE_MINUTES после окончания: свёртка успевает его дописать
+SETTLE_MINUTES = 10
+
+# Сколько последних учтённых часов перечитывается при каждом дообучении: опоздавшие замеры
+# меняют агрегаты прошедших часов, и модели получают разницу. Поправки к более старым часам
+# в модели не попадают
+REVISE_HOURS = 48
+
+# Прогноз пересчитывает модели сам, если они отстали от данных больше чем на STALE_HOURS часов
+STALE_HOURS = 2
+
+# Вероятность попадания фактического значения в интервал прогноза
+INTERVAL_LEVEL = 0.9
+
+# Сколько «наблюдений» средней дисперсии модели добавляется к дисперсии ячейки:
+# ячейки с короткой историей не получают слишком узкий интервал
+VARIANCE_PRIOR = 2.0
+
+# Модели сети, магазинов и датчиков
+MODEL_KINDS = ('fleet', 'store', 'sensor')
+
+# Отметка в rollup_state: первый час, ещё не учтённый в моделях
+FORECAST_STATE = 'forecast'
+
+# Начало отсчёта тренда (в неделях): небольшие t сохраняют точность накопленных сумм
+TREND_ORIGIN = analytics.to_bucket(datetime(2024, 1, 1))
+
+
+class SeasonalModel:
+    def __init__(self, stats: Optional[np.ndarray] = None, observations: int = 0, last_bucket: int = 0):
+        """
+        Сезонная модель одного ряда
+
+        Args:
+            stats: Накопленные суммы по ячейкам недели, массив WEEK_CELLS × STAT_COLUMNS
+            observations: Сколько часов учтено всего
+            last_bucket: Час (от 1970-01-01), к которому приведены веса сумм
+        """
+        self.stats = stats if stats is not None else np.zeros((WEEK_CELLS, STAT_COLUMNS))
+        self.observations = observations
+        self.last_bucket = last_bucket
+
+    @classmethod
+    def from_blob(cls, blob: bytes, observations: int, last_bucket: int) -> 'SeasonalModel':
+        stats = np.frombuffer(blob, dtype=np.float64).reshape(WEEK_CELLS, STAT_COLUMNS).copy()
+        return cls(stats, observations, last_bucket)
+
+    def to_blob(self) -> bytes:
+        return self.stats.astype(np.float64).tobytes()
+
+    def add(self, stats: np.ndarray, observations: int, until: int, half_life_weeks: float = HALF_LIFE_WEEKS):
+        """
+        Учёт новых часов: прежние суммы уменьшаются на время до until, новые добавляются
+
+        Args:
+            stats: Суммы новых часов (веса уже приведены к until)
+            observations: Число новых часов
+            until: Новый час приведения весов
+        """
+        if self.last_bucket:
+            self.stats *= 0.5 ** ((until - self.last_bucket) / 168 / half_life_weeks)
+        self.stats += stats
+        self.observations += observations
+        self.last_bucket = until
+        self.__dict__.pop('params', None)
+
+    @cached_property
+    def params(self) -> Dict[str, Any]:
+        """
+        Сезон, тренд и дисперсия по накопленным суммам
+
+        Тренд свой у каждой ячейки (поток в часы пик растёт быстрее), но сглажен к общему тренду
+        модели: у ячейки с короткой историей он почти общий. Дисперсия остатков тоже своя
+        у каждой ячейки и сглажена к средней по модели.
+        """
+        weight, st, sy, stt, sty, syy = self.stats.T
+        has_history = weight > 1e-9
+        safe_weight = np.where(has_history, weight, 1.0)
+
+        # Суммы относительно средних ячейки
+        ctt = np.where(has_history, stt - st * st / safe_weight, 0.0)
+        cty = np.where(has_history, sty - st * sy / safe_weight, 0.0)
+        cyy = np.where(has_history, syy - sy * sy / safe_weight, 0.0)
+
+        # Общий тренд — регрессия с фиктивными переменными ячеек; к нему тянется тренд ячейки
+        # с весом средней по ячейкам суммы ctt
+        spread = ctt.sum()
+        common = cty.sum() / spread if spread > 1e-9 else 0.0
+        prior = spread / max(int(has_history.sum()), 1)
+        slope = (cty + prior * common) / (ctt + prior) if prior > 1e-9 else np.full(WEEK_CELLS, common)
+        season = np.where(has_history, (sy - slope * st) / safe_weight, 0.0)
+
+        # Остатки делятся на число наблюдений без одного: среднее ячейки оценено по тем же данным
+        residual = np.maximum(cyy - 2 * slope * cty + slope * slope * ctt, 0.0)
+        freedom = np.maximum(weight - 1, 0.0)
+        total_freedom = freedom.sum()
+        pooled = residual.sum() / total_freedom if total_freedom > 1e-9 else 0.0
+        variance = (residual + VARIANCE_PRIOR * pooled) / (freedom + VARIANCE_PRIOR)
+
+        return {
+            'season': season,
+            'slope': slope,
+            'variance': variance,
+            'weight': weight,
+            'has_history': has_history
+        }
+
+    def predict(self, buckets: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Прогноз на часы buckets
+
+        Returns:
+            (ожидаемое значение, стандартное отклонение прогноза, есть ли история ячейки)
+        """
+        params = self.params
+        cells = analytics.bucket_cells(buckets)
+        weeks = (buckets - TREND_ORIGIN) / 168
+        mean = params['season'][cells] + params['slope'][cells] * weeks
+        weight = params['weight'][cells]
+        # Неопределённость самой оценки ячейки убывает с накопленным весом
+        deviation = np.sqrt(params['variance'][cells] * (1 + 1 / np.maximum(weight, 1.0)))
+        has_history = params['has_history'][cells]
+        return np.where(has_history, mean, 0.0), np.where(has_history, deviation, 0.0), has_history
+
+
+def accumulate(keys: np.ndarray, buckets: np.ndarray, values: np.ndarray, until: int,
+               half_life_weeks: float = HALF_LIFE_WEEKS) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Суммы моделей по новым часам
+
+    Args:
+        keys: Ряд каждого часа (id магазина или датчика, 0 для сети)
+        buckets: Час от 1970-01-01
+        values: Посетители за час
+        until: Час приведения весов
+
+    Returns:
+        (id рядов, суммы len(ids) × WEEK_CELLS × STAT_COLUMNS, число часов каждого ряда)
+    """
+    codes, ids = pd.factorize(keys, sort=True)
+    index = codes * WEEK_CELLS + analytics.bucket_cells(buckets)
+    weight = 0.5 ** ((until - buckets) / 168 / half_life_weeks)
+    t = (buckets - TREND_ORIGIN) / 168
+    y = values.astype(np.float64)
+
+    size = len(ids) * WEEK_CELLS
+    columns = [weight, weight * t, weight * y, weight * t * t, weight * t * y, weight * y * y]
+    stats = np.stack([np.bincount(index, weights=column, minlength=size) for column in columns], axis=1)
+    counts = np.bincount(codes, minlength=len(ids))
+    return np.asarray(ids), stats.reshape(len(ids), WEEK_CELLS, STAT_COLUMNS), counts
+
+
+def changes(old: Tuple[np.ndarray, ...], new: Tuple[np.ndarray, ...]) -> Tuple[Tuple[np.ndarray, ...], ...]:
+    """
+    Точки ряда (id ряда, час, посетители), которые появились или изменились
+
+    Returns:
+        (новые значения таких точек, их прежние значения)
+    """
+    if not len(old[0]):
+        return new, old
+    merged = pd.DataFrame({'key': old[0], 'bucket': old[1], 'value': old[2]}).merge(
+        pd.DataFrame({'key': new[0], 'bucket': new[1], 'value': new[2]}),
+        on=['key', 'bucket'], how='outer', suffixes=('_old', '_new'))
+    changed = merged['value_old'].ne(merged['value_new'])
+
+    def points(column: str) -> Tuple[np.ndarray, ...]:
+        rows = merged[changed & merged[column].notna()]
+        return (rows['key'].to_numpy(dtype=np.int64), rows['bucket'].to_numpy(dtype=np.int64),
+                rows[column].to_numpy(dtype=np.int64))
+
+    return points('value_new'), points('value_old')
+
+
+def series(kind: str, buckets: np.ndarray, sensor_ids: np.ndarray, store_ids: np.ndarray,
+           values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Почасовые ряды моделей вида kind из строк hourly_statistics
+
+    Returns:
+        (id ряда, час, посетители) — по строке на ряд и час
+    """
+    if kind == 'sensor':
+        # Датчик, перенесённый в другой магазин посреди часа, даёт за этот час две строки
+        keys = sensor_ids
+    elif kind == 'store':
+        # Датчики без магазина в модели магазинов не входят
+        mask = store_ids > 0
+        keys, buckets, values = store_ids[mask], buckets[mask], values[mask]
+    else:
+        keys = np.zeros_like(buckets)
+    totals = pd.Series(values).groupby([keys, buckets]).sum()
+    return (totals.index.get_level_values(0).to_numpy(dtype=np.int64),
+            totals.index.get_level_values(1).to_numpy(dtype=np.int64),
+            totals.to_numpy(dtype=np.int64))
+
+
+class ForecastEngine:
+    def __init__(self, db_path: Optional[str] = None, half_life_weeks: float = HALF_LIFE_WEEKS,
+                 fit_days: int = FIT_DAYS, interval_level: float = INTERVAL_LEVEL, auto_update: bool = True,
+                 revise_hours: int = REVISE_HOURS):
+        """
+        Инициализация прогноза по сезонным моделям
+
+        Модели хранятся в таблице forecast_models и дообучаются update() по новым почасовым агрегатам;
+        процессы приложения читают их оттуда и держат в памяти до следующего дообучения.
+
+        Args:
+            db_path: Путь к базе данных (по умолчанию общая база приложения)
+            half_life_weeks: Период полураспада веса наблюдений (недели)
+            fit_days: Глубина истории при первом обучении (сутки)
+            interval_level: Вероятность попадания фактического значения в интервал прогноза
+            auto_update: Дообучать отставшие модели при прогнозе (бэктест отключает, чтобы
+                         модели не увидели данные после точки прогноза)
+            revise_hours: Сколько последних учтённых часов перечитывать при дообучении
+        """
+        self.db_path = db_path or DB_PATH
+        self.auto_update = auto_update
+        self.half_life_weeks = half_life_weeks
+        self.fit_days = fit_days
+        self.revise_hours = revise_hours
+        self.interval_level = interval_level
+        self.z = NormalDist().inv_cdf(0.5 + interval_level / 2)
+
+        self._models = {}
+        self._version = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'updates': 0,
+            'last_update_at': None,
+            'last_update_ms': 0.0,
+            'fit_ms': {kind: 0.0 for kind in MODEL_KINDS},
+            'hours_added': 0,
+            'hours_revised': 0
+        }
+
+    def get_db_connection(self):
+        return get_db_connection(self.db_path)
+
+    def update(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Дообучение всех моделей на часах, появившихся после прошлого обновления
+
+        Последние revise_hours уже учтённых часов перечитываются: значения, которые с тех пор
+        изменились (опоздавшие замеры свёрнуты в прошедший час), заменяются в моделях — прежний
+        вклад вычитается, новый добавляется. Учтённые значения этих часов хранятся в forecast_recent.
+
+        Выполняется одной транзакцией записи: отметка последнего учтённого часа и модели
+        меняются вместе, поэтому одновременный вызов из другого процесса не учтёт часы дважды.
+
+        Args:
+            now: Момент, до которого учитываются завершённые часы (по умолчанию — текущий)
+
+        Returns:
+            {'from_bucket', 'until_bucket', 'rows', 'revised', 'models', 'fit_ms'}
+        """
+        now = now or datetime.now()
+        until = analytics.to_bucket(now - timedelta(minutes=SETTLE_MINUTES))
+        started = time.perf_counter()
+
+        conn = self.get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            mark = get_high_water_mark(cursor, FORECAST_STATE)
+            since = mark or until - self.fit_days * 24
+            if since >= until:
+                conn.rollback()
+                return {'from_bucket': since, 'until_bucket': since, 'rows': 0, 'revised': 0, 'models': 0,
+                        'fit_ms': {}}
+
+            revise_from = since - self.revise_hours if mark else since
+            rows = self._load_rows(conn, revise_from, until)
+            applied = self._load_applied(conn)
+            fit_ms = {}
+            models = 0
+            revised = 0
+            for kind in MODEL_KINDS:
+                kind_started = time.perf_counter()
+                added, removed = changes(series(kind, *applied), series(kind, *rows))
+                ids, stats, counts = accumulate(*added, until, self.half_life_weeks)
+                old_ids, old_stats, old_counts = accumulate(*removed, until, self.half_life_weeks)
+                revised += len(removed[0])
+
+                delta = {entity_id: [stats[position], int(counts[position])]
+                         for position, entity_id in enumerate(ids.tolist())}
+                for position, entity_id in enumerate(old_ids.tolist()):
+                    entry = delta.setdefault(entity_id, [np.zeros((WEEK_CELLS, STAT_COLUMNS)), 0])
+                    entry[0] = entry[0] - old_stats[position]
+                    entry[1] -= int(old_counts[position])
+
+                existing = self._load_models(conn, kind, list(delta))
+                model_rows = []
+                for entity_id, (entity_stats, entity_count) in delta.items():
+                    model = existing.get(entity_id) or SeasonalModel()
+                    model.add(entity_stats, entity_count, until, self.half_life_weeks)
+                    model_rows.append((kind, entity_id, model.to_blob(), model.observations, model.last_bucket,
+                                       now.isoformat()))
+                cursor.executemany('''
+                    INSERT INTO forecast_models (kind, entity_id, stats, observations, last_bucket, fitted_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(kind, entity_id) DO UPDATE SET
+                        stats = excluded.stats, observations = excluded.observations,
+                        last_bucket = excluded.last_bucket, fitted_at = excluded.fitted_at
+                ''', model_rows)
+                models += len(model_rows)
+                fit_ms[kind] = round((time.perf_counter() - kind_started) * 1000, 3)
+
+            self._save_applied(cursor, rows, until - self.revise_hours)
+            set_high_water_mark(cursor, until, FORECAST_STATE)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._models.clear()
+            self._version = until
+        self._stats['updates'] += 1
+        self._stats['last_update_at'] = now.isoformat()
+        self._stats['last_update_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        self._stats['fit_ms'] = fit_ms
+        new_rows = int((rows[0] >= since).sum())
+        self._stats['hours_added'] += new_rows
+        self._stats['hours_revised'] += revised
+        return {'from_bucket': since, 'until_bucket': until, 'rows': new_rows, 'revised': revised,
+                'models': models, 'fit_ms': fit_ms}
+
+    def models(self, kind: str, entity_ids: Optional[Collection[int]] = None) -> Dict[int, SeasonalModel]:
+        """
+        Обученные модели вида kind (всех или entity_ids) из кэша процесса или базы
+
+        Если модели отстали от данных больше чем на STALE_HOURS часов (фоновое дообучение
+        не запущено), они сначала дообучаются (при auto_update).
+        """
+        conn = self.get_db_connection()
+        try:
+            version = get_high_water_mark(conn.cursor(), FORECAST_STATE)
+            if self.auto_update and analytics.to_bucket(datetime.now()) - version > STALE_HOURS:
+                self.update()
+                version = get_high_water_mark(conn.cursor(), FORECAST_STATE)
+            with self._lock:
+                if version != self._version:
+                    self._models.clear()
+                    self._version = version
+                if entity_ids is None:
+                    cached = {key[1]: model for key, model in self._models.items() if key[0] == kind}
+                    missing = None
+                else:
+                    cached = {entity_id: self._models[(kind, entity_id)]
+                              for entity_id in entity_ids if (kind, entity_id) in self._models}
+                    missing = [entity_id for entity_id in entity_ids if entity_id not in cached]
+            if missing is None or missing:
+                loaded = self._load_models(conn, kind, missing)
+                with self._lock:
+                    if version == self._version:
+                        self._models.update({(kind, entity_id): model for entity_id, model in loaded.items()})
+                cached.update(loaded)
+            return cached
+        finally:
+            conn.close()
+
+    def forecast(self, start: datetime, hours: int, store_id: Optional[int] = None,
+                 sensor_ids: Optional[Collection[int]] = None) -> pd.DataFrame:
+        """
+        Прогноз с интервалом на hours часов начиная с start
+
+        Модель выбирается по области: магазин — модель магазина, набор датчиков — сумма моделей
+        датчиков, без ограничений — модель сети. Для суммы датчиков отклонения складываются
+        (ошибки датчиков одного магазина считаются полностью связанными), поэтому интервал
+        не занижен.
+
+        Returns:
+            DataFrame с колонками datetime, hour, predicted_visitors, lower, upper, has_history
+        """
+        times = pd.date_range(start.replace(minute=0, second=0, microsecond=0), periods=hours, freq='h')
+        buckets = analytics.to_buckets(times)
+
+        if sensor_ids is not None:
+            selected = self.models('sensor', sorted(int(sensor_id) for sensor_id in sensor_ids)).values()
+        elif store_id is not None:
+            selected = self.models('store', [int(store_id)]).values()
+        else:
+            selected = self.models('fleet', [0]).values()
+
+        mean = np.zeros(hours)
+        deviation = np.zeros(hours)
+        has_history = np.zeros(hours, dtype=bool)
+        for model in selected:
+            model_mean, model_deviation, model_history = model.predict(buckets)
+            mean += model_mean
+            deviation += model_deviation
+            has_history |= model_history
+
+        mean = np.maximum(mean, 0.0)
+        return pd.DataFrame({
+            'datetime': times,
+            'hour': times.hour,
+            'predicted_visitors': np.rint(mean).astype(np.int64),
+            'lower': np.floor(np.maximum(mean - self.z * deviation, 0.0)).astype(np.int64),
+            'upper': np.ceil(mean + self.z * deviation).astype(np.int64),
+            'has_history': has_history
+        })
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats['version'] = self._version
+        with self._lock:
+            stats['cached_models'] = len(self._models)
+        return stats
+
+    def _load_rows(self, conn, since: int, until: int) -> Tuple[np.ndarray, ...]:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(f'''
+            SELECT {analytics.BUCKET_SQL}, sensor_id, COALESCE(store_id, 0), COALESCE(visitor_count, 0)
+            FROM hourly_statistics
+            WHERE bucket_start >= ? AND bucket_start < ?
+        ''', (analytics.from_bucket(since).strftime(analytics.BUCKET_FORMAT),
+              analytics.from_bucket(until).strftime(analytics.BUCKET_FORMAT)))
+        rows = cursor.fetchall()
+        values = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * 4).reshape(-1, 4)
+        return values[:, 0], values[:, 1], values[:, 2], values[:, 3]
+
+    @staticmethod
+    def _load_applied(conn) -> Tuple[np.ndarray, ...]:
+        """Значения последних часов в том виде, в каком они учтены в моделях"""
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute('SELECT bucket, sensor_id, store_id, visitor_count FROM forecast_recent')
+        rows = cursor.fetchall()
+        values = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=len(rows) * 4).reshape(-1, 4)
+        return values[:, 0], values[:, 1], values[:, 2], values[:, 3]
+
+    @staticmethod
+    def _save_applied(cursor, rows: Tuple[np.ndarray, ...], since: int):
+        buckets, sensor_ids, store_ids, values = rows
+        mask = buckets >= since
+        cursor.execute('DELETE FROM forecast_recent')
+        cursor.executemany('''
+            INSERT INTO forecast_recent (bucket, sensor_id, store_id, visitor_count)
+            VALUES (?, ?, ?, ?)
+        ''', zip(buckets[mask].tolist(), sensor_ids[mask].tolist(), store_ids[mask].tolist(), values[mask].tolist()))
+
+    @staticmethod
+    def _load_models(conn, kind: str, entity_ids: Optional[Collection[int]]) -> Dict[int, SeasonalModel]:
+        query = 'SELECT entity_id, stats, observations, last_bucket FROM forecast_models WHERE kind = ?'
+        params = [kind]
+        if entity_ids is not None:
+            ids = [int(entity_id) for entity_id in entity_ids]
+            query += f' AND entity_id IN ({", ".join("?" * len(ids))})'
+            params += ids
+        rows = conn.execute(query, params).fetchall()
+        return {row[0]: SeasonalModel.from_blob(row[1], row[2], row[3]) for row in rows}
@@ -1,152 +1,194 @@
-from flask import Blueprint, render_template, jsonify, request
+from flask import Blueprint, render_template, jsonify, request, Response, stream_with_context, send_file
 from datetime import datetime
 import os
 import sqlite3
 import csv
 import xlsxwriter
+from database import db_connection, get_db_connection
+from authz import current_principal, current_scope, requires
+from exports import STREAM_FORMATS, check_format, stream_export, export_filename, resolve_sensor_ids
+from export_jobs import export_jobs
+from pagination import Paginator
+from partitions import range_source
 
 reports = Blueprint('reports', __name__)
 
-DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'visitor_data.db')
+REPORT_PAGES = Paginator('reports', {'received_at': ('vd.timestamp', 'received_at'), 'device_id': ('s.name', 'device_id')},
+                         '-received_at', filters={'device_id': ('s.name', '='), 'status': ('s.status', '=')},
+                         key='vd.id')
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    return conn
+def _visible_sensor_ids():
+    """Датчики, доступные текущему пользователю (None — все)"""
+    scope = current_scope()
+    return None if scope['all'] else scope['sensor_ids']
 
 @reports.route('/api/reports', methods=['GET'])
+@requires('reports', 'read')
 def get_reports_data():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT device_id, location, status, received_at
-        FROM visitor_counts
-        ORDER BY received_at DESC
-    ''')
-    
-    data = []
-    for row in cursor.fetchall():
-        data.append({
-            'device_id': row[0],
-            'location': row[1],
-            'status': row[2],
-            'received_at': row[3]
-        })
-    
-    conn.close()
-    return jsonify(data)
+    """Замеры датчиков за период start..end (YYYY-MM-DD, включительно) для предпросмотра отчёта"""
+    start_date = request.args.get('start') or None
+    end_date = request.args.get('end') or None
+
+    conditions = []
+    params = ()
+    if start_date:
+        conditions.append('vd.timestamp >= ?')
+        params += (start_date,)
+    if end_date:
+        conditions.append("vd.timestamp < DATE(?, '+1 day')")
+        params += (end_date,)
+    # Только датчики из области видимости пользователя
+    visible = _visible_sensor_ids()
+    if visible is not None:
+        conditions.append(f"vd.sensor_id IN ({', '.join('?' * len(visible))})" if visible else '0')
+        params += tuple(sorted(visible))
+
+    try:
+        with db_connection() as conn:
+            cursor = conn.cursor()
+            # Читаются только секции периода; курсор страницы — (время замера, id замера)
+            source = range_source(cursor, start_date, f'{end_date} 23:59:59.999999' if end_date else None)
+            page = REPORT_PAGES.fetch(cursor, f'''
+                SELECT vd.id, s.name as device_id, s.location, s.status,
+                       vd.visitor_count as count, vd.timestamp, vd.timestamp as received_at
+                FROM {source} vd
+                JOIN sensors s ON s.id = vd.sensor_id
+            ''', params, request.args, ' AND '.join(conditions) or None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    return jsonify(page)
 
 @reports.route('/api/export', methods=['POST'])
+@requires('reports', 'export')
 def export_data():
-    import io
-    from flask import Response
-    
+    """
+    Генерация файла отчета
+
+    Файл собирается заданием выгрузки в спуле (не в static): ответ — состояние задания,
+    результат скачивается через /api/export/jobs/<id>/download.
+    """
     data_format = request.form.get('format', 'csv')
-    start_date = request.form.get('start_date')
-    end_date = request.form.get('end_date')
-    
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    query = '''
-        SELECT device_id, count, timestamp, status, received_at, location
-        FROM visitor_counts
-        WHERE 1=1
-    '''
+    # Прежний «PDF» — текстовый отчет
+    if data_format == 'pdf':
+        data_format = 'txt'
     
-    params = []
-    if start_date:
-        query += ' AND DATE(received_at) >= ?'
-        params.append(start_date)
-    
-    if end_date:
-        query += ' AND DATE(received_at) <= ?'
-        params.append(end_date)
-    
-    query += ' ORDER BY received_at DESC'
-    
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    
-    if data_format == 'csv':
-        filename = f'report_{timestamp}.csv'
-        filepath = os.path.join('static', filename)
-        
-        # Создаем директорию static если её нет
-        os.makedirs('static', exist_ok=True)
-        
-        with open(filepath, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(['Device ID', 'Count', 'Timestamp', 'Status', 'Received At', 'Location'])
-            for row in rows:
-                writer.writerow(row)
-                
-    elif data_format == 'xlsx':
-        filename = f'report_{timestamp}.xlsx'
-        filepath = os.path.join('static', filename)
-        
-        # Создаем директорию static если её нет
-        os.makedirs('static', exist_ok=True)
-        
-        workbook = xlsxwriter.Workbook(filepath)
-        worksheet = workbook.add_worksheet()
-        
-        # Заголовки
-        headers = ['Device ID', 'Count', 'Timestamp', 'Status', 'Received At', 'Location']
-        for col, header in enumerate(headers):
-            worksheet.write(0, col, header)
-        
-        # Данные
-        for row_idx, row in enumerate(rows, start=1):
-            for col, value in enumerate(row):
-                worksheet.write(row_idx, col, value)
-        
-        workbook.close()
-        
-    elif data_format == 'pdf':
-        # Базовая поддержка PDF (можно расширить)
-        filename = f'report_{timestamp}.txt'
-        filepath = os.path.join('static', filename)
-        
-        os.makedirs('static', exist_ok=True)
-        
-        with open(filepath, 'w', encoding='utf-8') as txtfile:
-            txtfile.write('BELWEST - Отчет по посещаемости\n')
-            txtfile.write('=' * 50 + '\n\n')
-            txtfile.write(f'Период: {start_date} - {end_date}\n')
-            txtfile.write(f'Дата создания: {datetime.now().strftime("%d.%m.%Y %H:%M:%S")}\n\n')
-            txtfile.write('Device ID\tCount\tTimestamp\tStatus\tReceived At\tLocation\n')
-            txtfile.write('-' * 80 + '\n')
-            for row in rows:
-                txtfile.write('\t'.join(str(x) for x in row) + '\n')
-    else:
-        return jsonify({'error': 'Неподдерживаемый формат'}), 400
+    return _submit_export(data_format, request.form)
+
+@reports.route('/api/export/stream', methods=['GET', 'POST'])
+@requires('reports', 'export')
+def export_data_stream():
+    """Потоковая выгрузка: файл отдаётся в ответе по мере чтения строк, без записи в static"""
+    data_format = request.values.get('format', 'csv')
+    start_date = request.values.get('start_date') or None
+    end_date = request.values.get('end_date') or None
+    
+    try:
+        check_format(data_format)
+        sensor_ids = _parse_id_list(request.values.get('sensor_ids'))
+        store_ids = _parse_id_list(request.values.get('store_ids'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    mimetype = STREAM_FORMATS[data_format][0]
+    filename = export_filename(data_format, start_date, end_date)
     
-    return jsonify({
-        'message': 'Отчет успешно сгенерирован',
-        'filename': filename,
-        'format': data_format
-    })
+    conn = get_db_connection()
+    try:
+        # Выгружаются только датчики из области видимости пользователя
+        sensor_ids = resolve_sensor_ids(conn, sensor_ids, store_ids)
+        visible = _visible_sensor_ids()
+        if visible is not None:
+            sensor_ids = sorted(visible if sensor_ids is None else set(sensor_ids) & visible)
+    except Exception:
+        conn.close()
+        raise
+    
+    # Без Content-Length ответ уходит с chunked transfer encoding
+    return Response(
+        stream_with_context(stream_export(conn, data_format, start_date, end_date, sensor_ids)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+def _parse_id_list(value):
+    """Список id из JSON-массива или строки "1,2,3"; None, если фильтр не задан"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        value = [part for part in value.split(',') if part.strip()]
+    if not isinstance(value, list):
+        raise ValueError('expected a list of ids')
+    return [int(item) for item in value]
+
+@reports.route('/api/export/jobs', methods=['POST'])
+@requires('reports', 'export')
+def create_export_job():
+    """Фоновая выгрузка: задание ставится в очередь, прогресс — через /api/export/jobs/<id>"""
+    data = request.get_json(silent=True) or request.form
+    return _submit_export(data.get('format', 'csv'), data)
+
+def _submit_export(data_format, data):
+    try:
+        job = export_jobs.submit(
+            data_format,
+            start_date=data.get('start_date') or None,
+            end_date=data.get('end_date') or None,
+            sensor_ids=_parse_id_list(data.get('sensor_ids')),
+            store_ids=_parse_id_list(data.get('store_ids')),
+            owner=current_principal()['user_id'],
+            visible_sensor_ids=_visible_sensor_ids()
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    job['download_url'] = f"/api/export/jobs/{job['id']}/download"
+    return jsonify(job), 202
+
+@reports.route('/api/export/jobs', methods=['GET'])
+@requires('reports', 'export')
+def list_export_jobs():
+    return jsonify(export_jobs.list_jobs(owner=current_principal()['user_id']))
+
+@reports.route('/api/export/jobs/<job_id>', methods=['GET'])
+@requires('reports', 'export')
+def get_export_job(job_id):
+    job = export_jobs.get(job_id, owner=current_principal()['user_id'])
+    if job is None:
+        return jsonify({'error': 'Задание не найдено'}), 404
+    return jsonify(job)
+
+@reports.route('/api/export/jobs/<job_id>/download', methods=['GET'])
+@requires('reports', 'export')
+def download_export_job(job_id):
+    result = export_jobs.open_result(job_id, owner=current_principal()['user_id'])
+    if result is None:
+        return jsonify({'error': 'Результат не готов или удален'}), 404
+    path, filename = result
+    return send_file(path, as_attachment=True, download_name=filename)
+
+@reports.route('/api/export/jobs/<job_id>', methods=['DELETE'])
+@requires('reports', 'export')
+def delete_export_job(job_id):
+    if not export_jobs.remove(job_id, owner=current_principal()['user_id']):
+        return jsonify({'error': 'Задание не найдено или еще выполняется'}), 404
+    return jsonify({'message': 'Результат выгрузки удален'})
 def export_data():
     data_format = request.form.get('format', 'csv')
     start_date = request.form.get('start_date')
     end_date = request.form.get('end_date')
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    query = '''
-        SELECT device_id, count, timestamp, status, received_at, location
-        FROM visitor_counts
-        WHERE received_at BETWEEN ? AND ?
-    '''
-    cursor.execute(query, (start_date, end_date))
-    
-    rows = cursor.fetchall()
-    conn.close()
+    with db_connection() as conn:
+        cursor = conn.cursor()
+        
+        query = '''
+            SELECT device_id, count, timestamp, status, received_at, location
+            FROM visitor_counts
+            WHERE received_at BETWEEN ? AND ?
+        '''
+        cursor.execute(query, (start_date, end_date))
+        
+        rows = cursor.fetchall()
     
     if data_format == 'csv':
         filename = 'reports.csv'
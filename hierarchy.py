@@ -0,0 +1,197 @@
+"""
+Иерархия пользователей BELWEST
+Таблица замыкания user_hierarchy_closure хранит все пары (предок, потомок) с глубиной,
+поэтому область видимости пользователя читается одним индексным запросом
+"""
+
+import sqlite3
+from typing import Any, Dict, List, Optional
+
+from cache import ResultCache
+from database import get_db_connection
+
+CLOSURE_TABLE = 'user_hierarchy_closure'
+
+# Защита от циклов, заведённых в user_hierarchy до проверки в add_edge
+MAX_DEPTH = 16
+
+# Сколько секунд область видимости хранится в кэше без изменений иерархии
+SCOPE_TTL = 300.0
+SCOPE_CACHE_SIZE = 1024
+
+
+def ancestors_of(cursor: sqlite3.Cursor, user_id: int) -> List[int]:
+    cursor.execute(f'SELECT ancestor_id FROM {CLOSURE_TABLE} WHERE descendant_id = ?', (user_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def descendants_of(cursor: sqlite3.Cursor, user_id: int) -> List[int]:
+    cursor.execute(f'SELECT descendant_id FROM {CLOSURE_TABLE} WHERE ancestor_id = ?', (user_id,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def rebuild_closure(cursor: sqlite3.Cursor, ancestor_ids: Optional[List[int]] = None):
+    """
+    Пересчёт замыкания по прямым связям user_hierarchy
+
+    Args:
+        cursor: Курсор внутри открытой транзакции
+        ancestor_ids: Пересчитать только строки этих предков (None — всю таблицу)
+    """
+    if ancestor_ids is None:
+        cursor.execute(f'DELETE FROM {CLOSURE_TABLE}')
+        seed = 'SELECT parent_id, child_id, 1 FROM user_hierarchy'
+        params = ()
+    else:
+        ancestor_ids = sorted(set(ancestor_ids))
+        if not ancestor_ids:
+            return
+        placeholders = ', '.join('?' * len(ancestor_ids))
+        cursor.execute(f'DELETE FROM {CLOSURE_TABLE} WHERE ancestor_id IN ({placeholders})', ancestor_ids)
+        seed = f'SELECT parent_id, child_id, 1 FROM user_hierarchy WHERE parent_id IN ({placeholders})'
+        params = tuple(ancestor_ids)
+
+    # Пользователь может подчиняться нескольким руководителям — храним кратчайший путь
+    cursor.execute(f'''
+        WITH RECURSIVE walk(ancestor_id, descendant_id, depth) AS (
+            {seed}
+            UNION
+            SELECT w.ancestor_id, uh.child_id, w.depth + 1
+            FROM walk w
+            JOIN user_hierarchy uh ON uh.parent_id = w.descendant_id
+            WHERE w.depth < ?
+        )
+        INSERT INTO {CLOSURE_TABLE} (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, MIN(depth)
+        FROM walk
+        WHERE ancestor_id != descendant_id
+        GROUP BY ancestor_id, descendant_id
+    ''', params + (MAX_DEPTH,))
+
+
+def add_edge(cursor: sqlite3.Cursor, parent_id: int, child_id: int):
+    """
+    Добавление связи parent → child в замыкание (сама связь уже записана в user_hierarchy)
+
+    Raises:
+        ValueError: если связь замыкает цикл
+    """
+    if parent_id == child_id or parent_id in descendants_of(cursor, child_id):
+        raise ValueError('hierarchy cycle')
+
+    # Все предки родителя (и он сам) получают всех потомков ребёнка (и его самого)
+    cursor.execute(f'''
+        INSERT INTO {CLOSURE_TABLE} (ancestor_id, descendant_id, depth)
+        SELECT a.ancestor_id, d.descendant_id, a.depth + d.depth + 1
+        FROM (
+            SELECT ancestor_id, depth FROM {CLOSURE_TABLE} WHERE descendant_id = ?
+            UNION ALL SELECT ?, 0
+        ) a, (
+            SELECT descendant_id, depth FROM {CLOSURE_TABLE} WHERE ancestor_id = ?
+            UNION ALL SELECT ?, 0
+        ) d
+        WHERE true
+        ON CONFLICT (ancestor_id, descendant_id) DO UPDATE SET depth = MIN(depth, excluded.depth)
+    ''', (parent_id, parent_id, child_id, child_id))
+
+
+def remove_edge(cursor: sqlite3.Cursor, parent_id: int, child_id: int):
+    """Удаление связи из user_hierarchy и пересчёт строк замыкания, которые через неё проходили"""
+    affected = ancestors_of(cursor, parent_id) + [parent_id]
+    cursor.execute('DELETE FROM user_hierarchy WHERE parent_id = ? AND child_id = ?', (parent_id, child_id))
+    rebuild_closure(cursor, affected)
+
+
+def remove_user(cursor: sqlite3.Cursor, user_id: int):
+    """Удаление всех связей пользователя из user_hierarchy и замыкания"""
+    affected = ancestors_of(cursor, user_id)
+    cursor.execute('DELETE FROM user_hierarchy WHERE parent_id = ? OR child_id = ?', (user_id, user_id))
+    cursor.execute(f'DELETE FROM {CLOSURE_TABLE} WHERE ancestor_id = ? OR descendant_id = ?', (user_id, user_id))
+    rebuild_closure(cursor, affected)
+
+
+class ScopeResolver:
+    def __init__(self, db_path: Optional[str] = None, ttl: float = SCOPE_TTL,
+                 max_entries: int = SCOPE_CACHE_SIZE):
+        """
+        Инициализация кэша областей видимости
+
+        Args:
+            db_path: Путь к базе данных (по умолчанию общая база приложения)
+            ttl: Максимальный возраст области видимости (секунды)
+            max_entries: Максимальное число пользователей в кэше
+        """
+        self.db_path = db_path
+        # Права не должны переживать изменение иерархии, поэтому min_age = 0
+        self._cache = ResultCache(max_entries=max_entries, ttl=ttl, min_age=0)
+        self._listeners = []
+
+    def resolve(self, user_id: Optional[int], role: Optional[str]) -> Dict[str, Any]:
+        """
+        Пользователи, магазины и датчики, видимые пользователю
+
+        Видимы сам пользователь и все его подчинённые на любой глубине, магазины,
+        где кто-то из них ТУ или РД, датчики этих магазинов и датчики, назначенные
+        видимым пользователям.
+
+        Returns:
+            {'all': True, ...} для администратора, иначе множества id
+        """
+        if role == 'admin':
+            return {'all': True, 'user_ids': None, 'store_ids': None, 'sensor_ids': None}
+        if user_id is None:
+            return {'all': False, 'user_ids': frozenset(), 'store_ids': frozenset(), 'sensor_ids': frozenset()}
+        return self._cache.get_or_compute(('scope', user_id), lambda: self._load(user_id))
+
+    def invalidate(self, *args):
+        """Сброс после изменения иерархии, магазинов или назначений датчиков"""
+        self._cache.invalidate()
+        for listener in self._listeners:
+            listener()
+
+    def add_invalidate_listener(self, listener):
+        """Подписка на сброс: listener() вызывается после каждого invalidate()"""
+        self._listeners.append(listener)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+    def _load(self, user_id: int) -> Dict[str, Any]:
+        conn = get_db_connection(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                WITH visible(user_id) AS (
+                    SELECT ?
+                    UNION
+                    SELECT descendant_id FROM {CLOSURE_TABLE} WHERE ancestor_id = ?
+                ),
+                visible_stores(store_id) AS (
+                    SELECT id FROM stores WHERE tu_id IN visible OR rd_id IN visible
+                )
+                SELECT 'user', user_id FROM visible
+                UNION ALL
+                SELECT 'store', store_id FROM visible_stores
+                UNION ALL
+                SELECT 'sensor', sensor_id FROM user_sensors WHERE user_id IN visible
+                UNION ALL
+                SELECT 'sensor', sensor_id FROM store_sensors WHERE store_id IN visible_stores
+            ''', (user_id, user_id))
+
+            scope = {'user': set(), 'store': set(), 'sensor': set()}
+            for kind, entity_id in cursor.fetchall():
+                if entity_id is not None:
+                    scope[kind].add(entity_id)
+        finally:
+            conn.close()
+
+        return {
+            'all': False,
+            'user_ids': frozenset(scope['user']),
+            'store_ids': frozenset(scope['store']),
+            'sensor_ids': frozenset(scope['sensor'])
+        }
+
+
+# Общий резолвер областей видимости процесса
+scope_resolver = ScopeResolver()
@@ -0,0 +1,364 @@
+"""
+Асинхронный приём данных от датчиков BELWEST
+Отдельный HTTP/1.1-сервер на asyncio для /api/visitor-count: тысячи keep-alive соединений
+обслуживаются одним потоком, а медленное устройство не занимает поток веб-интерфейса
+"""
+
+import asyncio
+import json
+import sys
+import threading
+from datetime import datetime
+from http import HTTPStatus
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+from ingestion import IngestionBuffer, split_batch, parse_samples
+
+DEFAULT_PORT = 5001
+MAX_CONNECTIONS = 10000
+
+# Соединение без новых запросов закрывается через IDLE_TIMEOUT секунд,
+# тело запроса должно прийти целиком за BODY_TIMEOUT секунд
+IDLE_TIMEOUT = 75.0
+BODY_TIMEOUT = 30.0
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 4 * 1024 * 1024
+MAX_BATCH_SAMPLES = 10000
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def parse_head(head: bytes) -> Tuple[str, str, str, Dict[str, str]]:
+    """
+    Разбор строки запроса и заголовков
+
+    Returns:
+        (метод, путь без query string, версия протокола, заголовки в нижнем регистре)
+
+    Raises:
+        HTTPError: если запрос некорректен
+    """
+    try:
+        lines = head.decode('latin-1').split('\r\n')
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HTTPError(400, 'Malformed request line')
+    if not version.startswith('HTTP/1.'):
+        raise HTTPError(505, 'HTTP version not supported')
+
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise HTTPError(400, 'Malformed header')
+        headers[name.strip().lower()] = value.strip()
+
+    return method, target.split('?', 1)[0], version, headers
+
+
+def build_response(status: int, payload: Dict[str, Any], keep_alive: bool) -> bytes:
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    head = (
+        f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'
+        f'Content-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+        f'\r\n'
+    )
+    return head.encode('latin-1') + body
+
+
+class IngestServer:
+    def __init__(self, buffer: IngestionBuffer, host: str = '0.0.0.0', port: int = DEFAULT_PORT,
+                 max_connections: int = MAX_CONNECTIONS, idle_timeout: float = IDLE_TIMEOUT,
+                 max_batch_samples: int = MAX_BATCH_SAMPLES):
+        """
+        Инициализация сервера приёма
+
+        Args:
+            buffer: Буфер, в который ставятся замеры (запись в базу — в его фоновом потоке)
+            host: Адрес для прослушивания
+            port: Порт (0 — выбрать свободный)
+            max_connections: Предел одновременных соединений; сверх него отвечаем 503
+            idle_timeout: Через сколько секунд закрывать соединение без запросов
+            max_batch_samples: Предел замеров в одном пакетном запросе
+        """
+        self.buffer = buffer
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.max_batch_samples = max_batch_samples
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._stats = {
+            'connections': 0,
+            'peak_connections': 0,
+            'total_connections': 0,
+            'rejected_connections': 0,
+            'requests': 0,
+            'errors': 0,
+            'started_at': None
+        }
+
+    def start(self):
+        """Запуск сервера в отдельном потоке со своим циклом событий"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._run, name='ingest-server', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        if self._loop is None or self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._server.close)
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats['port'] = self.port
+        stats['running'] = self._thread is not None and self._thread.is_alive()
+        return stats
+
+    async def serve(self):
+        """Приём соединений до закрытия сервера (для запуска в уже работающем цикле событий)"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port,
+                                                  limit=MAX_HEADER_BYTES, backlog=2048)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._stats['started_at'] = datetime.now().isoformat()
+        self._ready.set()
+        print(f"Сервер приёма данных слушает {self.host}:{self.port}")
+        try:
+            await self._server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self.serve())
+        finally:
+            self._ready.set()
+            self._loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        stats = self._stats
+        if stats['connections'] >= self.max_connections:
+            stats['rejected_connections'] += 1
+            writer.write(build_response(503, {'status': 'error', 'message': 'Too many connections'}, False))
+            await self._close(writer)
+            return
+
+        stats['connections'] += 1
+        stats['total_connections'] += 1
+        stats['peak_connections'] = max(stats['peak_connections'], stats['connections'])
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.idle_timeout)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(build_response(431, {'status': 'error', 'message': 'Headers too large'}, False))
+                    break
+
+                keep_alive = False
+                try:
+                    method, path, version, headers = parse_head(head)
+                    keep_alive = headers.get('connection', '').lower() != 'close' if version == 'HTTP/1.1' \
+                        else headers.get('connection', '').lower() == 'keep-alive'
+                    body = await self._read_body(reader, method, headers)
+                    status, payload = self.dispatch(method, path, headers, body)
+                except HTTPError as e:
+                    status, payload = e.status, {'status': 'error', 'message': e.message}
+                    keep_alive = False
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                stats['requests'] += 1
+                if status >= 400:
+                    stats['errors'] += 1
+                writer.write(build_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            stats['connections'] -= 1
+            await self._close(writer)
+
+    async def _read_body(self, reader: asyncio.StreamReader, method: str, headers: Dict[str, str]) -> bytes:
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HTTPError(411, 'Chunked bodies are not supported, send Content-Length')
+        try:
+            length = int(headers.get('content-length', '0'))
+        except ValueError:
+            raise HTTPError(400, 'Invalid Content-Length')
+        if length < 0:
+            raise HTTPError(400, 'Invalid Content-Length')
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, 'Request body too large')
+        if not length:
+            return b''
+        return await asyncio.wait_for(reader.readexactly(length), BODY_TIMEOUT)
+
+    @staticmethod
+    async def _close(writer: asyncio.StreamWriter):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    def dispatch(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> Tuple[int, Dict[str, Any]]:
+        """Обработка одного запроса: (HTTP-статус, тело ответа)"""
+        routes = {
+            '/api/visitor-count': ('POST', self.visitor_count),
+            '/api/visitor-count/batch': ('POST', self.visitor_count_batch),
+            '/api/ingestion/health': ('GET', self.health)
+        }
+        route = routes.get(path.rstrip('/') or '/')
+        if route is None:
+            raise HTTPError(404, 'Not found')
+        if method != route[0]:
+            raise HTTPError(405, 'Method not allowed')
+        mimetype = headers.get('content-type', '').split(';', 1)[0].strip().lower()
+        return route[1](body.decode('utf-8', errors='replace'), mimetype)
+
+    def visitor_count(self, body: str, mimetype: str) -> Tuple[int, Dict[str, Any]]:
+        """Замер от Arduino — те же поля и ответы, что у /api/visitor-count веб-приложения"""
+        try:
+            data = None
+            if mimetype != 'application/x-www-form-urlencoded':
+                try:
+                    data = json.loads(body) if body else None
+                except ValueError:
+                    data = None
+            if not data:
+                form = {key: values[0] for key, values in parse_qs(body).items()}
+                data = {
+                    'device_id': form.get('device_id', 'unknown'),
+                    'count': int(form.get('count', 0)),
+                    'status': form.get('status', 'online')
+                }
+            if not isinstance(data, dict):
+                raise ValueError('Expected an object')
+
+            device_id = data.get('device_id', 'unknown')
+            visitor_count = int(data.get('count', 0))
+            status = data.get('status', 'online')
+        except (TypeError, ValueError) as e:
+            return 400, {'status': 'error', 'message': str(e)}
+
+        if not self.buffer.submit(device_id, visitor_count, status):
+            return 503, {'status': 'error', 'message': 'Ingestion queue is full'}
+        return 200, {'status': 'success', 'message': 'Data received'}
+
+    def visitor_count_batch(self, body: str, mimetype: str) -> Tuple[int, Dict[str, Any]]:
+        """
+        Пакет замеров от шлюза
+
+        В отличие от веб-приложения, пакет не пишется отдельной транзакцией, а ставится
+        в буфер вместе с остальными замерами; ответ приходит до записи в базу.
+        """
+        try:
+            items, errors = split_batch(body, mimetype)
+        except ValueError as e:
+            return 400, {'status': 'error', 'message': str(e)}
+        if len(items) + len(errors) > self.max_batch_samples:
+            return 413, {'status': 'error', 'message': 'Too many samples in one batch'}
+
+        samples, invalid = parse_samples(items)
+        errors.extend(invalid)
+
+        accepted = 0
+        for sample in samples:
+            if not self.buffer.submit(sample['device_id'], sample['count'], sample['status'],
+                                      sample['received_at']):
+                break
+            accepted += 1
+        if accepted < len(samples):
+            return 503, {'status': 'error', 'message': 'Ingestion queue is full', 'accepted': accepted}
+
+        errors.sort()
+        return 200, {
+            'status': 'success' if not errors else 'partial',
+            'accepted': accepted,
+            'rejected': len(errors),
+            'errors': errors
+        }
+
+    def health(self, body: str, mimetype: str) -> Tuple[int, Dict[str, Any]]:
+        buffer = self.buffer.stats()
+        return 200, {
+            'status': 'ok',
+            'connections': self._stats['connections'],
+            'queue_depth': buffer['queue_depth'],
+            'oldest_sample_age': buffer['oldest_sample_age']
+        }
+
+
+if __name__ == '__main__':
+    # Отдельный процесс приёма данных рядом с веб-приложением:
+    #   python ingest_server.py [порт] [путь к базе]
+    # В базу пишут оба процесса, поэтому приём работает в режиме нескольких процессов:
+    # датчики регистрируются и счётчики читаются под блокировкой записи, а новые замеры
+    # передаются веб-приложению (поток событий, кэши, свёртка) через журнал shared_state.
+    # Веб-приложение тоже должно работать в этом режиме: INGEST_SERVER_PORT = None в server.py
+    # или run_production.py
+    from database import DB_PATH, connect, get_db_connection
+    from events import event_broker
+    from ingestion import add_write_listener
+    from migrations import run_migrations
+    from sensor_registry import registry
+    from shared_state import shared_state
+
+    args = sys.argv[1:]
+    port = int(args[0]) if args else DEFAULT_PORT
+    db_path = args[1] if len(args) > 1 else DB_PATH
+
+    conn = connect(db_path)
+    run_migrations(conn)
+    conn.close()
+
+    def reload_registry(*args):
+        conn = get_db_connection(db_path)
+        try:
+            registry.load(conn)
+        finally:
+            conn.close()
+
+    reload_registry()
+    registry.shared = True
+    shared_state.db_path = db_path
+    event_broker.db_path = db_path
+    add_write_listener(event_broker.on_write)
+    shared_state.on('events', event_broker.apply_remote)
+    shared_state.on('sensors', reload_registry)
+    shared_state.start()
+
+    buffer = IngestionBuffer(db_path)
+    buffer.start()
+    server = IngestServer(buffer, port=port)
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        buffer.stop()
+        shared_state.stop()
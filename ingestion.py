@@ -0,0 +1,462 @@
+"""
+Буферизованный приём данных от датчиков BELWEST
+Принимает замеры сразу, а записывает их в базу фоновым потоком пакетами
+"""
+
+import json
+import sqlite3
+import threading
+import atexit
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional, Tuple
+
+from sensor_registry import registry
+from database import connect
+from partitions import insert_rows
+
+# Допустимые статусы, которые присылают устройства и шлюзы
+VALID_STATUSES = {'online', 'offline', 'active', 'inactive', 'error'}
+
+# Повторы записи пакета, когда база занята другим писателем: число попыток и пауза перед первым
+# повтором (секунды); пауза удваивается с каждой попыткой
+FLUSH_RETRIES = 5
+FLUSH_RETRY_DELAY = 0.1
+
+# Слушатели, которые вызываются после каждой успешной записи пакета
+_write_listeners = []
+
+# Разбор приращений и запись пакета выполняются по одному, иначе два писателя
+# прочитали бы одно и то же последнее значение счётчика
+_write_lock = threading.Lock()
+
+
+def is_busy_error(error: sqlite3.OperationalError) -> bool:
+    """Ошибка из-за блокировки базы другим соединением (SQLITE_BUSY / SQLITE_LOCKED), которая проходит при повторе"""
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xff in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def add_write_listener(listener):
+    """
+    Подписка на записанные пакеты замеров
+
+    Args:
+        listener: Функция listener(samples, sensor_ids), вызывается после фиксации транзакции;
+            у каждого замера заполнено visitor_delta — приращение, записанное в visitor_data
+    """
+    _write_listeners.append(listener)
+
+
+def parse_sample(item: Any) -> Dict[str, Any]:
+    """
+    Проверка и нормализация одного замера из пакета шлюза
+
+    Args:
+        item: Объект {device_id, count, timestamp, status}
+
+    Returns:
+        Замер вида {device_id, count, status, received_at}
+
+    Raises:
+        ValueError: если замер некорректен
+    """
+    if not isinstance(item, dict):
+        raise ValueError('sample must be an object')
+
+    device_id = item.get('device_id')
+    if not isinstance(device_id, str) or not device_id.strip():
+        raise ValueError('device_id is required')
+
+    count = item.get('count', 0)
+    if isinstance(count, bool) or not isinstance(count, (int, float, str)):
+        raise ValueError('count must be a number')
+    try:
+        count = int(count)
+    except ValueError:
+        raise ValueError('count must be a number')
+    if count < 0:
+        raise ValueError('count must be non-negative')
+
+    status = item.get('status', 'online')
+    if status not in VALID_STATUSES:
+        raise ValueError(f'unknown status: {status}')
+
+    # Устройства присылают эпоху с уже учтённым часовым поясом (TIME_ZONE_OFFSET),
+    # поэтому переводим её в "настенное" время без повторного сдвига
+    timestamp = item.get('timestamp')
+    if timestamp is None:
+        received_at = datetime.now()
+    else:
+        if isinstance(timestamp, bool) or not isinstance(timestamp, (int, float)):
+            raise ValueError('timestamp must be a unix time')
+        try:
+            received_at = datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError('timestamp is out of range')
+
+    return {
+        'device_id': device_id.strip(),
+        'count': count,
+        'status': status,
+        'received_at': received_at
+    }
+
+
+def split_batch(body: str, mimetype: Optional[str]) -> Tuple[List[Tuple[int, Any]], List[List[Any]]]:
+    """
+    Разбор тела пакетного запроса: JSON-массив, объект {"samples": [...]} или NDJSON
+
+    Args:
+        body: Тело запроса
+        mimetype: Тип содержимого запроса
+
+    Returns:
+        (пары (индекс, объект замера), ошибки [индекс, сообщение] для строк NDJSON, которые не разобрались)
+
+    Raises:
+        ValueError: если JSON разобрался, но это не массив замеров
+    """
+    errors = []
+    items = []
+    if mimetype in ('application/x-ndjson', 'application/jsonl'):
+        lines = body.splitlines()
+    else:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            lines = body.splitlines()
+        else:
+            lines = None
+            if isinstance(payload, dict):
+                payload = payload.get('samples')
+            if not isinstance(payload, list):
+                raise ValueError('Expected an array of samples')
+            items = list(enumerate(payload))
+
+    if lines is not None:
+        index = 0
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                items.append((index, json.loads(line)))
+            except ValueError:
+                errors.append([index, 'invalid JSON'])
+            index += 1
+
+    return items, errors
+
+
+def parse_samples(items: List[Tuple[int, Any]]) -> Tuple[List[Dict[str, Any]], List[List[Any]]]:
+    """Проверка всех замеров пакета за один проход: (корректные замеры, ошибки [индекс, сообщение])"""
+    samples = []
+    errors = []
+    for index, item in items:
+        try:
+            samples.append(parse_sample(item))
+        except ValueError as e:
+            errors.append([index, str(e)])
+    return samples, errors
+
+
+def timestamp_text(value: Any) -> Optional[str]:
+    """Время замера в том виде, в котором оно хранится в visitor_data.timestamp"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return str(value)
+    return str(value).replace('T', ' ', 1)
+
+
+def decode_delta(count: int, timestamp: str, previous: Optional[Tuple[int, str]]) -> Tuple[int, bool]:
+    """
+    Приращение посетителей по накопительному счётчику устройства
+
+    Скетч присылает число посетителей с начала дня (счётчик обнуляется в checkDailyReset
+    и при ручном сбросе), поэтому в visitor_data хранится и сам счётчик, и приращение
+    с предыдущего замера.
+
+    Args:
+        count: Значение счётчика в замере
+        timestamp: Время замера (timestamp_text)
+        previous: Последнее значение счётчика и время замера или None
+
+    Returns:
+        (приращение, становится ли замер новым последним значением счётчика)
+    """
+    if previous is None:
+        return count, True
+
+    previous_count, previous_timestamp = previous
+    if timestamp < previous_timestamp:
+        # Запоздавший замер уже учтён в более позднем значении счётчика
+        return 0, False
+    if timestamp[:10] != previous_timestamp[:10] or count < previous_count:
+        # Новый день или сброс счётчика: всё, что насчитано, пришло после сброса
+        return count, True
+    return count - previous_count, True
+
+
+def update_sensor_latest(cursor: sqlite3.Cursor, readings: List[Tuple[int, int, Optional[int], Any]]):
+    """
+    Обновление последнего показания датчиков в sensor_latest
+
+    Args:
+        cursor: Курсор внутри открытой транзакции
+        readings: Строки (sensor_id, visitor_count, visitor_delta, timestamp)
+    """
+    # Запоздавший замер не перезаписывает более свежее показание
+    cursor.executemany('''
+        INSERT INTO sensor_latest (sensor_id, visitor_count, visitor_delta, timestamp, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(sensor_id) DO UPDATE SET
+            visitor_count = excluded.visitor_count,
+            visitor_delta = excluded.visitor_delta,
+            timestamp = excluded.timestamp,
+            updated_at = excluded.updated_at
+        WHERE sensor_latest.timestamp IS NULL OR excluded.timestamp >= sensor_latest.timestamp
+    ''', [(sensor_id, count, delta, timestamp_text(timestamp), datetime.now().isoformat())
+          for sensor_id, count, delta, timestamp in readings])
+
+
+def write_samples(conn: sqlite3.Connection, samples: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Запись пакета замеров в базу одной транзакцией
+
+    Args:
+        conn: Соединение с базой данных без открытой транзакции
+        samples: Замеры вида {device_id, count, status, received_at}
+
+    Returns:
+        Словарь {device_id: sensor_id} для всех устройств пакета
+    """
+    with _write_lock:
+        # Имена устройств разрешаются через реестр, новые датчики регистрируются сразу
+        sensor_ids = registry.resolve_many(conn, samples)
+
+        # Последний замер по каждому устройству определяет состояние датчика
+        latest = {}
+        for sample in samples:
+            latest[sample['device_id']] = sample
+
+        cursor = conn.cursor()
+        try:
+            if registry.shared:
+                # Замеры тех же устройств пишут и другие процессы: счётчики читаются под блокировкой записи
+                cursor.execute('BEGIN IMMEDIATE')
+                registry.load_counters(cursor, set(sensor_ids.values()))
+
+            # Приращения считаются от последнего значения счётчика, включая замеры этого же пакета
+            counters = {}
+            readings = {}
+            rows = []
+            for sample in samples:
+                sensor_id = sensor_ids[sample['device_id']]
+                timestamp = timestamp_text(sample['received_at'])
+                previous = counters.get(sensor_id) or registry.get_counter(sensor_id)
+                delta, is_latest = decode_delta(sample['count'], timestamp, previous)
+                sample['visitor_delta'] = delta
+                row = (sensor_id, sample['count'], delta, sample['received_at'])
+                if is_latest:
+                    counters[sensor_id] = (sample['count'], timestamp)
+                    readings[sensor_id] = row
+                rows.append(row)
+
+            cursor.executemany('''
+                UPDATE sensors
+                SET status = ?, last_update = ?, visitor_count = ?
+                WHERE id = ?
+            ''', [(sample['status'], sample['received_at'], sample['count'], sensor_ids[device_id])
+                  for device_id, sample in latest.items()])
+
+            cursor.executemany('''
+                UPDATE sensors
+                SET last_counter = ?, last_counter_at = ?
+                WHERE id = ?
+            ''', [(count, timestamp, sensor_id) for sensor_id, (count, timestamp) in counters.items()])
+
+            insert_rows(cursor, rows)
+            update_sensor_latest(cursor, list(readings.values()))
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        for sensor_id, (count, timestamp) in counters.items():
+            registry.set_counter(sensor_id, count, timestamp)
+        for device_id, sample in latest.items():
+            registry.record(sensor_ids[device_id], sample['status'], sample['count'], sample['received_at'])
+
+    for listener in _write_listeners:
+        try:
+            listener(samples, sensor_ids)
+        except Exception as e:
+            print(f"Ошибка обработчика записи замеров: {e}")
+
+    return sensor_ids
+
+
+class IngestionBuffer:
+    def __init__(self, db_path: str, max_batch_size: int = 500,
+                 max_batch_age: float = 1.0, max_queue_size: int = 100000):
+        """
+        Инициализация буфера приёма данных
+
+        Args:
+            db_path: Путь к базе данных
+            max_batch_size: Максимальное число замеров в одной транзакции
+            max_batch_age: Максимальное время ожидания замера в буфере (секунды)
+            max_queue_size: Предел очереди, после которого новые замеры отклоняются
+        """
+        self.db_path = db_path
+        self.max_batch_size = max_batch_size
+        self.max_batch_age = max_batch_age
+        self.max_queue_size = max_queue_size
+
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+        self._stats = {
+            'accepted': 0,
+            'rejected': 0,
+            'written': 0,
+            'failed': 0,
+            'retries': 0,
+            'flushes': 0,
+            'last_batch_size': 0,
+            'last_flush_latency_ms': 0.0,
+            'max_flush_latency_ms': 0.0,
+            'total_flush_latency_ms': 0.0,
+            'last_flush_at': None
+        }
+
+    def start(self):
+        """Запуск фонового потока записи"""
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='ingestion-writer', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, device_id: str, count: int, status: str = 'online',
+               received_at: Optional[datetime] = None) -> bool:
+        """
+        Постановка замера в очередь на запись
+
+        Returns:
+            False, если очередь переполнена и замер не принят
+        """
+        if self._thread is None:
+            self.start()
+
+        sample = {
+            'device_id': device_id,
+            'count': count,
+            'status': status,
+            'received_at': received_at or datetime.now(),
+            'queued_at': time.monotonic()
+        }
+
+        with self._condition:
+            if self._stopping or len(self._queue) >= self.max_queue_size:
+                self._stats['rejected'] += 1
+                return False
+            self._queue.append(sample)
+            self._stats['accepted'] += 1
+            # Первый замер запускает отсчёт возраста пакета, полный пакет пишется сразу
+            if len(self._queue) == 1 or len(self._queue) >= self.max_batch_size:
+                self._condition.notify()
+        return True
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        """Остановка потока записи с дозаписью оставшихся замеров"""
+        with self._condition:
+            if self._thread is None:
+                return
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        """Текущее состояние буфера: глубина очереди и задержки записи"""
+        with self._condition:
+            stats = dict(self._stats)
+            stats['queue_depth'] = len(self._queue)
+            stats['oldest_sample_age'] = (
+                round(time.monotonic() - self._queue[0]['queued_at'], 3) if self._queue else 0.0
+            )
+            stats['running'] = self._thread is not None and self._thread.is_alive()
+
+        total_latency = stats.pop('total_flush_latency_ms')
+        stats['avg_flush_latency_ms'] = round(total_latency / stats['flushes'], 3) if stats['flushes'] else 0.0
+        return stats
+
+    def _next_batch(self) -> List[Dict[str, Any]]:
+        """Ожидание пакета, готового к записи (по размеру или возрасту)"""
+        with self._condition:
+            while True:
+                if self._queue:
+                    age = time.monotonic() - self._queue[0]['queued_at']
+                    if self._stopping or len(self._queue) >= self.max_batch_size or age >= self.max_batch_age:
+                        count = min(len(self._queue), self.max_batch_size)
+                        return [self._queue.popleft() for _ in range(count)]
+                    self._condition.wait(self.max_batch_age - age)
+                elif self._stopping:
+                    return []
+                else:
+                    self._condition.wait()
+
+    def _run(self):
+        # Писатель держит собственное соединение на всё время работы
+        conn = connect(self.db_path)
+        try:
+            while True:
+                batch = self._next_batch()
+                if not batch:
+                    break
+                self._flush(conn, batch)
+        finally:
+            conn.close()
+
+    def _flush(self, conn: sqlite3.Connection, batch: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                write_samples(conn, batch)
+                break
+            except sqlite3.OperationalError as e:
+                # База занята другим писателем: повторяем с растущей паузой, остальные ошибки не пройдут и при повторе
+                if is_busy_error(e) and attempt < FLUSH_RETRIES:
+                    print(f"База занята, повтор записи пакета замеров: {e}")
+                    with self._condition:
+                        self._stats['retries'] += 1
+                    time.sleep(FLUSH_RETRY_DELAY * 2 ** attempt)
+                    attempt += 1
+                    continue
+                print(f"Ошибка записи пакета замеров: {e}")
+            except Exception as e:
+                print(f"Ошибка записи пакета замеров: {e}")
+            with self._condition:
+                self._stats['failed'] += len(batch)
+            return
+
+        latency_ms = (time.perf_counter() - started) * 1000
+        with self._condition:
+            self._stats['written'] += len(batch)
+            self._stats['flushes'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['last_flush_latency_ms'] = round(latency_ms, 3)
+            self._stats['max_flush_latency_ms'] = round(max(self._stats['max_flush_latency_ms'], latency_ms), 3)
+            self._stats['total_flush_latency_ms'] += latency_ms
+            self._stats['last_flush_at'] = datetime.now().isoformat()
@@ -0,0 +1,340 @@
+"""
+Миграции схемы базы данных BELWEST
+Версионированные изменения схемы (индексы, ограничения), которые применяются при старте сервера
+"""
+
+import sqlite3
+import sys
+from datetime import datetime
+from typing import Dict, List, Any, Tuple
+
+from ingestion import decode_delta, timestamp_text
+from partitions import migrate_legacy_table
+from hierarchy import rebuild_closure
+
+
+def _backfill_visitor_deltas(cursor: sqlite3.Cursor):
+    """Приращения для уже записанных замеров и последнее значение счётчика каждого датчика"""
+    cursor.execute('SELECT DISTINCT sensor_id FROM visitor_data WHERE sensor_id IS NOT NULL')
+    for (sensor_id,) in cursor.fetchall():
+        cursor.execute('''
+            SELECT id, visitor_count, timestamp
+            FROM visitor_data
+            WHERE sensor_id = ? AND timestamp IS NOT NULL
+            ORDER BY timestamp, id
+        ''', (sensor_id,))
+
+        previous = None
+        updates = []
+        for row_id, count, timestamp in cursor.fetchall():
+            count = count or 0
+            timestamp = timestamp_text(timestamp)
+            delta, is_latest = decode_delta(count, timestamp, previous)
+            if is_latest:
+                previous = (count, timestamp)
+            updates.append((delta, row_id))
+
+        cursor.executemany('UPDATE visitor_data SET visitor_delta = ? WHERE id = ?', updates)
+        if previous is not None:
+            cursor.execute('''
+                UPDATE sensors SET last_counter = ?, last_counter_at = ? WHERE id = ?
+            ''', (previous[0], previous[1], sensor_id))
+
+
+# Каждая миграция: (версия, описание, шаги). Шаг — SQL-строка или функция, принимающая курсор.
+# Миграции применяются строго по возрастанию версии, каждая в своей транзакции.
+MIGRATIONS = [
+    (1, 'Индексы visitor_data по датчику и времени', [
+        'CREATE INDEX IF NOT EXISTS idx_visitor_data_sensor_timestamp ON visitor_data (sensor_id, timestamp)',
+        'CREATE INDEX IF NOT EXISTS idx_visitor_data_timestamp ON visitor_data (timestamp)'
+    ]),
+    (2, 'Индекс sensors по имени устройства', [
+        'CREATE INDEX IF NOT EXISTS idx_sensors_name ON sensors (name)'
+    ]),
+    (3, 'Уникальные привязки датчиков к пользователям и магазинам', [
+        # Удаляем дубли привязок, оставляя самую раннюю запись
+        '''
+            DELETE FROM user_sensors
+            WHERE id NOT IN (SELECT MIN(id) FROM user_sensors GROUP BY user_id, sensor_id)
+        ''',
+        '''
+            DELETE FROM store_sensors
+            WHERE id NOT IN (SELECT MIN(id) FROM store_sensors GROUP BY store_id, sensor_id)
+        ''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_user_sensors_user_sensor ON user_sensors (user_id, sensor_id)',
+        'CREATE INDEX IF NOT EXISTS idx_user_sensors_sensor ON user_sensors (sensor_id)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_store_sensors_store_sensor ON store_sensors (store_id, sensor_id)',
+        'CREATE INDEX IF NOT EXISTS idx_store_sensors_sensor ON store_sensors (sensor_id)'
+    ]),
+    (4, 'Индексы hourly_statistics и user_hierarchy', [
+        'CREATE INDEX IF NOT EXISTS idx_hourly_statistics_store_sensor ON hourly_statistics (store_id, sensor_id)',
+        'CREATE INDEX IF NOT EXISTS idx_user_hierarchy_child ON user_hierarchy (child_id)'
+    ]),
+    (5, 'Почасовые агрегаты в hourly_statistics', [
+        'ALTER TABLE hourly_statistics ADD COLUMN sample_count INTEGER DEFAULT 0',
+        'ALTER TABLE hourly_statistics ADD COLUMN bucket_start TIMESTAMP',
+        '''
+            CREATE TABLE IF NOT EXISTS rollup_state (
+                name TEXT PRIMARY KEY,
+                last_id INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_hourly_statistics_bucket ON hourly_statistics (bucket_start)',
+        'CREATE INDEX IF NOT EXISTS idx_hourly_statistics_sensor_bucket ON hourly_statistics (sensor_id, bucket_start)'
+    ]),
+    (6, 'Приращения накопительных счётчиков в visitor_data', [
+        'ALTER TABLE visitor_data ADD COLUMN visitor_delta INTEGER',
+        'ALTER TABLE sensors ADD COLUMN last_counter INTEGER',
+        'ALTER TABLE sensors ADD COLUMN last_counter_at TIMESTAMP',
+        _backfill_visitor_deltas,
+        # Агрегаты были посчитаны по накопительным значениям — пересобираем их по приращениям
+        'DELETE FROM hourly_statistics WHERE bucket_start IS NOT NULL',
+        'DELETE FROM rollup_state'
+    ]),
+    (7, 'Помесячные секции visitor_data', [
+        migrate_legacy_table
+    ]),
+    (8, 'Последнее показание каждого датчика в sensor_latest', [
+        '''
+            CREATE TABLE IF NOT EXISTS sensor_latest (
+                sensor_id INTEGER PRIMARY KEY,
+                visitor_count INTEGER DEFAULT 0,
+                visitor_delta INTEGER,
+                timestamp TIMESTAMP,
+                updated_at TIMESTAMP,
+                FOREIGN KEY (sensor_id) REFERENCES sensors (id)
+            )
+        ''',
+        '''
+            INSERT OR REPLACE INTO sensor_latest (sensor_id, visitor_count, visitor_delta, timestamp, updated_at)
+            SELECT sensor_id, visitor_count, visitor_delta, timestamp, CURRENT_TIMESTAMP
+            FROM (
+                SELECT
+                    sensor_id, visitor_count, visitor_delta, timestamp,
+                    ROW_NUMBER() OVER (PARTITION BY sensor_id ORDER BY timestamp DESC, id DESC) as position
+                FROM visitor_data
+                WHERE sensor_id IS NOT NULL
+            )
+            WHERE position = 1
+        '''
+    ]),
+    (9, 'Таблица замыкания иерархии пользователей', [
+        '''
+            CREATE TABLE IF NOT EXISTS user_hierarchy_closure (
+                ancestor_id INTEGER NOT NULL,
+                descendant_id INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                PRIMARY KEY (ancestor_id, descendant_id)
+            ) WITHOUT ROWID
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_user_hierarchy_closure_descendant ON user_hierarchy_closure (descendant_id, ancestor_id)',
+        rebuild_closure
+    ]),
+    (10, 'Журнал изменений для согласования процессов', [
+        '''
+            CREATE TABLE IF NOT EXISTS shared_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                origin INTEGER NOT NULL,
+                payload TEXT,
+                created_at REAL NOT NULL
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_shared_events_created_at ON shared_events (created_at)'
+    ]),
+    (11, 'Заранее рассчитанные результаты AI агента', [
+        '''
+            CREATE TABLE IF NOT EXISTS ai_results (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                computed_at TIMESTAMP NOT NULL,
+                high_water_mark INTEGER NOT NULL DEFAULT 0,
+                compute_ms REAL
+            )
+        '''
+    ]),
+    (12, 'Параметры сезонных моделей прогноза', [
+        '''
+            CREATE TABLE IF NOT EXISTS forecast_models (
+                kind TEXT NOT NULL,
+                entity_id INTEGER NOT NULL,
+                stats BLOB NOT NULL,
+                observations INTEGER NOT NULL DEFAULT 0,
+                last_bucket INTEGER NOT NULL,
+                fitted_at TIMESTAMP NOT NULL,
+                PRIMARY KEY (kind, entity_id)
+            ) WITHOUT ROWID
+        '''
+    ]),
+    (13, 'Последние часы, учтённые в моделях прогноза', [
+        '''
+            CREATE TABLE IF NOT EXISTS forecast_recent (
+                bucket INTEGER NOT NULL,
+                sensor_id INTEGER NOT NULL,
+                store_id INTEGER NOT NULL,
+                visitor_count INTEGER NOT NULL,
+                PRIMARY KEY (bucket, sensor_id, store_id)
+            ) WITHOUT ROWID
+        '''
+    ]),
+    (14, 'Задания выгрузки, общие для всех процессов', [
+        '''
+            CREATE TABLE IF NOT EXISTS export_jobs (
+                id TEXT PRIMARY KEY,
+                job_key TEXT NOT NULL,
+                owner INTEGER,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 1,
+                rows_written INTEGER NOT NULL DEFAULT 0,
+                total_rows INTEGER,
+                bytes_written INTEGER NOT NULL DEFAULT 0,
+                filename TEXT NOT NULL,
+                path TEXT,
+                error TEXT,
+                runner_pid INTEGER,
+                created_at TIMESTAMP NOT NULL,
+                started_at TIMESTAMP,
+                finished_at TIMESTAMP,
+                last_access REAL NOT NULL
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_export_jobs_job_key ON export_jobs (job_key, status)',
+        'CREATE INDEX IF NOT EXISTS idx_export_jobs_owner ON export_jobs (owner, created_at)'
+    ])
+]
+
+# Запросы приложения и индексы, которые они обязаны использовать.
+# Проверяются через EXPLAIN QUERY PLAN, чтобы регрессия схемы не превратила их в полный просмотр.
+QUERY_PLAN_CHECKS = [
+    ('SELECT id FROM sensors WHERE name = ?',
+     ('x',), ['idx_sensors_name']),
+    # visitor_data — представление над секциями visitor_data_pYYYYMM, у каждой свои индексы
+    ("SELECT SUM(visitor_count) FROM visitor_data WHERE timestamp > datetime('now', '-1 day')",
+     (), ['_timestamp (timestamp>?)']),
+    ('SELECT MAX(id) FROM visitor_data WHERE sensor_id = ?',
+     (1,), ['_sensor_timestamp (sensor_id=?)']),
+    ('SELECT visitor_count FROM visitor_data WHERE sensor_id = ? AND timestamp > ?',
+     (1, '2024-01-01'), ['_sensor_timestamp (sensor_id=? AND timestamp>?)']),
+    ('SELECT sensor_id FROM user_sensors WHERE user_id = ?',
+     (1,), ['idx_user_sensors_user_sensor']),
+    ('SELECT user_id FROM user_sensors WHERE sensor_id = ?',
+     (1,), ['idx_user_sensors_sensor']),
+    ('SELECT sensor_id FROM store_sensors WHERE store_id = ?',
+     (1,), ['idx_store_sensors_store_sensor']),
+    ('SELECT sensor_id FROM hourly_statistics WHERE store_id = ? AND sensor_id = ?',
+     (1, 1), ['idx_hourly_statistics_store_sensor']),
+    ('SELECT child_id FROM user_hierarchy WHERE parent_id = ?',
+     (1,), ['sqlite_autoindex_user_hierarchy_1']),
+    ('SELECT descendant_id FROM user_hierarchy_closure WHERE ancestor_id = ?',
+     (1,), ['PRIMARY KEY (ancestor_id=?)']),
+    ('SELECT ancestor_id FROM user_hierarchy_closure WHERE descendant_id = ?',
+     (1,), ['idx_user_hierarchy_closure_descendant']),
+    ("SELECT SUM(visitor_count) FROM hourly_statistics WHERE bucket_start >= strftime('%Y-%m-%d %H:00:00', 'now', '-1 day')",
+     (), ['idx_hourly_statistics_bucket']),
+    ('SELECT visitor_count FROM hourly_statistics WHERE sensor_id = ? AND store_id IS ? AND bucket_start = ?',
+     (1, None, '2024-01-01 10:00:00'), ['idx_hourly_statistics_sensor_bucket']),
+    # Аналитика магазина или набора датчиков читает только их агрегаты
+    ('SELECT visitor_count FROM hourly_statistics WHERE bucket_start >= ? AND sensor_id IN (?, ?)',
+     ('2024-01-01 10:00:00', 1, 2), ['idx_hourly_statistics_sensor_bucket (sensor_id=? AND bucket_start>?)'])
+]
+
+
+def ensure_migrations_table(cursor: sqlite3.Cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Текущая версия схемы (0, если миграции ещё не применялись)"""
+    cursor = conn.cursor()
+    ensure_migrations_table(cursor)
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+    return cursor.fetchone()[0]
+
+
+def run_migrations(conn: sqlite3.Connection) -> List[Tuple[int, str]]:
+    """
+    Применение всех ещё не применённых миграций
+
+    Args:
+        conn: Соединение с базой данных без открытой транзакции
+
+    Returns:
+        Список применённых миграций (версия, описание)
+    """
+    current_version = get_schema_version(conn)
+    conn.commit()
+
+    applied = []
+    for version, description, steps in MIGRATIONS:
+        if version <= current_version:
+            continue
+
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute('''
+                INSERT INTO schema_migrations (version, description, applied_at)
+                VALUES (?, ?, ?)
+            ''', (version, description, datetime.now().isoformat()))
+            conn.commit()
+        except (sqlite3.Error, ValueError) as e:
+            conn.rollback()
+            print(f"Ошибка миграции {version} ({description}): {e}")
+            break
+
+        applied.append((version, description))
+        print(f"Применена миграция {version}: {description}")
+
+    return applied
+
+
+def check_query_plans(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+    """
+    Проверка планов запросов из QUERY_PLAN_CHECKS
+
+    Returns:
+        Список нарушений: запрос, ожидаемые индексы и фактический план
+    """
+    cursor = conn.cursor()
+    failures = []
+    for sql, params, expected_indexes in QUERY_PLAN_CHECKS:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        plan = [row[3] for row in cursor.fetchall()]
+        if not any(index in detail for detail in plan for index in expected_indexes):
+            failures.append({'query': sql, 'expected': expected_indexes, 'plan': plan})
+    return failures
+
+
+if __name__ == '__main__':
+    # Применение миграций и проверка планов запросов вручную:
+    #   python migrations.py [путь к базе]
+    db_path = sys.argv[1] if len(sys.argv) > 1 else 'visitor_data.db'
+    conn = sqlite3.connect(db_path)
+
+    applied = run_migrations(conn)
+    print(f"Версия схемы: {get_schema_version(conn)}, применено миграций: {len(applied)}")
+
+    failures = check_query_plans(conn)
+    for failure in failures:
+        print(f"Запрос не использует индекс {failure['expected']}: {failure['query']}")
+        for detail in failure['plan']:
+            print(f"    {detail}")
+    conn.close()
+
+    if failures:
+        sys.exit(1)
+    print(f"Планы запросов в порядке ({len(QUERY_PLAN_CHECKS)} проверок)")
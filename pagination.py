@@ -0,0 +1,247 @@
+"""
+Постраничный вывод списков BELWEST
+Keyset-пагинация: курсор хранит ключ сортировки последней строки страницы,
+поэтому следующая страница читается по индексу без OFFSET, а общее число строк берётся из кэша
+"""
+
+import base64
+import binascii
+import json
+import sqlite3
+from typing import Any, Dict, List, Mapping, Optional, Tuple, Union
+
+from cache import ResultCache
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Сколько секунд общее число строк списка отдаётся из кэша без пересчёта
+COUNT_TTL = 60.0
+
+# Параметры запроса, включающие постраничный вывод
+PAGE_ARGS = ('limit', 'cursor')
+
+_counts = ResultCache(max_entries=1024, ttl=COUNT_TTL, min_age=COUNT_TTL)
+
+
+def encode_cursor(payload: List[Any]) -> str:
+    data = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str) -> List[Any]:
+    """
+    Разбор курсора из параметра cursor
+
+    Raises:
+        ValueError: если курсор повреждён
+    """
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json.loads(data.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(payload, list) or len(payload) != 4:
+        raise ValueError('invalid cursor')
+    return payload
+
+
+def split_column(spec: Union[str, Tuple[str, str]]) -> Tuple[str, str]:
+    """
+    Колонка списка: (выражение SQL, поле строки ответа)
+
+    Строка 's.name' означает выражение s.name и поле name; кортеж задаёт поле явно.
+    """
+    if isinstance(spec, tuple):
+        return spec
+    return spec, spec.rsplit('.', 1)[-1]
+
+
+class Paginator:
+    def __init__(self, name: str, sort_keys: Dict[str, Union[str, Tuple[str, str]]], default_sort: str,
+                 filters: Optional[Dict[str, Tuple[Union[str, Tuple[str, ...]], str]]] = None,
+                 key: Union[str, Tuple[str, str]] = 'id'):
+        """
+        Описание постраничного списка
+
+        Колонки задаются выражениями над таблицами запроса (например, 's.name'), а не над его
+        результатом: условие курсора и ORDER BY подставляются в сам запрос, чтобы база читала
+        страницу по индексу этих колонок.
+
+        Args:
+            name: Имя списка (курсор одного списка не принимается другим)
+            sort_keys: Допустимые значения sort и колонки, по которым сортировать
+            default_sort: Сортировка по умолчанию; '-' в начале — по убыванию
+            filters: Параметр запроса -> (колонка или кортеж колонок, '=' или 'like')
+            key: Уникальная колонка, которая упорядочивает строки с равным ключом сортировки
+        """
+        self.name = name
+        self.sort_keys = {sort: split_column(spec) for sort, spec in sort_keys.items()}
+        self.default_sort = default_sort
+        self.filters = filters or {}
+        self.key, self.key_field = split_column(key)
+
+    def prepare(self, source: str, params: Tuple, args: Mapping[str, str],
+                where: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Запрос страницы по параметрам sort, limit, cursor и фильтрам
+
+        Без limit и cursor запрос возвращает все строки, как до постраничного вывода.
+
+        Args:
+            source: SELECT ... FROM ... без WHERE, ORDER BY и LIMIT
+            params: Параметры source и where (в порядке следования в тексте)
+            args: Параметры HTTP-запроса
+            where: Собственное условие списка (без слова WHERE) или None
+
+        Returns:
+            Описание запроса: sql и params для выполнения, остальное нужно finish()
+
+        Raises:
+            ValueError: если параметры запроса некорректны
+        """
+        sort = args.get('sort') or self.default_sort
+        if sort.lstrip('-') not in self.sort_keys:
+            raise ValueError(f'unsupported sort: {sort}')
+        column, field = self.sort_keys[sort.lstrip('-')]
+        descending = sort.startswith('-')
+
+        conditions = [f'({where})'] if where else []
+        filter_params = []
+        for arg, (columns, operator) in self.filters.items():
+            value = args.get(arg)
+            if value is None or value == '':
+                continue
+            if operator == 'like':
+                columns = (columns,) if isinstance(columns, str) else columns
+                pattern = '%' + value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                conditions.append('(' + ' OR '.join(f"{c} LIKE ? ESCAPE '\\'" for c in columns) + ')')
+                filter_params.extend([pattern] * len(columns))
+            else:
+                conditions.append(f'{columns} = ?')
+                filter_params.append(value)
+
+        base_where = ' AND '.join(conditions) or '1'
+        base_params = tuple(params) + tuple(filter_params)
+        query = {
+            'paged': any(arg in args for arg in PAGE_ARGS),
+            'sort': sort,
+            'field': field,
+            'limit': None,
+            'count_sql': f'SELECT COUNT(*) FROM ({source} WHERE {base_where})',
+            'count_params': base_params,
+            'first_page': True
+        }
+
+        # Условия страницы: каждая ветка читается по индексу колонки сортировки в её порядке
+        branches = [('', ())]
+        if query['paged']:
+            limit = int(args.get('limit') or DEFAULT_PAGE_SIZE)
+            if limit < 1:
+                raise ValueError('limit must be positive')
+            query['limit'] = min(limit, MAX_PAGE_SIZE)
+
+            token = args.get('cursor')
+            if token:
+                name, cursor_sort, value, key_value = decode_cursor(token)
+                if name != self.name or cursor_sort != sort:
+                    raise ValueError('cursor does not match this list or sort order')
+                branches = self._seek_branches(column, descending, value, key_value)
+                query['first_page'] = False
+
+        direction = 'DESC' if descending else 'ASC'
+        order_by = f'{column} {direction}'
+        if column != self.key:
+            order_by += f', {self.key} {direction}'
+        limit_sql = ' LIMIT ?' if query['limit'] is not None else ''
+        # Лишняя строка показывает, есть ли следующая страница
+        limit_params = (query['limit'] + 1,) if query['limit'] is not None else ()
+
+        selects = []
+        sql_params = ()
+        for condition, condition_params in branches:
+            selects.append(f'{source} WHERE {base_where}{condition} ORDER BY {order_by}{limit_sql}')
+            sql_params += base_params + condition_params + limit_params
+
+        if len(selects) == 1:
+            sql = selects[0]
+        else:
+            # Строки с NULL в колонке сортировки читаются отдельной веткой,
+            # и только несколько страниц из обеих веток сортируются заново
+            sql = ' UNION ALL '.join(f'SELECT * FROM ({select})' for select in selects)
+            sql += f' ORDER BY {field} {direction}'
+            if field != self.key_field:
+                sql += f', {self.key_field} {direction}'
+            sql += limit_sql
+            sql_params += limit_params
+
+        query['sql'] = sql
+        query['params'] = sql_params
+        return query
+
+    def _seek_branches(self, column: str, descending: bool, value: Any, key_value: Any) -> List[Tuple[str, Tuple]]:
+        """
+        Условия строк после курсора (column = value, key = key_value)
+
+        NULL в SQLite меньше любого значения: при сортировке по возрастанию строки с NULL идут
+        первыми, по убыванию — последними, поэтому они выбираются отдельными ветками IS NULL.
+        """
+        operator = '<' if descending else '>'
+        if column == self.key:
+            return [(f' AND {self.key} {operator} ?', (key_value,))]
+
+        after_null = (f' AND {column} IS NULL AND {self.key} {operator} ?', (key_value,))
+        after_value = (f' AND ({column}, {self.key}) {operator} (?, ?)', (value, key_value))
+        if descending:
+            if value is None:
+                return [after_null]
+            return [after_value, (f' AND {column} IS NULL', ())]
+        if value is None:
+            return [after_null, (f' AND {column} IS NOT NULL', ())]
+        return [after_value]
+
+    def finish(self, cursor: sqlite3.Cursor, query: Dict[str, Any],
+               items: List[Dict[str, Any]]) -> Union[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Ответ по строкам, прочитанным запросом prepare()
+
+        Returns:
+            Массив строк без постраничного вывода, иначе
+            {'items', 'next_cursor', 'limit', 'total'}, где total — оценка из кэша (до COUNT_TTL секунд)
+        """
+        if not query['paged']:
+            return items
+
+        limit = query['limit']
+        has_more = len(items) > limit
+        items = items[:limit]
+
+        next_cursor = None
+        if has_more:
+            last = items[-1]
+            next_cursor = encode_cursor([self.name, query['sort'], last.get(query['field']),
+                                         last[self.key_field]])
+
+        if query['first_page'] and not has_more:
+            total = len(items)
+        else:
+            total = _counts.get_or_compute(
+                (self.name, query['count_sql'], query['count_params']),
+                lambda: cursor.execute(query['count_sql'], query['count_params']).fetchone()[0]
+            )
+
+        return {
+            'items': items,
+            'next_cursor': next_cursor,
+            'limit': limit,
+            'total': total
+        }
+
+    def fetch(self, cursor: sqlite3.Cursor, source: str, params: Tuple, args: Mapping[str, str],
+              where: Optional[str] = None) -> Union[List[Dict[str, Any]], Dict[str, Any]]:
+        """Страница списка целиком: prepare(), выполнение запроса и finish()"""
+        query = self.prepare(source, params, args, where)
+        cursor.execute(query['sql'], query['params'])
+        columns = [description[0] for description in cursor.description]
+        items = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return self.finish(cursor, query, items)
@@ -0,0 +1,272 @@
+"""
+Помесячное секционирование сырых замеров BELWEST
+Замеры хранятся в таблицах visitor_data_pYYYYMM, а visitor_data — представление над всеми секциями
+"""
+
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+VIEW_NAME = 'visitor_data'
+PARTITION_PREFIX = 'visitor_data_p'
+COLUMNS = 'id, sensor_id, visitor_count, visitor_delta, timestamp'
+QUARANTINE_TABLE = 'visitor_data_invalid'
+
+# Границы секций сравниваются с запасом: устройства присылают местное время,
+# а datetime('now') в запросах считает в UTC
+ROUTING_MARGIN = timedelta(days=1)
+
+
+def ensure_catalog(cursor: sqlite3.Cursor):
+    """Каталог секций и общий счётчик id замеров"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS visitor_data_partitions (
+            name TEXT PRIMARY KEY,
+            range_start TIMESTAMP NOT NULL,
+            range_end TIMESTAMP NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS visitor_data_sequence (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_id INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO visitor_data_sequence (id, last_id) VALUES (1, 0)')
+
+
+def month_of(timestamp: Any) -> str:
+    """Месяц замера в виде YYYY-MM"""
+    return str(timestamp)[:7]
+
+
+def partition_name(month: str) -> str:
+    return f"{PARTITION_PREFIX}{month[:4]}{month[5:7]}"
+
+
+def month_bounds(month: str) -> Tuple[str, str]:
+    """Начало месяца и начало следующего месяца"""
+    start = datetime.strptime(month, '%Y-%m')
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return str(start), str(end)
+
+
+def list_partitions(cursor: sqlite3.Cursor) -> List[Dict[str, Any]]:
+    """Секции из каталога в порядке времени"""
+    cursor.execute('''
+        SELECT name, range_start, range_end
+        FROM visitor_data_partitions
+        ORDER BY range_start
+    ''')
+    return [{'name': row[0], 'range_start': row[1], 'range_end': row[2]} for row in cursor.fetchall()]
+
+
+def create_partition(cursor: sqlite3.Cursor, month: str) -> str:
+    """Создание секции за месяц без пересборки представления"""
+    name = partition_name(month)
+    range_start, range_end = month_bounds(month)
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY,
+            sensor_id INTEGER,
+            visitor_count INTEGER DEFAULT 0,
+            visitor_delta INTEGER,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (sensor_id) REFERENCES sensors (id)
+        )
+    ''')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_sensor_timestamp ON {name} (sensor_id, timestamp)')
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_{name}_timestamp ON {name} (timestamp)')
+    cursor.execute('''
+        INSERT OR IGNORE INTO visitor_data_partitions (name, range_start, range_end, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', (name, range_start, range_end, datetime.now().isoformat()))
+    return name
+
+
+def rebuild_view(cursor: sqlite3.Cursor):
+    """Пересборка представления visitor_data по каталогу секций"""
+    partitions = list_partitions(cursor)
+    if not partitions:
+        create_partition(cursor, month_of(datetime.now()))
+        partitions = list_partitions(cursor)
+
+    union = '\nUNION ALL\n'.join(f'SELECT {COLUMNS} FROM {p["name"]}' for p in partitions)
+    cursor.execute(f'DROP VIEW IF EXISTS {VIEW_NAME}')
+    cursor.execute(f'CREATE VIEW {VIEW_NAME} AS\n{union}')
+
+
+def ensure_partitions(cursor: sqlite3.Cursor, months: List[str]) -> List[str]:
+    """
+    Создание недостающих секций для месяцев пакета
+
+    Returns:
+        Имена секций в том же порядке, что и месяцы
+    """
+    cursor.execute('SELECT name FROM visitor_data_partitions')
+    existing = {row[0] for row in cursor.fetchall()}
+
+    names = []
+    created = False
+    for month in months:
+        name = partition_name(month)
+        if name not in existing:
+            create_partition(cursor, month)
+            existing.add(name)
+            created = True
+        names.append(name)
+
+    if created:
+        rebuild_view(cursor)
+    return names
+
+
+def allocate_ids(cursor: sqlite3.Cursor, count: int) -> int:
+    """
+    Выделение диапазона id для новых замеров
+
+    Вызывается внутри пишущей транзакции: id растут в порядке фиксации,
+    на что опирается отметка обработанных строк в rollups.py.
+
+    Returns:
+        Первый id диапазона
+    """
+    cursor.execute('UPDATE visitor_data_sequence SET last_id = last_id + ? WHERE id = 1', (count,))
+    cursor.execute('SELECT last_id FROM visitor_data_sequence WHERE id = 1')
+    return cursor.fetchone()[0] - count + 1
+
+
+def insert_rows(cursor: sqlite3.Cursor, rows: List[Tuple[int, int, Optional[int], Any]]) -> int:
+    """
+    Запись замеров в секции по месяцу замера
+
+    Args:
+        cursor: Курсор внутри открытой транзакции
+        rows: Строки (sensor_id, visitor_count, visitor_delta, timestamp)
+
+    Returns:
+        Число записанных строк
+    """
+    if not rows:
+        return 0
+
+    now = datetime.now()
+    by_month = {}
+    first_id = allocate_ids(cursor, len(rows))
+    for offset, row in enumerate(rows):
+        month = month_of(row[3] if row[3] is not None else now)
+        by_month.setdefault(month, []).append((first_id + offset,) + tuple(row))
+
+    months = list(by_month)
+    for name, month in zip(ensure_partitions(cursor, months), months):
+        cursor.executemany(f'''
+            INSERT INTO {name} (id, sensor_id, visitor_count, visitor_delta, timestamp)
+            VALUES (?, ?, ?, ?, ?)
+        ''', by_month[month])
+    return len(rows)
+
+
+def partitions_for_range(cursor: sqlite3.Cursor, start: Any = None, end: Any = None) -> List[str]:
+    """Секции, которые пересекаются с интервалом [start, end)"""
+    partitions = list_partitions(cursor)
+    if start is not None:
+        start = str(start - ROUTING_MARGIN if isinstance(start, datetime) else start)
+        partitions = [p for p in partitions if p['range_end'] > start]
+    if end is not None:
+        end = str(end + ROUTING_MARGIN if isinstance(end, datetime) else end)
+        partitions = [p for p in partitions if p['range_start'] < end]
+    return [p['name'] for p in partitions]
+
+
+def range_source(cursor: sqlite3.Cursor, start: Any = None, end: Any = None) -> str:
+    """
+    Источник строк для запроса по интервалу времени
+
+    Подставляется в FROM вместо visitor_data, чтобы запрос читал только нужные секции.
+    """
+    names = partitions_for_range(cursor, start, end)
+    if not names:
+        return f'(SELECT {COLUMNS} FROM {VIEW_NAME} WHERE 0)'
+    if len(names) == 1:
+        return names[0]
+    return '(' + ' UNION ALL '.join(f'SELECT {COLUMNS} FROM {name}' for name in names) + ')'
+
+
+def delete_sensor_rows(cursor: sqlite3.Cursor, sensor_id: int) -> int:
+    """Удаление всех замеров датчика из всех секций"""
+    deleted = 0
+    for partition in list_partitions(cursor):
+        cursor.execute(f'DELETE FROM {partition["name"]} WHERE sensor_id = ?', (sensor_id,))
+        deleted += cursor.rowcount
+    return deleted
+
+
+def drop_partition(cursor: sqlite3.Cursor, name: str):
+    """Удаление секции целиком: DROP TABLE вместо долгого DELETE по строкам"""
+    if not name.startswith(PARTITION_PREFIX):
+        raise ValueError(f'not a visitor_data partition: {name}')
+    cursor.execute('DELETE FROM visitor_data_partitions WHERE name = ?', (name,))
+    cursor.execute(f'DROP TABLE IF EXISTS {name}')
+    rebuild_view(cursor)
+
+
+def raw_data_start(cursor: sqlite3.Cursor) -> Optional[str]:
+    """Начало самой старой сохранённой секции"""
+    cursor.execute('SELECT MIN(range_start) FROM visitor_data_partitions')
+    return cursor.fetchone()[0]
+
+
+def migrate_legacy_table(cursor: sqlite3.Cursor):
+    """Перенос строк из таблицы visitor_data в помесячные секции и замена её представлением"""
+    ensure_catalog(cursor)
+
+    cursor.execute(f"SELECT type FROM sqlite_master WHERE name = '{VIEW_NAME}'")
+    row = cursor.fetchone()
+    if row is None or row[0] != 'table':
+        rebuild_view(cursor)
+        return
+
+    current_month = month_of(datetime.now())
+    cursor.execute(f'''
+        SELECT DISTINCT COALESCE(substr(timestamp, 1, 7), ?) FROM {VIEW_NAME}
+    ''', (current_month,))
+    invalid_months = []
+    for (month,) in cursor.fetchall():
+        try:
+            month_bounds(month)
+        except ValueError:
+            invalid_months.append(month)
+            continue
+        name = create_partition(cursor, month)
+        cursor.execute(f'''
+            INSERT INTO {name} ({COLUMNS})
+            SELECT {COLUMNS} FROM {VIEW_NAME}
+            WHERE COALESCE(substr(timestamp, 1, 7), ?) = ?
+        ''', (current_month, month))
+
+    # Строки с неразборчивой меткой времени не попадают ни в одну секцию: они откладываются
+    # в отдельную таблицу, чтобы миграция не прерывалась и данные не терялись
+    if invalid_months:
+        cursor.execute(f'CREATE TABLE IF NOT EXISTS {QUARANTINE_TABLE} AS SELECT {COLUMNS} FROM {VIEW_NAME} WHERE 0')
+        placeholders = ', '.join('?' * len(invalid_months))
+        cursor.execute(f'''
+            INSERT INTO {QUARANTINE_TABLE} ({COLUMNS})
+            SELECT {COLUMNS} FROM {VIEW_NAME}
+            WHERE COALESCE(substr(timestamp, 1, 7), ?) IN ({placeholders})
+        ''', (current_month, *invalid_months))
+        print(f"Замеров с неразборчивой меткой времени: {cursor.rowcount}, перенесены в {QUARANTINE_TABLE}")
+
+    # Новые id продолжают последовательность AUTOINCREMENT старой таблицы
+    cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {VIEW_NAME}')
+    last_id = cursor.fetchone()[0]
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'")
+    if cursor.fetchone():
+        cursor.execute(f"SELECT seq FROM sqlite_sequence WHERE name = '{VIEW_NAME}'")
+        row = cursor.fetchone()
+        if row is not None:
+            last_id = max(last_id, row[0])
+    cursor.execute('UPDATE visitor_data_sequence SET last_id = MAX(last_id, ?) WHERE id = 1', (last_id,))
+
+    cursor.execute(f'DROP TABLE {VIEW_NAME}')
+    rebuild_view(cursor)
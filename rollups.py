@@ -0,0 +1,309 @@
+"""
+Почасовые агрегаты посещаемости BELWEST
+Инкрементально сворачивает новые строки visitor_data в hourly_statistics по датчикам и магазинам
+"""
+
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+
+from database import DB_PATH, connect
+from partitions import list_partitions, drop_partition, raw_data_start
+
+ROLLUP_NAME = 'hourly_statistics'
+
+# Как часто фоновый поток проверяет, не пора ли удалить старые секции (секунды)
+RETENTION_CHECK_INTERVAL = 3600.0
+
+
+def get_high_water_mark(cursor: sqlite3.Cursor, name: str = ROLLUP_NAME) -> int:
+    """Последний visitor_data.id, уже учтённый в агрегатах"""
+    cursor.execute('SELECT last_id FROM rollup_state WHERE name = ?', (name,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def set_high_water_mark(cursor: sqlite3.Cursor, last_id: int, name: str = ROLLUP_NAME):
+    cursor.execute('''
+        INSERT INTO rollup_state (name, last_id, updated_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at
+    ''', (name, last_id, datetime.now().isoformat()))
+
+
+def rollup_batch(conn: sqlite3.Connection, batch_size: int = 50000) -> int:
+    """
+    Свёртка очередной порции visitor_data в почасовые агрегаты
+
+    Порция и отметка обработанного id фиксируются одной транзакцией,
+    поэтому каждая строка попадает в агрегаты ровно один раз.
+
+    Args:
+        conn: Соединение без открытой транзакции
+        batch_size: Максимальное число строк visitor_data за один проход
+
+    Returns:
+        Число обработанных строк visitor_data
+    """
+    cursor = conn.cursor()
+    # IMMEDIATE: пока идёт свёртка, новые строки с меньшим id появиться не могут
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        last_id = get_high_water_mark(cursor)
+        cursor.execute('''
+            SELECT MAX(id), COUNT(*) FROM (
+                SELECT id FROM visitor_data WHERE id > ? ORDER BY id LIMIT ?
+            )
+        ''', (last_id, batch_size))
+        upper_id, row_count = cursor.fetchone()
+        if not row_count:
+            conn.rollback()
+            return 0
+
+        # Датчик относится к одному магазину, иначе посетители посчитались бы дважды
+        cursor.execute('''
+            SELECT
+                vd.sensor_id,
+                ss.store_id,
+                strftime('%Y-%m-%d %H:00:00', vd.timestamp) as bucket_start,
+                DATE(vd.timestamp) as date,
+                CAST(strftime('%H', vd.timestamp) AS INTEGER) as hour,
+                CAST(strftime('%w', vd.timestamp) AS INTEGER) as day_of_week,
+                SUM(vd.visitor_delta) as visitors,
+                COUNT(*) as samples
+            FROM visitor_data vd
+            LEFT JOIN (
+                SELECT sensor_id, MIN(store_id) as store_id
+                FROM store_sensors
+                GROUP BY sensor_id
+            ) ss ON ss.sensor_id = vd.sensor_id
+            WHERE vd.id > ? AND vd.id <= ? AND vd.timestamp IS NOT NULL
+            GROUP BY vd.sensor_id, bucket_start
+        ''', (last_id, upper_id))
+        buckets = cursor.fetchall()
+
+        for sensor_id, store_id, bucket_start, date, hour, day_of_week, visitors, samples in buckets:
+            cursor.execute('''
+                UPDATE hourly_statistics
+                SET visitor_count = visitor_count + ?, sample_count = sample_count + ?
+                WHERE sensor_id = ? AND store_id IS ? AND bucket_start = ?
+            ''', (visitors or 0, samples, sensor_id, store_id, bucket_start))
+            if cursor.rowcount == 0:
+                cursor.execute('''
+                    INSERT INTO hourly_statistics
+                        (sensor_id, store_id, hour, day_of_week, visitor_count, sample_count, date, bucket_start)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (sensor_id, store_id, hour, day_of_week, visitors or 0, samples, date, bucket_start))
+
+        set_high_water_mark(cursor, upper_id)
+        conn.commit()
+        return row_count
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def backfill(conn: sqlite3.Connection, batch_size: int = 50000) -> int:
+    """
+    Пересборка агрегатов по всей истории visitor_data
+
+    Привязки датчиков к магазинам (строки без bucket_start) сохраняются, как и агрегаты
+    за период, сырые секции которого уже удалены политикой хранения.
+
+    Returns:
+        Число обработанных строк visitor_data
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        DELETE FROM hourly_statistics
+        WHERE bucket_start IS NOT NULL AND bucket_start >= COALESCE(?, '')
+    ''', (raw_data_start(cursor),))
+    set_high_water_mark(cursor, 0)
+    conn.commit()
+
+    total = 0
+    while True:
+        processed = rollup_batch(conn, batch_size)
+        if not processed:
+            break
+        total += processed
+        print(f"Обработано строк visitor_data: {total}")
+    return total
+
+
+def apply_retention(conn: sqlite3.Connection, retention_days: int) -> List[str]:
+    """
+    Удаление сырых секций visitor_data старше retention_days
+
+    Секция удаляется только целиком и только после того, как все её строки
+    учтены в почасовых агрегатах, поэтому история в отчётах не теряется.
+
+    Args:
+        conn: Соединение без открытой транзакции
+        retention_days: Сколько дней хранить сырые замеры
+
+    Returns:
+        Имена удалённых секций
+    """
+    # Сначала досчитываем агрегаты по всему, что уже записано
+    while rollup_batch(conn):
+        pass
+
+    cutoff = str(datetime.now() - timedelta(days=retention_days))
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        last_id = get_high_water_mark(cursor)
+        partitions = list_partitions(cursor)
+        dropped = []
+        for partition in partitions[:-1]:
+            if partition['range_end'] > cutoff:
+                break
+            cursor.execute(f'SELECT MAX(id) FROM {partition["name"]}')
+            max_id = cursor.fetchone()[0]
+            if max_id is not None and max_id > last_id:
+                print(f"Секция {partition['name']} ещё не свёрнута в агрегаты, удаление отложено")
+                break
+            drop_partition(cursor, partition['name'])
+            dropped.append(partition['name'])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    for name in dropped:
+        print(f"Удалена секция сырых замеров: {name}")
+    return dropped
+
+
+class RollupEngine:
+    def __init__(self, db_path: Optional[str] = None, interval: float = 60.0,
+                 min_interval: float = 5.0, batch_size: int = 50000,
+                 retention_days: Optional[int] = None):
+        """
+        Инициализация фоновой свёртки
+
+        Args:
+            db_path: Путь к базе данных
+            interval: Максимальный интервал между проходами (секунды)
+            min_interval: Минимальный интервал между проходами при частой записи (секунды)
+            batch_size: Число строк visitor_data за один проход
+            retention_days: Срок хранения сырых замеров в днях (None — хранить всё)
+        """
+        self.db_path = db_path or DB_PATH
+        self.interval = interval
+        self.min_interval = min_interval
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self._last_retention = None
+
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._stats = {
+            'processed': 0,
+            'runs': 0,
+            'last_run_at': None,
+            'last_run_ms': 0.0,
+            'last_error': None,
+            'last_retention_at': None,
+            'dropped_partitions': 0
+        }
+
+    def start(self):
+        """Запуск фонового потока свёртки"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='rollup-engine', daemon=True)
+        self._thread.start()
+
+    def notify(self, *args):
+        """Сигнал о новых данных; подходит как слушатель записи замеров"""
+        self._wakeup.set()
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+
+    def run_once(self, conn: sqlite3.Connection) -> int:
+        """Свёртка всех накопившихся строк"""
+        started = time.perf_counter()
+        total = 0
+        while True:
+            processed = rollup_batch(conn, self.batch_size)
+            total += processed
+            if processed < self.batch_size:
+                break
+
+        self._stats['processed'] += total
+        self._stats['runs'] += 1
+        self._stats['last_run_at'] = datetime.now().isoformat()
+        self._stats['last_run_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        return total
+
+    def run_retention(self, conn: sqlite3.Connection) -> List[str]:
+        """Удаление старых сырых секций по сроку хранения"""
+        self._last_retention = time.monotonic()
+        dropped = apply_retention(conn, self.retention_days)
+        self._stats['last_retention_at'] = datetime.now().isoformat()
+        self._stats['dropped_partitions'] += len(dropped)
+        return dropped
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats)
+
+    def _run(self):
+        conn = connect(self.db_path)
+        try:
+            while not self._stopping.is_set():
+                self._wakeup.clear()
+                try:
+                    self.run_once(conn)
+                    if self.retention_days and (
+                        self._last_retention is None
+                        or time.monotonic() - self._last_retention >= RETENTION_CHECK_INTERVAL
+                    ):
+                        self.run_retention(conn)
+                    self._stats['last_error'] = None
+                except sqlite3.Error as e:
+                    self._stats['last_error'] = str(e)
+                    print(f"Ошибка свёртки почасовых агрегатов: {e}")
+                # Не чаще min_interval, даже если замеры приходят непрерывно
+                if self._stopping.wait(self.min_interval):
+                    break
+                self._wakeup.wait(self.interval - self.min_interval)
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    # Пересборка агрегатов по всей истории и удаление старых сырых секций:
+    #   python rollups.py --backfill [путь к базе]
+    #   python rollups.py --retention <дней> [путь к базе]
+    usage = 'Использование: python rollups.py --backfill [путь к базе] | --retention <дней> [путь к базе]'
+    args = sys.argv[1:]
+    if not args or args[0] not in ('--backfill', '--retention') or (args[0] == '--retention' and len(args) < 2):
+        print(usage)
+        sys.exit(1)
+
+    from migrations import run_migrations
+
+    if args[0] == '--backfill':
+        conn = connect(args[1] if len(args) > 1 else DB_PATH)
+        run_migrations(conn)
+        total = backfill(conn)
+        conn.close()
+        print(f"Пересборка завершена, обработано строк: {total}")
+    else:
+        conn = connect(args[2] if len(args) > 2 else DB_PATH)
+        run_migrations(conn)
+        dropped = apply_retention(conn, int(args[1]))
+        conn.close()
+        print(f"Удалено секций: {len(dropped)}")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Запуск BELWEST в продакшене
+Веб-приложение обслуживают несколько процессов gunicorn (по числу ядер), приём данных
+от датчиков, свёртку агрегатов и пересчёт результатов AI — отдельный фоновый процесс.
+Схема базы обновляется один раз до запуска процессов, кэши процессов согласуются через shared_state
+
+    python run_production.py [--bind 0.0.0.0:5000] [--workers N] [--threads N]
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import threading
+
+from gunicorn.app.base import BaseApplication
+
+import server
+from database import close_pools
+from events import subscriber_limit
+
+# Потоков на процесс: каждый открытый поток событий дашборда занимает один,
+# поэтому подписчиков на процесс допускается меньше (subscriber_limit)
+THREADS = 32
+
+
+def run_background():
+    """Фоновый процесс: сервер приёма на INGEST_SERVER_PORT, свёртка агрегатов и пересчёт результатов AI"""
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stopping.set())
+    signal.signal(signal.SIGINT, lambda *args: stopping.set())
+
+    server.start_background(shared=True)
+    print(f"Фоновый процесс запущен (pid {os.getpid()})")
+    stopping.wait()
+
+    server.ingest_server.stop()
+    server.app.ai_scheduler.stop()
+    server.rollup_engine.stop()
+    server.ingestion_buffer.stop()
+
+
+def post_fork(arbiter, worker):
+    # Приём данных, свёртка и пересчёт AI — в фоновом процессе, веб-процессам нужны буфер, события и кэши
+    server.start_background(shared=True, ingest=False, rollups=False, precompute=False)
+    # Лишние подписчики получают 503, пока у процесса ещё есть потоки для остальных запросов
+    server.event_broker.max_subscribers = subscriber_limit(worker.cfg.threads)
+
+
+def worker_exit(arbiter, worker):
+    # Замеры, принятые через /api/visitor-count, дописываются до выхода процесса
+    server.ingestion_buffer.stop()
+
+
+class ProductionApplication(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        return server.app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Запуск BELWEST в несколько процессов')
+    parser.add_argument('--bind', default='0.0.0.0:5000', help='Адрес веб-приложения')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Число веб-процессов')
+    parser.add_argument('--threads', type=int, default=THREADS, help='Потоков в каждом веб-процессе')
+    parser.add_argument('--background', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.background:
+        run_background()
+        sys.exit(0)
+
+    if not os.path.exists('flask_session'):
+        os.makedirs('flask_session')
+
+    # Миграции и начальные данные — один раз, до запуска процессов
+    server.init_db()
+    close_pools()
+
+    # Отдельный интерпретатор, а не fork: веб-процессы gunicorn не должны наследовать дочерний процесс
+    background = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--background'])
+
+    try:
+        ProductionApplication({
+            'bind': args.bind,
+            'workers': args.workers,
+            'worker_class': 'gthread',
+            'threads': args.threads,
+            'post_fork': post_fork,
+            'worker_exit': worker_exit
+        }).run()
+    finally:
+        background.terminate()
+        background.wait(15)
@@ -0,0 +1,219 @@
+"""
+Реестр датчиков BELWEST
+Держит в памяти соответствие device_id -> sensor_id и последнее состояние каждого датчика
+"""
+
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Tuple
+
+
+class SensorRegistry:
+    def __init__(self):
+        """Инициализация пустого реестра; данные загружаются из таблицы sensors при первом обращении"""
+        self._lock = threading.RLock()
+        self._ids = {}
+        self._sensors = {}
+        self._counters = {}
+        self._loaded = False
+        # В базу пишут несколько процессов: счётчики и новые устройства сверяются с базой
+        self.shared = False
+
+    def load(self, conn: sqlite3.Connection):
+        """Загрузка реестра из таблицы sensors"""
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, name, status, visitor_count, last_update, last_counter, last_counter_at
+            FROM sensors
+            ORDER BY id
+        ''')
+
+        ids = {}
+        sensors = {}
+        counters = {}
+        for row in cursor.fetchall():
+            ids.setdefault(row[1], row[0])
+            sensors[row[0]] = {
+                'id': row[0],
+                'name': row[1],
+                'status': row[2],
+                'visitor_count': row[3],
+                'last_update': row[4]
+            }
+            if row[5] is not None and row[6] is not None:
+                counters[row[0]] = (row[5], row[6])
+
+        with self._lock:
+            self._ids = ids
+            self._sensors = sensors
+            self._counters = counters
+            self._loaded = True
+
+    def ensure_loaded(self, conn: sqlite3.Connection):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load(conn)
+
+    def lookup(self, device_id: str) -> Optional[int]:
+        """Поиск sensor_id по имени устройства за O(1)"""
+        return self._ids.get(device_id)
+
+    def resolve_many(self, conn: sqlite3.Connection, samples: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Определение sensor_id для всех устройств пакета с автоматической регистрацией новых
+
+        Новые датчики создаются под блокировкой реестра отдельной короткой транзакцией,
+        поэтому два одновременных пакета не могут зарегистрировать одно устройство дважды.
+
+        Args:
+            conn: Соединение без открытой транзакции
+            samples: Замеры вида {device_id, count, status, received_at}
+
+        Returns:
+            Словарь {device_id: sensor_id}
+        """
+        self.ensure_loaded(conn)
+
+        sensor_ids = {}
+        missing = {}
+        for sample in samples:
+            sensor_id = self._ids.get(sample['device_id'])
+            if sensor_id is None:
+                missing[sample['device_id']] = sample
+            else:
+                sensor_ids[sample['device_id']] = sensor_id
+
+        if missing:
+            with self._lock:
+                cursor = conn.cursor()
+                created = []
+                try:
+                    if self.shared:
+                        # Устройство могли зарегистрировать другие процессы
+                        cursor.execute('BEGIN IMMEDIATE')
+                        names = list(missing)
+                        cursor.execute(f'''
+                            SELECT name, MIN(id) FROM sensors
+                            WHERE name IN ({', '.join('?' * len(names))})
+                            GROUP BY name
+                        ''', names)
+                        for name, sensor_id in cursor.fetchall():
+                            if self._ids.get(name) is None:
+                                created.append((sensor_id, name, missing[name]))
+                                self._ids[name] = sensor_id
+
+                    for device_id, sample in missing.items():
+                        sensor_id = self._ids.get(device_id)
+                        if sensor_id is None:
+                            cursor.execute('''
+                                INSERT INTO sensors (name, location, status, last_update, visitor_count)
+                                VALUES (?, ?, ?, ?, ?)
+                            ''', (device_id, f'Location for {device_id}', sample['status'],
+                                  sample['received_at'], sample['count']))
+                            sensor_id = cursor.lastrowid
+                            created.append((sensor_id, device_id, sample))
+                        sensor_ids[device_id] = sensor_id
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
+                for sensor_id, device_id, sample in created:
+                    self.register(sensor_id, device_id, sample['status'])
+
+        return sensor_ids
+
+    def register(self, sensor_id: int, name: str, status: Optional[str] = 'active'):
+        """Добавление датчика, созданного через API"""
+        with self._lock:
+            self._ids.setdefault(name, sensor_id)
+            self._sensors[sensor_id] = {
+                'id': sensor_id,
+                'name': name,
+                'status': status,
+                'visitor_count': 0,
+                'last_update': datetime.now().isoformat()
+            }
+
+    def update(self, sensor_id: int, name: Optional[str] = None, status: Optional[str] = None):
+        """Переименование датчика или смена статуса через API"""
+        with self._lock:
+            sensor = self._sensors.get(sensor_id)
+            if sensor is None:
+                return
+
+            if name is not None and name != sensor['name']:
+                old_name = sensor['name']
+                sensor['name'] = name
+                if self._ids.get(old_name) == sensor_id:
+                    del self._ids[old_name]
+                    self._rebind(old_name)
+                self._ids.setdefault(name, sensor_id)
+
+            if status is not None:
+                sensor['status'] = status
+
+    def remove(self, sensor_id: int):
+        """Удаление датчика из реестра"""
+        with self._lock:
+            sensor = self._sensors.pop(sensor_id, None)
+            self._counters.pop(sensor_id, None)
+            if sensor is not None and self._ids.get(sensor['name']) == sensor_id:
+                del self._ids[sensor['name']]
+                self._rebind(sensor['name'])
+
+    def record(self, sensor_id: int, status: str, visitor_count: int, timestamp: Any):
+        """Сохранение последнего состояния датчика после записи замера"""
+        with self._lock:
+            sensor = self._sensors.get(sensor_id)
+            if sensor is None:
+                return
+            sensor['status'] = status
+            sensor['visitor_count'] = visitor_count
+            sensor['last_update'] = timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp
+
+    def load_counters(self, cursor: sqlite3.Cursor, sensor_ids: List[int]):
+        """Перечитывание последних значений счётчиков из базы (внутри транзакции записи)"""
+        sensor_ids = list(sensor_ids)
+        if not sensor_ids:
+            return
+        cursor.execute(f'''
+            SELECT id, last_counter, last_counter_at FROM sensors
+            WHERE id IN ({', '.join('?' * len(sensor_ids))})
+        ''', sensor_ids)
+        with self._lock:
+            for sensor_id, count, timestamp in cursor.fetchall():
+                if count is not None and timestamp is not None:
+                    self._counters[sensor_id] = (count, timestamp)
+                else:
+                    self._counters.pop(sensor_id, None)
+
+    def get_counter(self, sensor_id: int) -> Optional[Tuple[int, str]]:
+        """Последнее значение накопительного счётчика устройства и время замера"""
+        return self._counters.get(sensor_id)
+
+    def set_counter(self, sensor_id: int, count: int, timestamp: str):
+        with self._lock:
+            self._counters[sensor_id] = (count, timestamp)
+
+    def get(self, sensor_id: int) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            sensor = self._sensors.get(sensor_id)
+            return dict(sensor) if sensor else None
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Последнее состояние всех датчиков без обращения к visitor_data"""
+        with self._lock:
+            return [dict(sensor) for sensor in sorted(self._sensors.values(), key=lambda s: s['name'])]
+
+    def _rebind(self, name: str):
+        # Если осталось несколько датчиков с тем же именем, имя переходит к датчику с меньшим id
+        candidates = [s['id'] for s in self._sensors.values() if s['name'] == name]
+        if candidates:
+            self._ids[name] = min(candidates)
+
+
+# Общий реестр процесса
+registry = SensorRegistry()
@@ -12,7 +12,20 @@ from handlers.users import users
 from handlers.sensors import sensors as sensors_bp
 from handlers.reports import reports
 from handlers.permissions import permissions
-from ai_agent import create_ai_endpoints, BelwestAIAgent
+from ai_agent import create_ai_endpoints, BelwestAIAgent, InsightsScheduler
+from ingestion import IngestionBuffer, split_batch, parse_samples, write_samples, add_write_listener
+from ingest_server import IngestServer
+from sensor_registry import registry
+from migrations import run_migrations, get_schema_version
+from database import DB_PATH, db_connection, get_db_connection
+from rollups import RollupEngine
+from partitions import range_source
+from cache import ResultCache
+from pagination import Paginator
+from events import event_broker
+from hierarchy import scope_resolver
+from shared_state import shared_state
+from authz import requires
 
 app = Flask(__name__)
 
@@ -25,6 +38,20 @@ app.config['SESSION_USE_SIGNER'] = True
 app.config['SESSION_KEY_PREFIX'] = 'belwest:'
 app.config['SESSION_FILE_THRESHOLD'] = 100
 
+# Конфигурация буфера приёма данных от датчиков
+app.config['INGESTION_BATCH_SIZE'] = 500
+app.config['INGESTION_FLUSH_INTERVAL'] = 1.0
+app.config['INGESTION_MAX_QUEUE'] = 100000
+app.config['INGESTION_MAX_BATCH_REQUEST'] = 10000
+# Порт асинхронного сервера приёма для устройств (None — только через веб-приложение)
+app.config['INGEST_SERVER_PORT'] = 5001
+app.config['INGEST_SERVER_MAX_CONNECTIONS'] = 10000
+app.config['ROLLUP_INTERVAL'] = 60.0
+app.config['RAW_RETENTION_DAYS'] = 90
+app.config['SENSOR_DATA_CACHE_TTL'] = 30.0
+app.config['SENSOR_DATA_CACHE_MIN_AGE'] = 5.0
+app.config['SENSOR_DATA_CACHE_SIZE'] = 256
+
 Session(app)
 
 # Регистрация blueprint'ов
@@ -33,15 +60,71 @@ app.register_blueprint(sensors_bp, url_prefix='/')
 app.register_blueprint(reports, url_prefix='/')
 app.register_blueprint(permissions, url_prefix='/')
 
-# AI endpoints будут зарегистрированы в main блоке
+# AI агент создаётся один раз на процесс, endpoints отдают результаты, заранее рассчитанные планировщиком
+app.ai_agent = BelwestAIAgent()
+app.ai_scheduler = InsightsScheduler(app.ai_agent)
+create_ai_endpoints(app)
+
+# Буфер замеров: запись в базу пакетами фоновым потоком
+ingestion_buffer = IngestionBuffer(
+    DB_PATH,
+    max_batch_size=app.config['INGESTION_BATCH_SIZE'],
+    max_batch_age=app.config['INGESTION_FLUSH_INTERVAL'],
+    max_queue_size=app.config['INGESTION_MAX_QUEUE']
+)
+
+# Устройства могут отправлять замеры на отдельный asyncio-сервер: медленные соединения
+# не занимают потоки веб-интерфейса, замеры попадают в тот же буфер
+ingest_server = IngestServer(
+    ingestion_buffer,
+    port=app.config['INGEST_SERVER_PORT'] or 0,
+    max_connections=app.config['INGEST_SERVER_MAX_CONNECTIONS'],
+    max_batch_samples=app.config['INGESTION_MAX_BATCH_REQUEST']
+)
+
+# Почасовые агрегаты обновляются после записи новых замеров, старые сырые секции удаляются
+rollup_engine = RollupEngine(
+    DB_PATH,
+    interval=app.config['ROLLUP_INTERVAL'],
+    retention_days=app.config['RAW_RETENTION_DAYS']
+)
+add_write_listener(rollup_engine.notify)
+
+# Ответы /api/sensor-data кэшируются и сбрасываются при записи новых замеров
+sensor_data_cache = ResultCache(
+    max_entries=app.config['SENSOR_DATA_CACHE_SIZE'],
+    ttl=app.config['SENSOR_DATA_CACHE_TTL'],
+    min_age=app.config['SENSOR_DATA_CACHE_MIN_AGE']
+)
+add_write_listener(sensor_data_cache.invalidate)
+
+# Приращения по датчикам и магазинам рассылаются открытым потокам /api/events
+add_write_listener(event_broker.on_write)
+scope_resolver.add_invalidate_listener(event_broker.invalidate_stores)
+
+# При работе в нескольких процессах изменения других процессов применяются к кэшам этого:
+# новые замеры, области видимости и датчики, изменённые через API
+shared_state.on('events', event_broker.apply_remote)
+shared_state.on('events', sensor_data_cache.invalidate)
+shared_state.on('events', rollup_engine.notify)
+shared_state.on('scope', scope_resolver.invalidate)
+scope_resolver.add_invalidate_listener(lambda *args: shared_state.broadcast('scope'))
+
+def reload_registry(*args):
+    conn = get_db_connection()
+    try:
+        registry.load(conn)
+    finally:
+        conn.close()
+
+shared_state.on('sensors', reload_registry)
 
-# Путь к базе данных
-DB_PATH = 'visitor_data.db'
+# Дашборды перечитывают результаты AI по событию вместо опроса раз в минуту
+app.ai_scheduler.add_listener(lambda meta: event_broker.announce('ai', meta))
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+# Магазины на карте выдаются постранично при limit/cursor
+MAP_PAGES = Paginator('map-data', {'id': 's.id', 'name': 's.name'}, 'name',
+                      filters={'q': (('s.name', 's.address'), 'like')}, key='s.id')
 
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
@@ -51,7 +134,7 @@ def init_db():
     cursor = conn.cursor()
 
     # Получаем список существующих таблиц
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")
     existing_tables = {row[0] for row in cursor.fetchall()}
 
     print(f"Инициализация базы данных. Найдено таблиц: {len(existing_tables)}")
@@ -181,6 +264,10 @@ def init_db():
         initialize_default_data(cursor)
 
     conn.commit()
+
+    # Применяем версионированные миграции (индексы и ограничения)
+    applied_migrations = run_migrations(conn)
+    schema_version = get_schema_version(conn)
     conn.close()
 
     if created_tables:
@@ -188,6 +275,11 @@ def init_db():
     else:
         print("База данных актуальна. Новые таблицы не требуются.")
 
+    if applied_migrations:
+        print(f"Применено миграций: {len(applied_migrations)}. Версия схемы: {schema_version}")
+    else:
+        print(f"Миграции не требуются. Версия схемы: {schema_version}")
+
 def check_and_add_columns(cursor):
     """Проверяет и добавляет недостающие колонки в существующие таблицы"""
 
@@ -294,14 +386,13 @@ def login():
                 return jsonify({'success': False, 'error': 'Пожалуйста, заполните все поля'})
             return render_template('login.html', error='Пожалуйста, заполните все поля')
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        hashed_password = hash_password(password)
-        cursor.execute('SELECT * FROM users WHERE username = ? AND password = ?', 
-                      (username, hashed_password))
-        user = cursor.fetchone()
-        conn.close()
+            hashed_password = hash_password(password)
+            cursor.execute('SELECT * FROM users WHERE username = ? AND password = ?', 
+                          (username, hashed_password))
+            user = cursor.fetchone()
 
         if user:
             session['user_id'] = user['id']
@@ -367,40 +458,12 @@ def receive_visitor_count():
             }
 
         device_id = data.get('device_id', 'unknown')
-        visitor_count = data.get('count', 0)
+        visitor_count = int(data.get('count', 0))
         status = data.get('status', 'online')
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Проверяем существование датчика
-        cursor.execute('SELECT id FROM sensors WHERE name = ?', (device_id,))
-        sensor = cursor.fetchone()
-
-        if sensor:
-            sensor_id = sensor['id']
-            # Обновляем существующий датчик
-            cursor.execute('''
-                UPDATE sensors 
-                SET status = ?, last_update = ?, visitor_count = ?
-                WHERE id = ?
-            ''', (status, datetime.now(), visitor_count, sensor_id))
-        else:
-            # Создаем новый датчик
-            cursor.execute('''
-                INSERT INTO sensors (name, location, status, last_update, visitor_count)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (device_id, f'Location for {device_id}', status, datetime.now(), visitor_count))
-            sensor_id = cursor.lastrowid
-
-        # Сохраняем данные посетителей
-        cursor.execute('''
-            INSERT INTO visitor_data (sensor_id, visitor_count, timestamp)
-            VALUES (?, ?, ?)
-        ''', (sensor_id, visitor_count, datetime.now()))
-
-        conn.commit()
-        conn.close()
+        # Замер ставится в очередь и будет записан пакетом
+        if not ingestion_buffer.submit(device_id, visitor_count, status):
+            return jsonify({'status': 'error', 'message': 'Ingestion queue is full'}), 503
 
         return jsonify({'status': 'success', 'message': 'Data received'})
 
@@ -408,6 +471,68 @@ def receive_visitor_count():
         print(f"Error in receive_visitor_count: {e}")
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
+# Пакетный приём данных от шлюзов магазинов (JSON-массив или NDJSON)
+@app.route('/api/visitor-count/batch', methods=['POST'])
+def receive_visitor_count_batch():
+    body = request.get_data(as_text=True)
+
+    # Разбираем тело: JSON-массив, объект {"samples": [...]} или NDJSON
+    try:
+        items, errors = split_batch(body, request.mimetype)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    if len(items) + len(errors) > app.config['INGESTION_MAX_BATCH_REQUEST']:
+        return jsonify({'status': 'error', 'message': 'Too many samples in one batch'}), 413
+
+    # Проверяем все замеры за один проход
+    samples, invalid = parse_samples(items)
+    errors.extend(invalid)
+
+    # Все корректные замеры пишем одной транзакцией
+    if samples:
+        try:
+            with db_connection() as conn:
+                write_samples(conn, samples)
+        except sqlite3.Error as e:
+            print(f"Error in receive_visitor_count_batch: {e}")
+            return jsonify({'status': 'error', 'message': 'Database error'}), 503
+
+    errors.sort()
+    return jsonify({
+        'status': 'success' if not errors else 'partial',
+        'accepted': len(samples),
+        'rejected': len(errors),
+        'errors': errors
+    })
+
+# Состояние буфера приёма данных
+@app.route('/api/ingestion/stats')
+@login_required
+def get_ingestion_stats():
+    stats = ingestion_buffer.stats()
+    stats['rollups'] = rollup_engine.stats()
+    stats['sensor_data_cache'] = sensor_data_cache.stats()
+    stats['events'] = event_broker.stats()
+    stats['ingest_server'] = ingest_server.stats()
+    stats['shared_state'] = shared_state.stats()
+    stats['ai_scheduler'] = app.ai_scheduler.stats()
+    stats['forecast'] = app.ai_agent.forecaster.stats()
+    return jsonify(stats)
+
+# Поток изменений для дашборда (Server-Sent Events) вместо периодического опроса
+@app.route('/api/events')
+@login_required
+def stream_events():
+    subscription = event_broker.subscribe(session.get('user_id'), session.get('role'))
+    if subscription is None:
+        return jsonify({'error': 'Слишком много подключений к потоку событий'}), 503
+
+    return Response(event_broker.stream(subscription), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 # API для получения данных датчиков
 @app.route('/api/sensor-data')
 @login_required
@@ -416,61 +541,97 @@ def get_sensor_data():
     hierarchy_type = request.args.get('hierarchy_type', '')
     entity_id = request.args.get('entity_id', '')
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # Администраторы видят одни и те же данные, остальным пользователям кэш ведётся отдельно
+    user_scope = 'all' if session.get('role') == 'admin' else session.get('user_id')
+    key = ('sensor-data', period, hierarchy_type, entity_id, user_scope)
+    return jsonify(sensor_data_cache.get_or_compute(key, lambda: compute_sensor_data(period)))
 
-    # Базовый запрос для получения данных
-    if period == 'day':
-        time_condition = "datetime('now', '-1 day')"
-    elif period == 'week':
-        time_condition = "datetime('now', '-7 days')"
-    elif period == 'month':
-        time_condition = "datetime('now', '-30 days')"
-    else:
-        time_condition = "datetime('now', '-1 hour')"
-
-    # Получаем общую статистику
-    cursor.execute(f'''
-        SELECT 
-            COUNT(DISTINCT s.id) as active_sensors,
-            COALESCE(SUM(vd.visitor_count), 0) as total_visitors,
-            COUNT(vd.id) as total_records
-        FROM sensors s
-        LEFT JOIN visitor_data vd ON s.id = vd.sensor_id 
-        WHERE s.status = 'active' AND vd.timestamp > {time_condition}
-    ''')
-
-    stats = cursor.fetchone()
-
-    # Получаем данные по времени для графика
-    cursor.execute(f'''
-        SELECT 
-            strftime('%H', vd.timestamp) as hour,
-            SUM(vd.visitor_count) as visitors
-        FROM visitor_data vd
-        JOIN sensors s ON vd.sensor_id = s.id
-        WHERE vd.timestamp > {time_condition}
-        GROUP BY hour
-        ORDER BY hour
-    ''')
-
-    hourly_data = cursor.fetchall()
-
-    # Получаем список датчиков
-    cursor.execute('''
-        SELECT s.*, vd.visitor_count as current_visitors
-        FROM sensors s
-        LEFT JOIN visitor_data vd ON s.id = vd.sensor_id
-        WHERE vd.id = (
-            SELECT MAX(id) FROM visitor_data WHERE sensor_id = s.id
-        ) OR vd.id IS NULL
-    ''')
-
-    sensors_list = cursor.fetchall()
+def compute_sensor_data(period):
+    with db_connection() as conn:
+        cursor = conn.cursor()
 
-    conn.close()
+        # День, неделю и месяц считаем по почасовым агрегатам, последний час — по сырым замерам
+        rollup_offsets = {'day': '-1 day', 'week': '-7 days', 'month': '-30 days'}
+
+        if period in rollup_offsets:
+            bucket_condition = "strftime('%Y-%m-%d %H:00:00', 'now', ?)"
+            params = (rollup_offsets[period],)
+
+            # Получаем общую статистику
+            cursor.execute(f'''
+                SELECT 
+                    COUNT(DISTINCT s.id) as active_sensors,
+                    COALESCE(SUM(hs.visitor_count), 0) as total_visitors,
+                    COALESCE(SUM(hs.sample_count), 0) as total_records
+                FROM sensors s
+                JOIN hourly_statistics hs ON s.id = hs.sensor_id
+                WHERE s.status = 'active' AND hs.bucket_start >= {bucket_condition}
+            ''', params)
+
+            stats = cursor.fetchone()
+
+            # Получаем данные по времени для графика
+            cursor.execute(f'''
+                SELECT 
+                    printf('%02d', hs.hour) as hour,
+                    SUM(hs.visitor_count) as visitors
+                FROM hourly_statistics hs
+                JOIN sensors s ON hs.sensor_id = s.id
+                WHERE hs.bucket_start >= {bucket_condition}
+                GROUP BY hs.hour
+                ORDER BY hs.hour
+            ''', params)
+        else:
+            time_condition = "datetime('now', '-1 hour')"
+            # Читаем только секции visitor_data, пересекающиеся с последним часом
+            source = range_source(cursor, datetime.now() - timedelta(hours=1))
+
+            # Получаем общую статистику
+            cursor.execute(f'''
+                SELECT 
+                    COUNT(DISTINCT s.id) as active_sensors,
+                    COALESCE(SUM(vd.visitor_delta), 0) as total_visitors,
+                    COUNT(vd.id) as total_records
+                FROM sensors s
+                LEFT JOIN {source} vd ON s.id = vd.sensor_id 
+                WHERE s.status = 'active' AND vd.timestamp > {time_condition}
+            ''')
+
+            stats = cursor.fetchone()
+
+            # Получаем данные по времени для графика
+            cursor.execute(f'''
+                SELECT 
+                    strftime('%H', vd.timestamp) as hour,
+                    SUM(vd.visitor_delta) as visitors
+                FROM {source} vd
+                JOIN sensors s ON vd.sensor_id = s.id
+                WHERE vd.timestamp > {time_condition}
+                GROUP BY hour
+                ORDER BY hour
+            ''')
+
+        hourly_data = cursor.fetchall()
+
+        # Получаем список датчиков; последние показания берём из sensor_latest и реестра, а не из visitor_data
+        registry.ensure_loaded(conn)
+        cursor.execute('''
+            SELECT s.*, COALESCE(sl.visitor_count, 0) as current_visitors, sl.timestamp as last_reading_at
+            FROM sensors s
+            LEFT JOIN sensor_latest sl ON sl.sensor_id = s.id
+        ''')
 
-    return jsonify({
+        sensors_list = []
+        for row in cursor.fetchall():
+            sensor = dict(row)
+            state = registry.get(sensor['id'])
+            if state:
+                sensor['status'] = state['status']
+                sensor['last_update'] = state['last_update']
+                sensor['visitor_count'] = state['visitor_count']
+            sensors_list.append(sensor)
+
+    return {
         'total_visitors': stats['total_visitors'] or 0,
         'active_sensors': stats['active_sensors'] or 0,
         'peak_weekday': '14:30',
@@ -478,20 +639,27 @@ def get_sensor_data():
         'unique_visitors': int((stats['total_visitors'] or 0) * 0.7),
         'repeat_visits': int((stats['total_visitors'] or 0) * 0.3),
         'hourly_data': [dict(row) for row in hourly_data],
-        'sensors': [dict(row) for row in sensors_list]
-    })
+        'sensors': sensors_list
+    }
+
+# Последнее состояние датчиков из реестра
+@app.route('/api/sensors/live')
+@login_required
+def get_sensors_live():
+    with db_connection() as conn:
+        registry.ensure_loaded(conn)
+    return jsonify(registry.snapshot())
 
 # API для иерархии
 @app.route('/api/hierarchy')
 @login_required
 def get_hierarchy():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute('SELECT id, name FROM stores ORDER BY name')
+        cursor.execute('SELECT id, name FROM stores ORDER BY name')
 
-    options = cursor.fetchall()
-    conn.close()
+        options = cursor.fetchall()
 
     return jsonify([dict(row) for row in options])
 
@@ -499,33 +667,24 @@ def get_hierarchy():
 @app.route('/api/sensors')
 @login_required
 def get_sensors():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with db_connection() as conn:
+        cursor = conn.cursor()
 
-    cursor.execute('''
-        SELECT 
-            s.id,
-            s.name,
-            s.location,
-            s.status,
-            s.last_update,
-            s.visitor_count,
-            COALESCE(vd.visitor_count, 0) as current_visitors
-        FROM sensors s
-        LEFT JOIN (
-            SELECT sensor_id, visitor_count
-            FROM visitor_data vd1
-            WHERE vd1.timestamp = (
-                SELECT MAX(timestamp) 
-                FROM visitor_data vd2 
-                WHERE vd2.sensor_id = vd1.sensor_id
-            )
-        ) vd ON s.id = vd.sensor_id
-        ORDER BY s.name
-    ''')
+        cursor.execute('''
+            SELECT 
+                s.id,
+                s.name,
+                s.location,
+                s.status,
+                s.last_update,
+                s.visitor_count,
+                COALESCE(sl.visitor_count, 0) as current_visitors
+            FROM sensors s
+            LEFT JOIN sensor_latest sl ON sl.sensor_id = s.id
+            ORDER BY s.name
+        ''')
 
-    sensors_list = cursor.fetchall()
-    conn.close()
+        sensors_list = cursor.fetchall()
 
     result = []
     for sensor in sensors_list:
@@ -542,39 +701,35 @@ def get_sensors():
 def get_map_data():
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            SELECT 
-                s.id,
-                s.name,
-                s.address,
-                s.latitude,
-                s.longitude
-            FROM stores s
-            ORDER BY s.name
-        ''')
-
-        stores = cursor.fetchall()
-        conn.close()
+        with db_connection() as conn:
+            cursor = conn.cursor()
+
+            page = MAP_PAGES.fetch(cursor, '''
+                SELECT 
+                    s.id,
+                    s.name,
+                    s.address,
+                    s.latitude,
+                    s.longitude
+                FROM stores s
+            ''', (), request.args)
 
         # Добавляем случайные данные для демонстрации
         import random
-        result = []
-        for store in stores:
-            store_data = dict(store)
+        for store_data in (page if isinstance(page, list) else page['items']):
             store_data['visitors_today'] = random.randint(20, 150)
             store_data['conversion'] = round(random.uniform(5.0, 20.0), 1)
             store_data['revenue'] = random.randint(15000, 75000)
-            result.append(store_data)
 
-        return jsonify(result)
+        return jsonify(page)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Error in get_map_data: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/sensor-assignment', methods=['DELETE'])
+@requires('stores', 'update')
 def unassign_sensor():
     try:
         data = request.get_json()
@@ -583,12 +738,10 @@ def unassign_sensor():
         if not sensor_id:
             return jsonify({'success': False, 'error': 'Sensor ID is required'})
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with db_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute('UPDATE sensors SET store_id = NULL WHERE id = ?', (sensor_id,))
-        conn.commit()
-        conn.close()
+            cursor.execute('UPDATE sensors SET store_id = NULL WHERE id = ?', (sensor_id,))
 
         return jsonify({'success': True})
 
@@ -628,19 +781,45 @@ def save_settings():
         print(f"Error saving settings: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+def start_background(shared: bool = False, ingest: bool = True, rollups: bool = True, precompute: bool = True):
+    """
+    Запуск фоновой работы процесса (после init_db)
+
+    Args:
+        shared: Приложение работает в нескольких процессах — кэши, реестр датчиков
+            и счётчики сверяются через shared_state и базу
+        ingest: Запустить асинхронный сервер приёма на INGEST_SERVER_PORT
+        rollups: Запустить свёртку почасовых агрегатов (достаточно одного процесса)
+        precompute: Пересчитывать результаты AI в фоне (достаточно одного процесса)
+    """
+    reload_registry()
+
+    if shared:
+        registry.shared = True
+        shared_state.start()
+
+    ingestion_buffer.start()
+    event_broker.start()
+    if rollups:
+        rollup_engine.start()
+    if precompute:
+        app.ai_scheduler.start()
+    if ingest and app.config['INGEST_SERVER_PORT']:
+        ingest_server.start()
+
 if __name__ == '__main__':
+    # Запуск для разработки: один процесс с отладчиком. В продакшене — run_production.py
     if not os.path.exists('flask_session'):
         os.makedirs('flask_session')
 
     init_db()
-
-    # Инициализация AI агента
-    ai_agent = BelwestAIAgent()
-    app.ai_agent = ai_agent
-
-    # Регистрация AI endpoints
-    create_ai_endpoints(app)
-
-    print("AI агент инициализирован и активирован")
-
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # С debug=True Werkzeug повторно запускает модуль в дочернем процессе и обслуживает запросы там:
+    # порт приёма и фоновые потоки открываются только в нём, иначе родитель займёт порт 5001
+    # и будет принимать замеры мимо потока событий, кэшей и реестра дочернего процесса.
+    # Без встроенного сервера приёма замеры пишет отдельный процесс ingest_server.py —
+    # тогда процессы согласуются через shared_state
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background(shared=not app.config['INGEST_SERVER_PORT'])
+        print("AI агент инициализирован и активирован")
+
+    app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,160 @@
+"""
+Согласование процессов BELWEST
+Когда приложение работает в нескольких процессах, каждый держит свои кэши и реестр датчиков.
+Изменения публикуются в журнал shared_events общей базы, а фоновый поток каждого процесса
+читает журнал и применяет чужие изменения к своим копиям
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from database import get_db_connection
+
+# Как часто процесс читает журнал (секунды) — это и задержка согласования
+POLL_INTERVAL = 0.5
+
+# Сколько секунд записи хранятся в журнале
+RETENTION = 300.0
+PRUNE_INTERVAL = 60.0
+
+
+class SharedState:
+    def __init__(self, db_path: Optional[str] = None, poll_interval: float = POLL_INTERVAL,
+                 retention: float = RETENTION):
+        """
+        Инициализация журнала изменений
+
+        До start() процесс считается единственным: broadcast() ничего не делает.
+
+        Args:
+            db_path: Путь к базе данных (по умолчанию общая база приложения)
+            poll_interval: Интервал чтения журнала (секунды)
+            retention: Время хранения записей журнала (секунды)
+        """
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.retention = retention
+
+        self._handlers = {}
+        self._last_id = 0
+        self._last_prune = 0.0
+        self._local = threading.local()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._stats = {
+            'published': 0,
+            'applied': 0,
+            'last_error': None
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def on(self, name: str, handler: Callable[[Any], None]):
+        """Обработчик изменений name из других процессов: handler(payload)"""
+        self._handlers.setdefault(name, []).append(handler)
+
+    def broadcast(self, name: str, payload: Any = None):
+        """
+        Публикация изменения для остальных процессов
+
+        Изменения, которые сам процесс применяет из журнала, повторно не публикуются.
+        """
+        if not self.enabled or getattr(self._local, 'applying', False):
+            return
+        conn = get_db_connection(self.db_path)
+        try:
+            conn.execute('''
+                INSERT INTO shared_events (name, origin, payload, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (name, os.getpid(), json.dumps(payload, ensure_ascii=False, default=str), time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+        self._stats['published'] += 1
+
+    def start(self):
+        """Запуск чтения журнала; вызывается в каждом процессе после fork"""
+        if self.enabled:
+            return
+        conn = get_db_connection(self.db_path)
+        try:
+            # История до запуска процесса уже отражена в базе, из которой он загрузился
+            self._last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM shared_events').fetchone()[0]
+        finally:
+            conn.close()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='shared-state', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 10.0):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def poll(self) -> int:
+        """
+        Применение новых записей журнала от других процессов
+
+        Returns:
+            Число применённых записей
+        """
+        conn = get_db_connection(self.db_path)
+        try:
+            rows = conn.execute('''
+                SELECT id, name, origin, payload FROM shared_events WHERE id > ? ORDER BY id
+            ''', (self._last_id,)).fetchall()
+
+            if time.monotonic() - self._last_prune >= PRUNE_INTERVAL:
+                self._last_prune = time.monotonic()
+                conn.execute('DELETE FROM shared_events WHERE created_at < ?', (time.time() - self.retention,))
+                conn.commit()
+        finally:
+            conn.close()
+
+        pid = os.getpid()
+        applied = 0
+        self._local.applying = True
+        try:
+            for row_id, name, origin, payload in rows:
+                self._last_id = row_id
+                if origin == pid:
+                    continue
+                data = json.loads(payload) if payload else None
+                for handler in self._handlers.get(name, []):
+                    try:
+                        handler(data)
+                    except Exception as e:
+                        print(f"Ошибка применения изменения {name} из другого процесса: {e}")
+                applied += 1
+        finally:
+            self._local.applying = False
+
+        self._stats['applied'] += applied
+        return applied
+
+    def stats(self) -> Dict[str, Any]:
+        stats = dict(self._stats)
+        stats['enabled'] = self.enabled
+        stats['pid'] = os.getpid()
+        stats['last_id'] = self._last_id
+        return stats
+
+    def _run(self):
+        while not self._stopping.wait(self.poll_interval):
+            try:
+                self.poll()
+                self._stats['last_error'] = None
+            except Exception as e:
+                self._stats['last_error'] = str(e)
+                print(f"Ошибка чтения журнала изменений: {e}")
+
+
+# Общий журнал изменений процесса
+shared_state = SharedState()
@@ -0,0 +1,91 @@
+// Поток изменений с сервера (Server-Sent Events) вместо периодического опроса
+class LiveFeed {
+    constructor(url = '/api/events') {
+        this.url = url;
+        this.source = null;
+        this.handlers = {};
+        this.connectedOnce = false;
+        this.fallbackInterval = null;
+        this.fallbackDelay = 30000; // опрос, пока поток недоступен
+    }
+
+    // Подписка на события: sensor, store, status, ai (новые результаты AI), resync
+    on(type, handler) {
+        if (!this.handlers[type]) {
+            this.handlers[type] = [];
+        }
+        this.handlers[type].push(handler);
+        return this;
+    }
+
+    emit(type, data) {
+        (this.handlers[type] || []).forEach(handler => {
+            try {
+                handler(data);
+            } catch (error) {
+                console.error(`Ошибка обработчика события ${type}:`, error);
+            }
+        });
+    }
+
+    start() {
+        if (this.source) return;
+
+        if (typeof EventSource === 'undefined') {
+            this.startFallback();
+            return;
+        }
+
+        this.source = new EventSource(this.url);
+
+        ['sensor', 'store', 'status', 'ai', 'resync'].forEach(type => {
+            this.source.addEventListener(type, event => this.emit(type, JSON.parse(event.data)));
+        });
+
+        this.source.addEventListener('ready', () => {
+            this.stopFallback();
+            // События, пришедшие во время обрыва, не досылаются — данные перечитываются целиком
+            if (this.connectedOnce) {
+                this.emit('resync', { reason: 'reconnect' });
+            }
+            this.connectedOnce = true;
+            console.log('Поток событий подключен');
+        });
+
+        this.source.onerror = () => {
+            // EventSource переподключается сам; закрытый поток (401, 503) заменяется опросом
+            if (this.source && this.source.readyState === EventSource.CLOSED) {
+                this.source = null;
+            }
+            this.startFallback();
+        };
+    }
+
+    stop() {
+        if (this.source) {
+            this.source.close();
+            this.source = null;
+        }
+        this.stopFallback();
+    }
+
+    isRunning() {
+        return this.source !== null || this.fallbackInterval !== null;
+    }
+
+    startFallback() {
+        if (this.fallbackInterval) return;
+        this.fallbackInterval = setInterval(() => {
+            this.emit('resync', { reason: 'poll' });
+        }, this.fallbackDelay);
+    }
+
+    stopFallback() {
+        if (this.fallbackInterval) {
+            clearInterval(this.fallbackInterval);
+            this.fallbackInterval = null;
+        }
+    }
+}
+
+window.liveFeed = new LiveFeed();
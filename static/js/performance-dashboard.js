@@ -432,6 +432,20 @@ class PerformanceDashboard {
     }
 
     setupAutoRefresh() {
+        if (window.liveFeed) {
+            // Метрики перечитываются после смены статуса датчиков, но не чаще updateInterval
+            let lastLoad = Date.now();
+            const refresh = () => {
+                if (!this.isPaused && Date.now() - lastLoad >= this.updateInterval) {
+                    lastLoad = Date.now();
+                    this.loadPerformanceData();
+                }
+            };
+            window.liveFeed.on('status', refresh).on('resync', refresh);
+            window.liveFeed.start();
+            return;
+        }
+
         setInterval(() => {
             if (!this.isPaused) {
                 this.loadPerformanceData();
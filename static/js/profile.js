@@ -7,6 +7,12 @@ let assignedSensors = [];
 let selectedAvailableSensors = [];
 let selectedAssignedSensors = [];
 
+// Постраничный вывод таблицы пользователей: курсоры уже открытых страниц для кнопки "Назад"
+const USERS_PAGE_SIZE = 50;
+let usersCursors = [''];
+let usersNextCursor = null;
+let usersTotal = 0;
+
 // Инициализация страницы
 document.addEventListener('DOMContentLoaded', function() {
     console.log('Загрузка страницы управления пользователями...');
@@ -210,12 +216,24 @@ function initializeHierarchyManagement() {
     loadHierarchy();
 }
 
-// Загрузка пользователей
+// Загрузка пользователей: таблица по страницам, селекты — только нужные поля
 function loadUsers() {
-    fetch('/api/users')
+    const cursor = usersCursors[usersCursors.length - 1];
+    fetch(`/api/users?limit=${USERS_PAGE_SIZE}&cursor=${encodeURIComponent(cursor)}`)
+        .then(response => response.json())
+        .then(page => {
+            usersNextCursor = page.next_cursor;
+            usersTotal = page.total;
+            updateUsersList(page.items);
+            updateUsersPagination();
+        })
+        .catch(error => {
+            console.error('Ошибка загрузки пользователей:', error);
+        });
+
+    fetch('/api/users?fields=id,username,role')
         .then(response => response.json())
         .then(users => {
-            updateUsersList(users);
             updateUserSelects(users);
         })
         .catch(error => {
@@ -223,6 +241,35 @@ function loadUsers() {
         });
 }
 
+// Кнопки страниц под таблицей пользователей
+function updateUsersPagination() {
+    const container = document.getElementById('users-pagination');
+    if (!container) return;
+
+    const pageCount = Math.max(Math.ceil(usersTotal / USERS_PAGE_SIZE), 1);
+    const currentPage = usersCursors.length;
+
+    container.innerHTML = `
+        <button class="btn-secondary" ${currentPage <= 1 ? 'disabled' : ''}
+                onclick="showPreviousUsersPage()">Назад</button>
+        <span>Страница ${currentPage} из ${pageCount} (всего ${usersTotal})</span>
+        <button class="btn-secondary" ${usersNextCursor ? '' : 'disabled'}
+                onclick="showNextUsersPage()">Вперед</button>
+    `;
+}
+
+function showNextUsersPage() {
+    if (!usersNextCursor) return;
+    usersCursors.push(usersNextCursor);
+    loadUsers();
+}
+
+function showPreviousUsersPage() {
+    if (usersCursors.length <= 1) return;
+    usersCursors.pop();
+    loadUsers();
+}
+
 // Загрузка датчиков
 function loadSensors() {
     fetch('/api/sensors')
@@ -263,7 +310,7 @@ function updateUsersList(users) {
             <td>${user.username}</td>
             <td>${user.email}</td>
             <td><span class="role-badge role-${user.role}">${getRoleName(user.role)}</span></td>
-            <td>${user.sensors ? user.sensors.map(s => `<span class="sensor-tag">${s}</span>`).join('') : ''}</td>
+            <td>${user.sensors ? user.sensors.map(s => `<span class="sensor-tag">${s.name}</span>`).join('') : ''}</td>
             <td>
                 <button class="btn-edit" onclick="editUser(${user.id})">Редактировать</button>
                 <button class="btn-delete" onclick="deleteUserById(${user.id})">Удалить</button>
@@ -545,7 +592,7 @@ function clearSensorAssignmentLists() {
 
 // Загрузка пользователей для назначения
 function loadUsersForAssignment() {
-    fetch('/api/users')
+    fetch('/api/users?fields=id,username,role')
         .then(response => response.json())
         .then(users => {
             const select = document.getElementById('assignment-user-select');
@@ -566,7 +613,7 @@ function loadUsersForAssignment() {
 
 // Загрузка пользователей для иерархии
 function loadUsersForHierarchy() {
-    fetch('/api/users')
+    fetch('/api/users?fields=id,username,role')
         .then(response => response.json())
         .then(users => {
             updateHierarchySelects(users);
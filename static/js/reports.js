@@ -208,42 +208,42 @@ document.addEventListener("DOMContentLoaded", function () {
             return;
         }
         
+        // CSV, Excel и колоночные форматы скачиваются потоком, без промежуточного файла на сервере
+        if (['csv', 'xlsx', 'parquet', 'arrow'].includes(format)) {
+            const params = new URLSearchParams({ format: format, start_date: start, end_date: end });
+            const link = document.createElement('a');
+            link.href = `/api/export/stream?${params.toString()}`;
+            document.body.appendChild(link);
+            link.click();
+            document.body.removeChild(link);
+            
+            showNotification(`Отчет в формате ${format.toUpperCase()} загружается`, 'success');
+            addToHistory(link.href, format, start, end);
+            return;
+        }
+        
         const generateBtn = document.getElementById("generate-report");
         const originalText = generateBtn.innerHTML;
         
         generateBtn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Генерация...';
         generateBtn.disabled = true;
         
-        fetch("/api/export", {
+        // Остальные форматы собираются фоновым заданием выгрузки на сервере
+        fetch("/api/export/jobs", {
             method: "POST",
             headers: { 
-                "Content-Type": "application/x-www-form-urlencoded" 
+                "Content-Type": "application/json" 
             },
-            body: `format=${format}&start_date=${start}&end_date=${end}`,
-        })
-        .then(response => {
-            if (!response.ok) {
-                throw new Error('Network response was not ok');
-            }
-            return response.json();
+            body: JSON.stringify({ format: format, start_date: start, end_date: end }),
         })
-        .then(data => {
-            if (data.filename) {
-                showNotification(`Отчет успешно сгенерирован в формате ${format.toUpperCase()}`, 'success');
-                
-                // Создаем ссылку для скачивания
-                const link = document.createElement('a');
-                link.href = `/static/${data.filename}`;
-                link.download = data.filename;
-                document.body.appendChild(link);
-                link.click();
-                document.body.removeChild(link);
-                
-                // Добавляем в историю
-                addToHistory(data.filename, format, start, end);
-            } else {
-                showNotification("Ошибка при генерации отчета", 'error');
-            }
+        .then(readJob)
+        .then(waitForJob)
+        .then(job => {
+            showNotification(`Отчет успешно сгенерирован в формате ${format.toUpperCase()}`, 'success');
+            
+            const url = `/api/export/jobs/${job.id}/download`;
+            window.downloadFile(url);
+            addToHistory(url, format, start, end);
         })
         .catch(error => {
             console.error("Error generating report:", error);
@@ -255,7 +255,30 @@ document.addEventListener("DOMContentLoaded", function () {
         });
     }
     
-    function addToHistory(filename, format, startDate, endDate) {
+    function readJob(response) {
+        return response.json().then(job => {
+            if (!response.ok) {
+                throw new Error(job.error || 'Network response was not ok');
+            }
+            return job;
+        });
+    }
+    
+    // Опрос состояния задания, пока файл не будет готов
+    function waitForJob(job) {
+        if (job.status === 'done') {
+            return Promise.resolve(job);
+        }
+        if (job.status !== 'queued' && job.status !== 'running') {
+            return Promise.reject(new Error(job.error || `Задание выгрузки: ${job.status}`));
+        }
+        return new Promise(resolve => setTimeout(resolve, 1000))
+            .then(() => fetch(`/api/export/jobs/${job.id}`))
+            .then(readJob)
+            .then(waitForJob);
+    }
+    
+    function addToHistory(url, format, startDate, endDate) {
         const historyContainer = document.querySelector('.reports-history');
         if (!historyContainer) return;
         
@@ -269,7 +292,7 @@ document.addEventListener("DOMContentLoaded", function () {
             <div class="history-format">${format.toUpperCase()}</div>
             <div class="history-size">-</div>
             <div class="history-actions">
-                <button class="btn-download" onclick="downloadFile('${filename}')">
+                <button class="btn-download" onclick="downloadFile('${url}')">
                     <i class="fas fa-download"></i>
                 </button>
                 <button class="btn-delete" onclick="deleteHistoryItem(this)">
@@ -282,10 +305,9 @@ document.addEventListener("DOMContentLoaded", function () {
     }
     
     // Глобальные функции для работы с историей
-    window.downloadFile = function(filename) {
+    window.downloadFile = function(url) {
         const link = document.createElement('a');
-        link.href = `/static/${filename}`;
-        link.download = filename;
+        link.href = url;
         document.body.appendChild(link);
         link.click();
         document.body.removeChild(link);
@@ -223,6 +223,17 @@ function applyNotifications(enabled) {
 }
 
 function applyAutoRefresh(enabled) {
+    // На дашборде данные приходят потоком событий, опрос не нужен
+    if (window.liveFeed) {
+        if (enabled) {
+            window.liveFeed.start();
+        } else {
+            window.liveFeed.stop();
+        }
+        console.log('Автообновление', enabled ? 'включено' : 'выключено');
+        return;
+    }
+
     if (enabled) {
         if (window.autoRefreshInterval) {
             clearInterval(window.autoRefreshInterval);
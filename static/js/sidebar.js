@@ -437,6 +437,10 @@ function showNotification(message, type) {
 let autoRefreshInterval;
 
 function startAutoRefresh() {
+    if (window.liveFeed) {
+        window.liveFeed.start();
+        return;
+    }
     if (autoRefreshInterval) clearInterval(autoRefreshInterval);
     autoRefreshInterval = setInterval(() => {
         console.log('Auto-refreshing data...');
@@ -445,6 +449,9 @@ function startAutoRefresh() {
 }
 
 function stopAutoRefresh() {
+    if (window.liveFeed) {
+        window.liveFeed.stop();
+    }
     if (autoRefreshInterval) {
         clearInterval(autoRefreshInterval);
         autoRefreshInterval = null;
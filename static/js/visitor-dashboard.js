@@ -2,6 +2,8 @@
 let visitorsChart;
 let isActivityPaused = false;
 let activityUpdateInterval;
+// Последнее состояние датчиков по id: к нему применяются изменения из потока событий
+const dashboardSensors = new Map();
 
 // Функция инициализации
 document.addEventListener('DOMContentLoaded', function() {
@@ -13,6 +15,7 @@ document.addEventListener('DOMContentLoaded', function() {
     initializeDashboard();
     initializeChart();
     loadDashboardData();
+    loadAIInsights();
     setupEventListeners();
     startRealTimeUpdates();
 
@@ -81,6 +84,7 @@ function handleHierarchyChange(event) {
 // Обработчик изменения сущности
 function handleEntityChange() {
     loadDashboardData();
+    loadAIInsights();
 }
 
 // Обработчик изменения периода
@@ -366,16 +370,20 @@ function updateSensorsList(sensors) {
         return;
     }
 
+    dashboardSensors.clear();
     sensors.forEach(sensor => {
+        dashboardSensors.set(sensor.id, sensor);
         const sensorElement = createSensorElement(sensor);
         sensorsList.appendChild(sensorElement);
     });
 
     // Обновляем активность датчиков
     updateSensorsActivity(sensors);
+}
 
-    // Сохраняем данные для других функций
-    localStorage.setItem('lastSensorsData', JSON.stringify(sensors));
+// Датчик передаёт замеры (устройства присылают online, датчики из API — active)
+function isSensorOnline(status) {
+    return status === 'active' || status === 'online';
 }
 
 // Создание элемента датчика
@@ -383,9 +391,10 @@ function createSensorElement(sensor) {
     const sensorDiv = document.createElement('div');
     sensorDiv.className = 'sensor-item';
     sensorDiv.setAttribute('data-status', sensor.status || 'offline');
+    sensorDiv.setAttribute('data-sensor-id', sensor.id);
 
-    const statusClass = sensor.status === 'active' ? 'online' : 'offline';
-    const statusText = sensor.status === 'active' ? 'Онлайн' : 'Офлайн';
+    const statusClass = isSensorOnline(sensor.status) ? 'online' : 'offline';
+    const statusText = isSensorOnline(sensor.status) ? 'Онлайн' : 'Офлайн';
     const visitors = sensor.visitors || sensor.visitor_count || sensor.current_visitors || 0;
 
     sensorDiv.innerHTML = `
@@ -420,8 +429,9 @@ function updateSensorsActivity(sensors) {
 function createSensorActivityItem(sensor) {
     const activityDiv = document.createElement('div');
     activityDiv.className = 'sensor-activity-item';
+    activityDiv.setAttribute('data-sensor-id', sensor.id);
 
-    const statusClass = sensor.status === 'active' ? 'online' : 'offline';
+    const statusClass = isSensorOnline(sensor.status) ? 'online' : 'offline';
     const visitors = sensor.visitors || sensor.visitor_count || sensor.current_visitors || 0;
     const lastUpdate = sensor.last_update ? new Date(sensor.last_update).toLocaleTimeString() : 'Неизвестно';
 
@@ -437,7 +447,7 @@ function createSensorActivityItem(sensor) {
             </div>
             <div class="activity-status ${statusClass}">
                 <i class="fas fa-circle"></i>
-                <span>${sensor.status === 'active' ? 'Онлайн' : 'Офлайн'}</span>
+                <span>${isSensorOnline(sensor.status) ? 'Онлайн' : 'Офлайн'}</span>
             </div>
             <div class="activity-time">
                 <i class="fas fa-clock"></i>
@@ -502,6 +512,12 @@ function addActivityItem(sensor) {
 
 // Настройка обработчиков событий
 function setupEventListeners() {
+    // Обновление AI инсайтов по кнопке
+    const refreshAIBtn = document.getElementById('refresh-ai-insights');
+    if (refreshAIBtn) {
+        refreshAIBtn.addEventListener('click', loadAIInsights);
+    }
+
     // Кнопки фильтра статуса датчиков
     const statusFilters = document.querySelectorAll('.status-filter .filter-btn');
     statusFilters.forEach(btn => {
@@ -687,16 +703,124 @@ function refreshDashboardData() {
 
 // Запуск обновлений в реальном времени
 function startRealTimeUpdates() {
-    // Обновляем данные каждые 30 секунд
-    setInterval(loadDashboardData, 30000);
+    if (!window.liveFeed) {
+        // Без потока событий обновляем данные каждые 30 секунд, AI инсайты — каждую минуту
+        setInterval(loadDashboardData, 30000);
+        setInterval(loadAIInsights, 60000);
+        return;
+    }
+
+    // Сервер присылает только изменения, они применяются к уже загруженным данным;
+    // AI инсайты перечитываются, когда сервер пересчитал их
+    window.liveFeed
+        .on('sensor', applySensorUpdate)
+        .on('status', applyStatusChange)
+        .on('ai', () => loadAIInsights())
+        .on('resync', () => {
+            loadDashboardData();
+            loadAIInsights();
+        });
+
+    const settings = JSON.parse(localStorage.getItem('belwest_settings') || '{}');
+    if (settings.autoRefresh !== false) {
+        window.liveFeed.start();
+    }
+}
+
+// Новые замеры датчика: счётчик, приращение посетителей и время замера
+function applySensorUpdate(update) {
+    const { visitors, ...state } = update;
+    const sensor = { ...(dashboardSensors.get(update.id) || {}), ...state };
+    dashboardSensors.set(sensor.id, sensor);
+    renderSensor(sensor);
 
-    // Обновляем активность каждые 5 секунд
-    setInterval(() => {
+    if (visitors > 0) {
+        addToMetric('total-visitors', visitors);
+        addToCurrentHour(visitors);
         if (!isActivityPaused) {
-            const sensors = JSON.parse(localStorage.getItem('lastSensorsData') || '[]');
-            updateActivityStream(sensors);
+            addActivityItem({ ...sensor, visitors: visitors });
+            trimActivityStream();
         }
-    }, 5000);
+    }
+}
+
+// Смена статуса датчика, в том числе переход в offline без замеров
+function applyStatusChange(change) {
+    const sensor = dashboardSensors.get(change.id);
+    if (!sensor) return;
+
+    const wasOnline = isSensorOnline(sensor.status);
+    sensor.status = change.status;
+    renderSensor(sensor);
+
+    if (wasOnline !== isSensorOnline(change.status)) {
+        addToMetric('active-sensors', wasOnline ? -1 : 1);
+    }
+}
+
+// Замена элементов одного датчика без перерисовки всего списка
+function renderSensor(sensor) {
+    const sensorsList = document.getElementById('sensors-list');
+    if (sensorsList) {
+        const existing = sensorsList.querySelector(`.sensor-item[data-sensor-id="${sensor.id}"]`);
+        const element = createSensorElement(sensor);
+        if (existing) {
+            existing.replaceWith(element);
+        } else {
+            sensorsList.querySelector('.no-data')?.remove();
+            sensorsList.appendChild(element);
+        }
+    }
+
+    const activityList = document.getElementById('sensors-activity-list');
+    if (activityList) {
+        const existing = activityList.querySelector(`.sensor-activity-item[data-sensor-id="${sensor.id}"]`);
+        const element = createSensorActivityItem(sensor);
+        if (existing) {
+            existing.replaceWith(element);
+        } else {
+            activityList.appendChild(element);
+        }
+    }
+}
+
+// Приращение числовой метрики на странице
+function addToMetric(id, delta) {
+    const element = document.getElementById(id);
+    if (!element) return;
+
+    const value = parseInt(element.textContent, 10);
+    if (isNaN(value)) return;
+
+    element.textContent = Math.max(value + delta, 0);
+    element.classList.add('metric-updated');
+    setTimeout(() => {
+        element.classList.remove('metric-updated');
+    }, 1000);
+}
+
+// Приращение точки текущего часа на графике
+function addToCurrentHour(visitors) {
+    if (!visitorsChart) return;
+
+    const hour = new Date().getHours();
+    const index = visitorsChart.data.labels.findIndex(label => parseInt(label, 10) === hour);
+    if (index === -1) return;
+
+    visitorsChart.data.datasets[0].data[index] += visitors;
+    visitorsChart.update('none');
+}
+
+// Ограничение потока активности последними 10 событиями
+function trimActivityStream() {
+    const activityStream = document.getElementById('activity-stream');
+    if (!activityStream) return;
+
+    activityStream.querySelector('.no-activity')?.remove();
+    const items = activityStream.querySelectorAll('.activity-item');
+    for (let i = 10; i < items.length; i++) {
+        items[i].remove();
+    }
 }
 
 // Отображение состояния загрузки
@@ -912,8 +1036,7 @@ function showErrorState(message) {
 
 // Глобальные функции для экспорта
 window.refreshDashboardData = refreshDashboardData;
-window.filterSensorsList = filter```python
-SensorsByStatus;
+window.filterSensorsList = filterSensorsByStatus;
 window.toggleActivityStream = toggleActivityPause;
 window.clearActivityStream = clearActivityStream;
 window.updateStoresData = updateStoresData;
@@ -931,127 +1054,6 @@ function filterSensorsByStatus(filter) {
     });
 }
 
-// Функция переключения потока активности
-function toggleActivityPause() {
-    const btn = document.getElementById('pause-activity');
-    const icon = btn.querySelector('i');
-
-    if (icon.classList.contains('fa-pause')) {
-        icon.classList.remove('fa-pause');
-        icon.classList.add('fa-play');
-        // Приостановить обновления
-        if (window.activityInterval) {
-            clearInterval(window.activityInterval);
-        }
-    } else {
-        icon.classList.remove('fa-play');
-        icon.classList.add('fa-pause');
-        // Возобновить обновления
-        startActivityUpdates();
-    }
-}
-
-// Функция очистки активности
-function clearActivityStream() {
-    const activityStream = document.getElementById('activity-stream');
-    if (activityStream) {
-        activityStream.innerHTML = '';
-    }
-}
-
-// Функция запуска обновлений активности
-function startActivityUpdates() {
-    window.activityInterval = setInterval(() => {
-        // Добавляем случайную активность для демонстрации
-        addActivityItem();
-    }, 5000);
-}
-
-// Функция добавления элемента активности
-function addActivityItem() {
-    const activityStream = document.getElementById('activity-stream');
-    if (!activityStream) return;
-
-    const activities = [
-        'Новый посетитель в ТЦ Галерея',
-        'Датчик #5 обновил статус',
-        'Пик активности в BELWEST Dana Mall',
-        'Подключен новый датчик',
-        'Превышен лимит посетителей в VIP зоне'
-    ];
-
-    const activity = activities[Math.floor(Math.random() * activities.length)];
-    const time = new Date().toLocaleTimeString();
-
-    const activityItem = document.createElement('div');
-    activityItem.className = 'activity-item';
-    activityItem.innerHTML = `
-        <div class="activity-icon">
-            <i class="fas fa-circle"></i>
-        </div>
-        <div class="activity-content">
-            <div class="activity-text">${activity}</div>
-            <div class="activity-time">${time}</div>
-        </div>
-    `;
-
-    activityStream.insertBefore(activityItem, activityStream.firstChild);
-
-    // Ограничиваем количество элементов
-    const items = activityStream.querySelectorAll('.activity-item');
-    if (items.length > 10) {
-        items[items.length - 1].remove();
-    }
-}
-function loadDashboard() {
-    console.log('Дашборд загружается...');
-    updateMetrics();
-    loadChartData();
-    loadAIInsights();
-
-    // Автообновление каждые 30 секунд
-    setInterval(updateMetrics, 30000);
-    setInterval(loadAIInsights, 60000); // AI инсайты каждую минуту
-
-    // Обработчик кнопки обновления AI инсайтов
-    const refreshAIBtn = document.getElementById('refresh-ai-insights');
-    if (refreshAIBtn) {
-        refreshAIBtn.addEventListener('click', loadAIInsights);
-    }
-
-    console.log('Дашборд инициализирован');
-}
-
-// Проверка авторизации в запросах
-function fetchWithAuth(url, options = {}) {
-    return fetch(url, options)
-        .then(response => {
-            if (response.status === 401) {
-                window.location.href = '/login';
-                return;
-            }
-            return response;
-        });
-}
-function loadDashboard() {
-    console.log('Дашборд загружается...');
-    updateMetrics();
-    loadChartData();
-    loadAIInsights();
-
-    // Автообновление каждые 30 секунд
-    setInterval(updateMetrics, 30000);
-    setInterval(loadAIInsights, 60000); // AI инсайты каждую минуту
-
-    // Обработчик кнопки обновления AI инсайтов
-    const refreshAIBtn = document.getElementById('refresh-ai-insights');
-    if (refreshAIBtn) {
-        refreshAIBtn.addEventListener('click', loadAIInsights);
-    }
-
-    console.log('Дашборд инициализирован');
-}
-
 // Проверка авторизации в запросах
 function fetchWithAuth(url, options = {}) {
     return fetch(url, options)
@@ -1116,8 +1118,15 @@ async function loadAIInsights() {
             </div>
         `;
 
+        // При выбранном магазине AI анализирует только его датчики
+        const params = new URLSearchParams();
+        const hierarchyType = document.getElementById('hierarchy-type')?.value;
+        const entityId = document.getElementById('entity-selector')?.value;
+        if (hierarchyType === 'store' && entityId) params.append('store_id', entityId);
+        const query = params.toString() ? `?${params}` : '';
+
         // Загружаем инсайты
-        const insightsResponse = await fetch('/api/ai/insights');
+        const insightsResponse = await fetch(`/api/ai/insights${query}`);
         const insightsData = await insightsResponse.json();
 
         if (insightsData.status === 'success') {
@@ -1125,7 +1134,7 @@ async function loadAIInsights() {
         }
 
         // Загружаем рекомендации
-        const recommendationsResponse = await fetch('/api/ai/recommendations');
+        const recommendationsResponse = await fetch(`/api/ai/recommendations${query}`);
         const recommendationsData = await recommendationsResponse.json();
 
         if (recommendationsData.status === 'success') {
@@ -3,6 +3,8 @@
 import sqlite3
 import random
 from datetime import datetime, timedelta
+from partitions import insert_rows, delete_sensor_rows
+from ingestion import update_sensor_latest
 
 def create_test_data():
     """Создает тестовые данные для демонстрации системы"""
@@ -11,7 +13,10 @@ def create_test_data():
     cursor = conn.cursor()
     
     # Очищаем старые тестовые данные
-    cursor.execute('DELETE FROM visitor_data WHERE sensor_id IN (SELECT id FROM sensors WHERE name LIKE "TEST_%")')
+    cursor.execute('SELECT id FROM sensors WHERE name LIKE "TEST_%"')
+    for (sensor_id,) in cursor.fetchall():
+        delete_sensor_rows(cursor, sensor_id)
+        cursor.execute('DELETE FROM sensor_latest WHERE sensor_id = ?', (sensor_id,))
     cursor.execute('DELETE FROM sensors WHERE name LIKE "TEST_%"')
     
     # Создаем тестовые датчики
@@ -36,33 +41,37 @@ def create_test_data():
     base_time = datetime.now() - timedelta(hours=24)
     
     for sensor_id in sensor_ids:
+        # Устройство присылает накопительный счётчик, который обнуляется в начале дня
+        counter = 0
+        counter_date = None
+        rows = []
         for hour in range(24):
             # Имитируем разную активность в разное время
             if 9 <= hour <= 12 or 14 <= hour <= 18:  # Пиковые часы
-                visitor_count = random.randint(15, 45)
+                visitor_delta = random.randint(15, 45)
             elif 19 <= hour <= 21:  # Вечерние часы
-                visitor_count = random.randint(8, 25)
+                visitor_delta = random.randint(8, 25)
             else:  # Ночные и ранние утренние часы
-                visitor_count = random.randint(0, 10)
+                visitor_delta = random.randint(0, 10)
             
             timestamp = base_time + timedelta(hours=hour, minutes=random.randint(0, 59))
+            if timestamp.date() != counter_date:
+                counter = 0
+                counter_date = timestamp.date()
+            counter += visitor_delta
             
-            cursor.execute('''
-                INSERT INTO visitor_data (sensor_id, visitor_count, timestamp)
-                VALUES (?, ?, ?)
-            ''', (sensor_id, visitor_count, timestamp))
-    
-    # Обновляем счетчики датчиков
-    for sensor_id in sensor_ids:
+            rows.append((sensor_id, counter, visitor_delta, timestamp))
+        
+        # Замеры раскладываются по помесячным секциям visitor_data
+        insert_rows(cursor, rows)
+        update_sensor_latest(cursor, rows[-1:])
+        
+        # Последнее значение счётчика становится текущим показанием датчика
         cursor.execute('''
             UPDATE sensors 
-            SET visitor_count = (
-                SELECT COALESCE(SUM(visitor_count), 0) 
-                FROM visitor_data 
-                WHERE sensor_id = ? AND timestamp > datetime('now', '-1 day')
-            )
+            SET visitor_count = ?, last_counter = ?, last_counter_at = ?
             WHERE id = ?
-        ''', (sensor_id, sensor_id))
+        ''', (counter, counter, str(timestamp), sensor_id))
     
     conn.commit()
     conn.close()
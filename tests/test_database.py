@@ -0,0 +1,69 @@
+"""
+Соединения из пула в блоке with
+Успешный блок фиксирует транзакцию, ошибка откатывает её, в обоих случаях соединение возвращается в пул
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'pool.db')
+    conn = database.connect(path)
+    conn.execute('CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)')
+    conn.commit()
+    conn.close()
+    yield path
+    database.close_pools()
+
+
+def count_items(db_path):
+    conn = database.connect(db_path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_with_commits_and_returns_to_pool(db_path):
+    pool = database.get_pool(db_path)
+    with database.get_db_connection(db_path) as conn:
+        conn.execute("INSERT INTO items (name) VALUES ('a')")
+        assert pool.stats()['in_use'] == 1
+
+    assert count_items(db_path) == 1
+    assert pool.stats()['in_use'] == 0
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1')
+
+
+def test_with_rolls_back_on_error(db_path):
+    pool = database.get_pool(db_path)
+    with pytest.raises(RuntimeError):
+        with database.get_db_connection(db_path) as conn:
+            conn.execute("INSERT INTO items (name) VALUES ('a')")
+            raise RuntimeError('boom')
+
+    assert count_items(db_path) == 0
+    assert pool.stats()['in_use'] == 0
+
+
+def test_db_connection_nested_calls_share_connection(db_path):
+    pool = database.get_pool(db_path)
+    with database.db_connection(db_path) as outer:
+        outer.execute("INSERT INTO items (name) VALUES ('a')")
+        with database.db_connection(db_path) as inner:
+            assert inner is outer
+            inner.execute("INSERT INTO items (name) VALUES ('b')")
+        assert count_items(db_path) == 0
+
+    assert count_items(db_path) == 2
+    assert pool.stats()['in_use'] == 0
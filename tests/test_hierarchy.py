@@ -0,0 +1,118 @@
+"""
+Поддержка таблицы замыкания иерархии пользователей
+После каждого изменения замыкание должно совпадать с пересчитанным с нуля по user_hierarchy
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hierarchy import (CLOSURE_TABLE, add_edge, ancestors_of, descendants_of, rebuild_closure, remove_edge,
+                       remove_user)
+
+
+@pytest.fixture
+def cursor(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'hierarchy.db'))
+    conn.execute('''
+        CREATE TABLE user_hierarchy (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            parent_id INTEGER NOT NULL,
+            child_id INTEGER NOT NULL,
+            UNIQUE(parent_id, child_id)
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TABLE {CLOSURE_TABLE} (
+            ancestor_id INTEGER NOT NULL,
+            descendant_id INTEGER NOT NULL,
+            depth INTEGER NOT NULL,
+            PRIMARY KEY (ancestor_id, descendant_id)
+        ) WITHOUT ROWID
+    ''')
+    yield conn.cursor()
+    conn.close()
+
+
+def link(cursor, parent_id, child_id):
+    """Связь так, как её добавляет обработчик: запись в user_hierarchy, затем add_edge"""
+    cursor.execute('INSERT INTO user_hierarchy (parent_id, child_id) VALUES (?, ?)', (parent_id, child_id))
+    add_edge(cursor, parent_id, child_id)
+
+
+def closure(cursor):
+    cursor.execute(f'SELECT ancestor_id, descendant_id, depth FROM {CLOSURE_TABLE} ORDER BY 1, 2')
+    return cursor.fetchall()
+
+
+def rebuilt(cursor):
+    """Замыкание, пересчитанное с нуля; текущее содержимое таблицы не меняется"""
+    cursor.execute('SAVEPOINT rebuild')
+    rebuild_closure(cursor)
+    result = closure(cursor)
+    cursor.execute('ROLLBACK TO rebuild')
+    cursor.execute('RELEASE rebuild')
+    return result
+
+
+def test_add_edge_matches_rebuild(cursor):
+    # 1 → 2 → 3, 1 → 4 → 3: до 3 два пути, хранится кратчайший
+    for parent_id, child_id in [(2, 3), (1, 2), (4, 3), (1, 4), (3, 5)]:
+        link(cursor, parent_id, child_id)
+        assert closure(cursor) == rebuilt(cursor)
+
+    assert sorted(descendants_of(cursor, 1)) == [2, 3, 4, 5]
+    assert sorted(ancestors_of(cursor, 5)) == [1, 2, 3, 4]
+    assert (1, 3, 2) in closure(cursor)
+    assert (1, 5, 3) in closure(cursor)
+
+
+def test_add_edge_keeps_shortest_depth(cursor):
+    for parent_id, child_id in [(1, 2), (2, 3), (3, 4)]:
+        link(cursor, parent_id, child_id)
+    assert (1, 4, 3) in closure(cursor)
+
+    link(cursor, 1, 4)
+    assert (1, 4, 1) in closure(cursor)
+    assert closure(cursor) == rebuilt(cursor)
+
+
+def test_remove_edge_keeps_other_paths(cursor):
+    for parent_id, child_id in [(1, 2), (2, 3), (1, 4), (4, 3), (3, 5)]:
+        link(cursor, parent_id, child_id)
+
+    remove_edge(cursor, 2, 3)
+    assert closure(cursor) == rebuilt(cursor)
+    # До 3 и 5 остался путь через 4
+    assert sorted(descendants_of(cursor, 1)) == [2, 3, 4, 5]
+    assert descendants_of(cursor, 2) == []
+
+    remove_edge(cursor, 4, 3)
+    assert closure(cursor) == rebuilt(cursor)
+    assert sorted(descendants_of(cursor, 1)) == [2, 4]
+    assert ancestors_of(cursor, 5) == [3]
+
+
+def test_remove_user(cursor):
+    for parent_id, child_id in [(1, 2), (2, 3), (3, 4)]:
+        link(cursor, parent_id, child_id)
+
+    remove_user(cursor, 2)
+    assert closure(cursor) == rebuilt(cursor)
+    assert descendants_of(cursor, 1) == []
+    assert ancestors_of(cursor, 4) == [3]
+
+
+@pytest.mark.parametrize('parent_id, child_id', [(3, 1), (2, 1), (3, 3)])
+def test_add_edge_rejects_cycles(cursor, parent_id, child_id):
+    for edge in [(1, 2), (2, 3)]:
+        link(cursor, *edge)
+    before = closure(cursor)
+
+    with pytest.raises(ValueError):
+        add_edge(cursor, parent_id, child_id)
+    assert closure(cursor) == before
@@ -0,0 +1,133 @@
+"""
+Приём замеров: приращения по накопительному счётчику и запись пакетов буфером
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingestion
+from ingestion import IngestionBuffer, decode_delta
+
+
+def decode_all(samples):
+    """Приращения для последовательности замеров одного датчика в порядке поступления"""
+    previous = None
+    deltas = []
+    for count, timestamp in samples:
+        delta, is_latest = decode_delta(count, timestamp, previous)
+        if is_latest:
+            previous = (count, timestamp)
+        deltas.append(delta)
+    return deltas
+
+
+def test_first_sample_counts_from_zero():
+    assert decode_delta(7, '2026-10-01 09:00:00', None) == (7, True)
+
+
+def test_delta_within_day():
+    assert decode_all([(3, '2026-10-01 09:00:00'), (5, '2026-10-01 09:05:00'),
+                       (5, '2026-10-01 09:10:00'), (12, '2026-10-01 09:15:00')]) == [3, 2, 0, 7]
+
+
+def test_day_rollover_starts_from_new_counter():
+    # Счётчик обнулился в полночь: 4 — посетители нового дня, а не 4 - 120
+    assert decode_all([(120, '2026-10-01 23:55:00'), (4, '2026-10-02 00:05:00'),
+                       (9, '2026-10-02 00:10:00')]) == [120, 4, 5]
+    # Даже если новый день начался с большего значения, чем вчерашнее
+    assert decode_delta(150, '2026-10-02 08:00:00', (120, '2026-10-01 23:55:00')) == (150, True)
+
+
+def test_counter_reset_within_day():
+    assert decode_all([(40, '2026-10-01 12:00:00'), (2, '2026-10-01 12:05:00'),
+                       (6, '2026-10-01 12:10:00')]) == [40, 2, 4]
+
+
+def test_late_sample_is_not_counted_twice():
+    previous = (30, '2026-10-01 12:10:00')
+    assert decode_delta(25, '2026-10-01 12:05:00', previous) == (0, False)
+    # Следующий замер считается от последнего значения, а не от запоздавшего
+    assert decode_all([(20, '2026-10-01 12:00:00'), (30, '2026-10-01 12:10:00'),
+                       (25, '2026-10-01 12:05:00'), (34, '2026-10-01 12:15:00')]) == [20, 10, 0, 4]
+
+
+def test_same_timestamp_is_latest():
+    assert decode_delta(12, '2026-10-01 12:00:00', (10, '2026-10-01 12:00:00')) == (2, True)
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    monkeypatch.setattr(ingestion, 'FLUSH_RETRY_DELAY', 0)
+    return IngestionBuffer(':memory:')
+
+
+def failing_writer(errors):
+    """write_samples, который сначала выбрасывает ошибки из errors, а затем пишет пакет"""
+    calls = []
+
+    def write(conn, batch):
+        calls.append(len(batch))
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+    return write, calls
+
+
+def test_flush_retries_busy_database(buffer, monkeypatch):
+    write, calls = failing_writer([sqlite3.OperationalError('database is locked')] * 2)
+    monkeypatch.setattr(ingestion, 'write_samples', write)
+
+    buffer._flush(None, [{}, {}])
+
+    stats = buffer.stats()
+    assert len(calls) == 3
+    assert stats['retries'] == 2
+    assert stats['written'] == 2
+    assert stats['failed'] == 0
+
+
+def test_flush_gives_up_after_retries(buffer, monkeypatch):
+    write, calls = failing_writer([sqlite3.OperationalError('database is locked')] * 100)
+    monkeypatch.setattr(ingestion, 'write_samples', write)
+
+    buffer._flush(None, [{}, {}, {}])
+
+    stats = buffer.stats()
+    assert len(calls) == ingestion.FLUSH_RETRIES + 1
+    assert stats['failed'] == 3
+    assert stats['queue_depth'] == 0
+
+
+@pytest.mark.parametrize('message', ['no such table: visitor_data', 'disk I/O error', 'database or disk is full'])
+def test_flush_does_not_retry_permanent_errors(buffer, monkeypatch, message):
+    write, calls = failing_writer([sqlite3.OperationalError(message)])
+    monkeypatch.setattr(ingestion, 'write_samples', write)
+
+    buffer._flush(None, [{}])
+
+    stats = buffer.stats()
+    assert len(calls) == 1
+    assert stats['retries'] == 0
+    assert stats['failed'] == 1
+    assert stats['queue_depth'] == 0
+
+
+def test_busy_error_detection(tmp_path):
+    path = str(tmp_path / 'busy.db')
+    holder = sqlite3.connect(path)
+    holder.execute('CREATE TABLE t (x)')
+    holder.execute('BEGIN IMMEDIATE')
+    other = sqlite3.connect(path, timeout=0)
+    try:
+        with pytest.raises(sqlite3.OperationalError) as error:
+            other.execute('BEGIN IMMEDIATE')
+        assert ingestion.is_busy_error(error.value)
+        assert not ingestion.is_busy_error(sqlite3.OperationalError('no such table: t'))
+    finally:
+        other.close()
+        holder.rollback()
+        holder.close()
@@ -0,0 +1,74 @@
+"""
+Keyset-пагинация: страницы по курсору совпадают с полным списком, в том числе при NULL
+в колонке сортировки, а следующая страница читается поиском по индексу
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pagination import Paginator
+
+SOURCE = 'SELECT m.id, m.name, m.taken_at FROM measurements m'
+PAGES = Paginator('measurements', {'id': 'm.id', 'name': 'm.name', 'taken_at': 'm.taken_at'}, 'taken_at',
+                  filters={'name': ('m.name', '=')}, key='m.id')
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE measurements (id INTEGER PRIMARY KEY, name TEXT, taken_at TEXT)')
+    conn.execute('CREATE INDEX idx_measurements_taken_at ON measurements (taken_at)')
+    conn.executemany('INSERT INTO measurements (name, taken_at) VALUES (?, ?)', [
+        (f'sensor-{i % 3}', None if i % 7 == 0 else f'2025-01-{i % 5 + 1:02d}')
+        for i in range(1, 60)
+    ])
+    yield conn
+    conn.close()
+
+
+def walk(conn, args, limit, params=(), where=None):
+    items, cursor = [], None
+    while True:
+        page_args = dict(args, limit=str(limit))
+        if cursor:
+            page_args['cursor'] = cursor
+        page = PAGES.fetch(conn.cursor(), SOURCE, params, page_args, where)
+        items += page['items']
+        cursor = page['next_cursor']
+        if cursor is None:
+            return items
+
+
+@pytest.mark.parametrize('sort', ['taken_at', '-taken_at', 'id', '-id', 'name'])
+@pytest.mark.parametrize('limit', [1, 4, 100])
+def test_pages_match_full_list(conn, sort, limit):
+    full = PAGES.fetch(conn.cursor(), SOURCE, (), {'sort': sort})
+    assert [item['id'] for item in walk(conn, {'sort': sort}, limit)] == [item['id'] for item in full]
+
+
+def test_pages_with_filter_and_own_condition(conn):
+    args = {'sort': '-taken_at', 'name': 'sensor-1'}
+    full = PAGES.fetch(conn.cursor(), SOURCE, (5,), args, 'm.id > ?')
+    paged = walk(conn, args, 3, (5,), 'm.id > ?')
+    assert [item['id'] for item in paged] == [item['id'] for item in full]
+    assert all(item['id'] > 5 and item['name'] == 'sensor-1' for item in paged)
+
+
+@pytest.mark.parametrize('sort', ['taken_at', '-taken_at'])
+def test_next_page_seeks_by_index(conn, sort):
+    first = PAGES.fetch(conn.cursor(), SOURCE, (), {'sort': sort, 'limit': '20'})
+    query = PAGES.prepare(SOURCE, (), {'sort': sort, 'limit': '20', 'cursor': first['next_cursor']})
+    plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query['sql']}", query['params'])]
+    assert any('SEARCH m USING INDEX idx_measurements_taken_at (taken_at' in detail for detail in plan), plan
+    assert not any(detail.startswith('SCAN m') for detail in plan), plan
+
+
+def test_foreign_cursor_is_rejected(conn):
+    first = PAGES.fetch(conn.cursor(), SOURCE, (), {'sort': 'taken_at', 'limit': '5'})
+    with pytest.raises(ValueError):
+        PAGES.prepare(SOURCE, (), {'sort': '-taken_at', 'cursor': first['next_cursor']})
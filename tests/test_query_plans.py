@@ -0,0 +1,40 @@
+"""
+Планы запросов приложения на схеме, собранной с нуля
+Каждый запрос из migrations.QUERY_PLAN_CHECKS должен использовать свой индекс, а не полный просмотр
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from migrations import QUERY_PLAN_CHECKS, check_query_plans
+
+
+@pytest.fixture
+def schema_db(tmp_path, monkeypatch):
+    """Временная база со схемой init_db и всеми миграциями"""
+    db_path = str(tmp_path / 'visitor_data.db')
+    monkeypatch.setattr(database, 'DB_PATH', db_path)
+    import server
+    server.init_db()
+    database.close_pools()
+
+    conn = database.connect(db_path)
+    yield conn
+    conn.close()
+
+
+def test_query_plans_use_indexes(schema_db):
+    failures = check_query_plans(schema_db)
+    assert failures == [], '\n'.join(f"{failure['query']}: {failure['plan']}" for failure in failures)
+
+
+@pytest.mark.parametrize('sql, params', [(sql, params) for sql, params, _ in QUERY_PLAN_CHECKS])
+def test_query_plans_have_no_full_scans(schema_db, sql, params):
+    plan = [row[3] for row in schema_db.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()]
+    scans = [detail for detail in plan if detail.startswith('SCAN ')]
+    assert scans == [], f'{sql}: {plan}'
@@ -0,0 +1,81 @@
+"""
+Пакетная загрузка пользователей BELWEST
+Пользователи и назначенные им датчики читаются постоянным числом запросов и группируются в памяти
+"""
+
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+# Колонки таблицы users, доступные в ответе, и вычисляемые поля
+USER_COLUMNS = ['id', 'username', 'email', 'role', 'created_at']
+USER_FIELDS = USER_COLUMNS + ['sensors']
+
+# Число id в одном IN (...) — меньше предела параметров старых сборок SQLite
+ID_BATCH_SIZE = 500
+
+
+def parse_fields(raw: Optional[str]) -> List[str]:
+    """
+    Список полей из параметра fields=id,username,role
+
+    Raises:
+        ValueError: если запрошено неизвестное поле
+    """
+    if not raw:
+        return list(USER_FIELDS)
+
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in USER_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+
+def load_users(cursor: sqlite3.Cursor, sql: str, params: Tuple = (),
+               fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Пользователи из запроса sql вместе с их датчиками
+
+    Датчики читаются одним запросом на всю выборку, а не отдельным запросом на каждого пользователя.
+
+    Args:
+        cursor: Курсор базы данных
+        sql: SELECT, возвращающий колонки USER_COLUMNS (страница списка или вся выборка)
+        params: Параметры sql
+        fields: Поля ответа (None — все USER_FIELDS)
+
+    Returns:
+        Пользователи в порядке sql со всеми колонками и, если запрошены, датчиками
+    """
+    fields = fields or list(USER_FIELDS)
+
+    cursor.execute(sql, params)
+    columns = [description[0] for description in cursor.description]
+    users = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    if 'sensors' in fields and users:
+        # Датчики читаются по уже полученным id, а не повторным выполнением sql
+        by_user = {user['id']: [] for user in users}
+        user_ids = list(by_user)
+        for start in range(0, len(user_ids), ID_BATCH_SIZE):
+            batch = user_ids[start:start + ID_BATCH_SIZE]
+            cursor.execute(f'''
+                SELECT us.user_id, s.id, s.name
+                FROM user_sensors us
+                JOIN sensors s ON s.id = us.sensor_id
+                WHERE us.user_id IN ({', '.join('?' * len(batch))})
+                ORDER BY us.user_id, s.id
+            ''', batch)
+            for user_id, sensor_id, name in cursor.fetchall():
+                by_user[user_id].append({'id': sensor_id, 'name': name})
+        for user in users:
+            user['sensors'] = by_user[user['id']]
+
+    return users
+
+
+def project(users: List[Dict[str, Any]], fields: List[str]) -> List[Dict[str, Any]]:
+    """Только запрошенные поля каждого пользователя"""
+    return [{field: user[field] for field in fields} for user in users]